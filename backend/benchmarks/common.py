@@ -0,0 +1,79 @@
+import json
+import logging
+import platform
+import sys
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+
+# The benchmarks import the backend packages the same way the app does
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+logger = logging.getLogger()
+
+def summarize_latencies(latencies_ns: list[int] | np.ndarray) -> dict[str, float]:
+    """
+    Summarize latencies measured in nanoseconds.
+    Returns:
+        The number of calls and the mean, min, p50, p90, p99 and max latencies in microseconds.
+    """
+    latencies_us = np.asarray(latencies_ns, dtype=np.float64) / 1_000
+
+    if len(latencies_us) == 0:
+        return {"count": 0}
+
+    p50, p90, p99 = np.percentile(latencies_us, [50, 90, 99])
+    return {
+        "count": len(latencies_us),
+        "mean_us": float(latencies_us.mean()),
+        "min_us": float(latencies_us.min()),
+        "p50_us": float(p50),
+        "p90_us": float(p90),
+        "p99_us": float(p99),
+        "max_us": float(latencies_us.max()),
+    }
+
+def measure(func: Callable[[int], object], repeat: int, warmup: int = 3) -> dict[str, float]:
+    """
+    Measure the latency of a function call.
+    Args:
+        func: The function to measure, called with the index of the call.
+        repeat: The number of measured calls.
+        warmup: The number of calls before measuring.
+    Returns:
+        The latency summary, see `summarize_latencies`.
+    """
+    for i in range(warmup):
+        func(i)
+
+    latencies_ns = np.empty(repeat, dtype=np.int64)
+
+    for i in range(repeat):
+        started_at = time.perf_counter_ns()
+        func(warmup + i)
+        latencies_ns[i] = time.perf_counter_ns() - started_at
+
+    return summarize_latencies(latencies_ns)
+
+def write_results(results: dict, output_path: str | None) -> None:
+    """
+    Write the benchmark results as JSON together with the environment details, or log them if no path is given.
+    """
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        **results,
+    }
+    text = json.dumps(report, indent=2)
+
+    if output_path is None:
+        logger.info(text)
+        return
+
+    Path(output_path).write_text(text)
+    logger.info(f"Results written to {output_path}")
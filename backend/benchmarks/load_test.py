@@ -0,0 +1,134 @@
+import argparse
+import asyncio
+import logging
+import random
+import time
+import httpx
+from common import summarize_latencies, write_results
+from synthetic_data import generate_players
+from matchmaking import get_player_store
+
+SCENARIOS = ["predict", "pair", "queue", "players", "mixed"]
+"""Request mixes a client can send, `mixed` picks one of the others for every request"""
+
+logger = logging.getLogger()
+
+async def send_request(client: httpx.AsyncClient, scenario: str, profile_ids: list[int]) -> bool:
+    """
+    Send one request of a scenario.
+    Returns:
+        True if the API reported success.
+    """
+    if scenario == "mixed":
+        scenario = random.choice(SCENARIOS[:-1])
+
+    match scenario:
+        case "predict":
+            player_1, player_2 = random.sample(profile_ids, 2)
+            response = await client.post("/api/matchmaking/predict", json={"player1": player_1, "player2": player_2})
+        case "pair":
+            player_id = random.choice(profile_ids)
+            await client.post("/api/matchmaking/queue", json={"playerId": player_id})
+            response = await client.post("/api/matchmaking/pair", json={"playerId": player_id})
+        case "queue":
+            player_id = random.choice(profile_ids)
+            await client.post("/api/matchmaking/queue/remove", json={"playerId": player_id})
+            response = await client.post("/api/matchmaking/queue", json={"playerId": player_id})
+        case "players":
+            params = {"page": random.randint(1, 100), "pageSize": 25, "orderBy": "-rating"}
+            response = await client.get("/api/players/", params=params)
+        case _:
+            raise ValueError(f"Unknown scenario '{scenario}'")
+
+    return response.status_code == 200 and response.json().get("success", False)
+
+async def run_client(client: httpx.AsyncClient, scenario: str, profile_ids: list[int], deadline: float, latencies_ns: list[int]) -> int:
+    """
+    Send requests one after another until the deadline.
+    Returns:
+        The number of failed requests.
+    """
+    failures = 0
+
+    while time.perf_counter() < deadline:
+        started_at = time.perf_counter_ns()
+
+        try:
+            is_success = await send_request(client, scenario, profile_ids)
+        except httpx.HTTPError:
+            is_success = False
+
+        latencies_ns.append(time.perf_counter_ns() - started_at)
+        failures += not is_success
+
+    return failures
+
+async def run_load_test(scenario: str, clients: int, duration: float, profile_ids: list[int]) -> dict:
+    """
+    Drive the FastAPI app in-process with concurrent clients.
+    Args:
+        scenario: The request mix, one of `SCENARIOS`.
+        clients: The number of concurrent clients.
+        duration: Seconds to send requests for.
+        profile_ids: The profile IDs of the players used in the requests.
+    Returns:
+        The latency summary with the throughput and the number of failed requests.
+    """
+    from main import app
+    from routers import matchmaking_lifespan
+
+    transport = httpx.ASGITransport(app=app)
+    latencies_ns: list[int] = []
+
+    async with matchmaking_lifespan(app), httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        started_at = time.perf_counter()
+        deadline = started_at + duration
+        failures = await asyncio.gather(*(
+            run_client(client, scenario, profile_ids, deadline, latencies_ns)
+            for _ in range(clients)
+        ))
+        elapsed = time.perf_counter() - started_at
+
+    return {
+        **summarize_latencies(latencies_ns),
+        "throughput_rps": len(latencies_ns) / elapsed,
+        "failures": sum(failures),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the API in-process with concurrent clients")
+    parser.add_argument("--players", type=int, default=100_000, help="Number of synthetic players")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS, help="Request mixes to run")
+    parser.add_argument("--clients", type=int, default=32, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run every scenario for")
+    parser.add_argument("--output", help="Path of the JSON results, logged if omitted")
+    args = parser.parse_args()
+
+    # The app loads the shared store on import, so it has to hold the synthetic players first
+    store = get_player_store()
+    store.load_dataframe(generate_players(args.players))
+    profile_ids = store.profile_ids.tolist()
+    results = {
+        "benchmark": "load_test",
+        "players": args.players,
+        "clients": args.clients,
+        "duration": args.duration,
+        "scenarios": {},
+    }
+
+    for scenario in args.scenarios:
+        logger.info(f"Running scenario '{scenario}' with {args.clients} clients for {args.duration}s...")
+        # Per-request info logs of the matchmaker would dominate the measured latencies
+        logging.disable(logging.INFO)
+
+        try:
+            results["scenarios"][scenario] = asyncio.run(run_load_test(scenario, args.clients, args.duration, profile_ids))
+        finally:
+            logging.disable(logging.NOTSET)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import logging
+import time
+import numpy as np
+from common import measure, write_results
+from synthetic_data import generate_players
+from core import PagedQuery, settings
+from matchmaking import Matchmaker, PlayerStore
+from services import PlayerService
+
+logger = logging.getLogger()
+
+def run_benchmarks(players_count: int, repeat: int, pair_repeat: int, batch_size: int) -> dict[str, dict]:
+    """
+    Run all the benchmarks on a fresh store of synthetic players.
+    Args:
+        players_count: The number of synthetic players.
+        repeat: The number of measured calls of the fast operations.
+        pair_repeat: The number of measured calls of `find_match_for_player`, which scores a whole cluster.
+        batch_size: The number of pairs scored by the batch prediction.
+    Returns:
+        The latency summary of every benchmark by name.
+    """
+    rng = np.random.default_rng(1)
+    results: dict[str, dict] = {}
+
+    started_at = time.perf_counter()
+    store = PlayerStore()
+    store.load_dataframe(generate_players(players_count))
+    matchmaker = Matchmaker(player_store=store)
+    matchmaker.load_models()
+    results["setup"] = {"seconds": time.perf_counter() - started_at}
+
+    profile_ids = store.profile_ids
+    pairs = rng.integers(players_count, size=(repeat + 3, 2))
+
+    results["match_features"] = measure(lambda i: matchmaker._get_match_features(*pairs[i]), repeat)
+    results["predict"] = measure(lambda i: matchmaker.predict_match_outcome(int(profile_ids[pairs[i, 0]]), int(profile_ids[pairs[i, 1]])), repeat)
+    results["predict_cached"] = measure(lambda i: matchmaker.predict_match_outcome(int(profile_ids[0]), int(profile_ids[1])), repeat)
+
+    rows_A = rng.integers(players_count, size=batch_size)
+    rows_B = rng.integers(players_count, size=batch_size)
+    results[f"predict_batch_{batch_size}"] = measure(lambda i: matchmaker.predict_match_outcomes_by_rows(rows_A, rows_B), max(1, repeat // 100))
+
+    queued_ids = rng.choice(profile_ids, size=repeat + 3, replace=False).tolist()
+    results["queue_remove"] = measure(lambda i: matchmaker.remove_player_from_queue(queued_ids[i]), repeat)
+    results["queue_add"] = measure(lambda i: matchmaker.add_player_to_queue(queued_ids[i]), repeat)
+
+    pair_ids = rng.choice(profile_ids, size=pair_repeat + 3, replace=False).tolist()
+    results["pair"] = measure(lambda i: matchmaker.find_match_for_player(pair_ids[i]), pair_repeat)
+
+    player_service = PlayerService(store)
+    pages = rng.integers(1, max(2, players_count // 25), size=repeat + 3)
+    started_at = time.perf_counter()
+    player_service.get_players(PagedQuery(page=1, page_size=25, order_by="-rating", filter="player12"))
+    results["players_index_build"] = {"seconds": time.perf_counter() - started_at}
+    results["players_page"] = measure(lambda i: player_service.get_players(PagedQuery(page=int(pages[i]), page_size=25)), repeat)
+    results["players_page_ordered"] = measure(lambda i: player_service.get_players(PagedQuery(page=int(pages[i]), page_size=25, order_by="-rating")), repeat)
+    results["players_page_filtered"] = measure(lambda i: player_service.get_players(PagedQuery(page=1, page_size=25, order_by="name", filter=f"player{pages[i]}")), repeat)
+    results["player_by_id"] = measure(lambda i: player_service.get_player(queued_ids[i]), repeat)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the latency of the matchmaking and players operations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Numbers of synthetic players")
+    parser.add_argument("--repeat", type=int, default=1000, help="Measured calls of the fast operations")
+    parser.add_argument("--pair-repeat", type=int, default=50, help="Measured calls of the pairing")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Pairs scored by the batch prediction")
+    parser.add_argument("--output", help="Path of the JSON results, logged if omitted")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "micro",
+        "inference_backend": settings.inference_backend,
+        "sizes": {},
+    }
+
+    for players_count in args.sizes:
+        logger.info(f"Benchmarking {players_count} players...")
+        # Per-call info logs of the matchmaker would dominate the measured latencies
+        logging.disable(logging.INFO)
+
+        try:
+            results["sizes"][str(players_count)] = run_benchmarks(players_count, args.repeat, args.pair_repeat, args.batch_size)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+RANK_LEVELS = [
+    ("Bronze 1", 0), ("Bronze 2", 400), ("Bronze 3", 450),
+    ("Silver 1", 500), ("Silver 2", 600), ("Silver 3", 650),
+    ("Gold 1", 700), ("Gold 2", 800), ("Gold 3", 900),
+    ("Platinum 1", 1000), ("Platinum 2", 1100), ("Platinum 3", 1150),
+    ("Diamond 1", 1200), ("Diamond 2", 1300), ("Diamond 3", 1350),
+    ("Conqueror 1", 1400), ("Conqueror 2", 1500), ("Conqueror 3", 1600),
+]
+"""Rank levels with their minimum ratings, the same mapping as in the BuildModel notebook"""
+
+CIVILIZATIONS = [
+    "english", "french", "holy_roman_empire", "rus", "mongols", "chinese", "delhi_sultanate", "abbasid_dynasty",
+    "ottomans", "malians", "byzantines", "japanese", "ayyubids", "jeanne_darc", "order_of_the_dragon", "zhu_xis_legacy",
+]
+COUNTRIES = ["us", "de", "fr", "gb", "ru", "by", "rs", "cn", "kr", "br", "pl", "ca", "es", "it", "ua"]
+CLUSTERS_COUNT = 25
+
+logger = logging.getLogger()
+
+def generate_players(players_count: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate synthetic players data with the same columns and value ranges as `clustered_players.csv`.
+    Args:
+        players_count: The number of players.
+        seed: The seed of the random generator, the same seed gives the same data.
+    Returns:
+        The players data, ordered by rating like the leaderboard.
+    """
+    rng = np.random.default_rng(seed)
+    rating = np.sort(rng.normal(1000, 300, players_count).clip(0, 2300).round())[::-1]
+    games_count = rng.integers(1, 3000, players_count)
+    win_rate = rng.beta(20, 20, players_count)
+    wins_count = np.round(games_count * win_rate).astype(np.int64)
+    avg_mmr = rating + rng.normal(0, 40, players_count)
+    thresholds = np.array([threshold for _, threshold in RANK_LEVELS])
+    rank_level_encoded = np.searchsorted(thresholds, rating, side="right") - 1
+    input_type_encoded = (rng.random(players_count) < 0.05).astype(np.int64)
+
+    players_df = pd.DataFrame({
+        "rank": np.arange(1, players_count + 1),
+        "name": [f"Player{i}" for i in range(players_count)],
+        "profile_id": rng.choice(100 * players_count, players_count, replace=False) + 1,
+        "rating": rating,
+        "games_count": games_count,
+        "wins_count": wins_count,
+        "last_game_at": "2024-12-03 20:39:41 UTC",
+        "rank_level": np.array([name for name, _ in RANK_LEVELS])[rank_level_encoded],
+        "country": rng.choice(COUNTRIES, players_count),
+        "rank_level_encoded": rank_level_encoded,
+    })
+
+    for window, scale in ((10, 12), (25, 9), (50, 7), (75, 6), (100, 5)):
+        players_df[f"avg_mmr_diff_{window}"] = rng.normal(0, scale, players_count)
+
+    players_df["avg_mmr"] = avg_mmr
+    players_df["avg_opp_mmr"] = avg_mmr + rng.normal(0, 25, players_count)
+    players_df["avg_game_length"] = rng.uniform(600, 2400, players_count)
+    players_df["common_civ"] = rng.choice(CIVILIZATIONS, players_count)
+    players_df["input_type"] = np.where(input_type_encoded == 1, "controller", "keyboard")
+    players_df["input_type_encoded"] = input_type_encoded
+    players_df["win_rate"] = wins_count / games_count
+    players_df["cluster"] = rng.integers(0, CLUSTERS_COUNT, players_count)
+    return players_df
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic clustered_players.csv")
+    parser.add_argument("--players", type=int, default=100_000, help="Number of players")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator")
+    parser.add_argument("--output", default="clustered_players.csv", help="Path of the CSV file to write")
+    args = parser.parse_args()
+
+    generate_players(args.players, args.seed).to_csv(args.output, index=False)
+    logger.info(f"{args.players} players written to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
@@ -3,3 +3,6 @@ from .result import *
 from .base_model import *
 from .paged_result import *
 from .paged_query import *
+from .settings import *
+from .metrics import *
+from .result_json import *
@@ -0,0 +1,188 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Default upper bounds of the histogram buckets in seconds, from 10 µs to 10 s"""
+
+class Metric(ABC):
+    """
+    Base class of the metrics. A metric holds one value per combination of its label values.
+    """
+    type: str
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def render(self) -> Iterator[str]:
+        """
+        Render the metric in the Prometheus text exposition format.
+        """
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._render_samples()
+
+    @abstractmethod
+    def _render_samples(self) -> Iterator[str]:
+        """
+        Render the samples of the metric, one line per sample.
+        """
+
+    def _format_labels(self, label_values: tuple[str, ...], extra: str = "") -> str:
+        labels = [f'{name}="{value}"' for name, value in zip(self.label_names, label_values)]
+
+        if extra:
+            labels.append(extra)
+
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, e.g. the number of formed matches.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help, label_names)
+        self._values: dict[tuple[str, ...], float] = {} if label_names else {(): 0.0}
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        """
+        Increase the counter.
+        Args:
+            amount: The amount to add.
+            label_values: The values of the labels in `label_names` order.
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def _render_samples(self) -> Iterator[str]:
+        for label_values, value in list(self._values.items()):
+            yield f"{self.name}{self._format_labels(label_values)} {value}"
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down. Either set explicitly or read from a callback on every scrape.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], float] | None = None) -> None:
+        super().__init__(name, help)
+        self.callback = callback
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = value
+
+    def get(self) -> float:
+        return float(self.callback()) if self.callback is not None else self._value
+
+    def _render_samples(self) -> Iterator[str]:
+        yield f"{self.name} {self.get()}"
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values counted in cumulative buckets, e.g. the latency of an operation in seconds.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+        self._counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """
+        Record an observed value.
+        Args:
+            value: The observed value.
+            label_values: The values of the labels in `label_names` order.
+        """
+        bucket = bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._counts.get(label_values)
+
+            if counts is None:
+                counts = self._counts[label_values] = [0] * (len(self.buckets) + 1)
+                self._sums[label_values] = 0.0
+
+            counts[bucket] += 1
+            self._sums[label_values] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """
+        Observe the duration of the `with` block in seconds.
+        """
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, *label_values)
+
+    def _render_samples(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = [(label_values, list(counts), self._sums[label_values]) for label_values, counts in self._counts.items()]
+
+        for label_values, counts, total in snapshot:
+            cumulative = 0
+
+            for upper_bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = self._format_labels(label_values, f'le="{upper_bound}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+
+            yield f"{self.name}_sum{self._format_labels(label_values)} {total}"
+            yield f"{self.name}_count{self._format_labels(label_values)} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Collection of the application metrics rendered by the `/metrics` endpoint.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        """
+        Register a counter, replacing a metric with the same name.
+        """
+        counter = self._metrics[name] = Counter(name, help, label_names)
+        return counter
+
+    def gauge(self, name: str, help: str, callback: Callable[[], float] | None = None) -> Gauge:
+        """
+        Register a gauge, replacing a metric with the same name.
+        """
+        gauge = self._metrics[name] = Gauge(name, help, callback)
+        return gauge
+
+    def histogram(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        Register a histogram, replacing a metric with the same name.
+        """
+        histogram = self._metrics[name] = Histogram(name, help, label_names, buckets)
+        return histogram
+
+    def render(self) -> str:
+        """
+        Render all the metrics in the Prometheus text exposition format.
+        """
+        return "".join(f"{line}\n" for metric in list(self._metrics.values()) for line in metric.render())
+
+
+metrics_registry = MetricsRegistry()
+"""Metrics of the running application"""
@@ -0,0 +1,27 @@
+from fastapi import Response
+from .result import Result
+
+class RawJSONResponse(Response):
+    """
+    Response with already serialized JSON, returned as is without the validation
+    and the serialization of the endpoint's response model.
+    """
+    media_type = "application/json"
+
+
+def encode_result_json(result: Result, data_json: str | None = None) -> str:
+    """
+    Serialize a result to JSON the same way the API responses are serialized (camelCase keys),
+    with the `data` payload passed as already encoded JSON.
+    Lets the endpoints returning many cached items skip validating and serializing them again.
+    Args:
+        result: The result without its payload.
+        data_json: The encoded JSON of the payload, the payload of the result is serialized if None.
+    Returns:
+        The JSON of the result.
+    """
+    if data_json is None:
+        return result.model_dump_json(by_alias=True)
+
+    result_json = result.model_dump_json(by_alias=True, exclude={"data"})
+    return result_json[:-1] + ',"data":' + data_json + "}"
@@ -0,0 +1,83 @@
+import os
+from .base_model import PydanticBaseModel
+
+class Settings(PydanticBaseModel):
+    """
+    Application settings. Every field can be overridden by an environment variable
+    named after the field in upper case with the `MATCHMAKING_` prefix,
+    e.g. `MATCHMAKING_BATCH_INTERVAL=0.25`.
+    """
+
+    batch_enabled: bool = False
+    """Run the background batch matchmaking that pairs the whole queue on every tick"""
+
+    batch_interval: float = 0.5
+    """Seconds between two batch matchmaking ticks"""
+
+    notify_interval: float = 0.25
+    """Seconds between two refreshes of the queue status pushed to the players subscribed to their notifications"""
+
+    debug_log_sample_rate: float = 0.01
+    """Fraction of the per-request matchmaking debug messages that are logged"""
+
+    games_watch_dir: str | None = None
+    """Directory polled for files of finished games to apply to the players data, disabled if not set"""
+
+    games_watch_interval: float = 1.0
+    """Seconds between two polls of the finished games directory"""
+
+    elo_window: float = 100
+    """Initial maximum rating difference of the ELO fallback matchmaking"""
+
+    elo_window_growth: float = 5
+    """Rating points the ELO fallback window widens by per second the player has been waiting"""
+
+    inference_backend: str = "inplace"
+    """Backend evaluating the classifier: `sklearn`, `inplace`, `numpy` or `treelite`"""
+
+    predict_batch_max_pairs: int = 250_000
+    """Maximum number of pairs scored by one batch prediction request"""
+
+    prediction_cache_symmetric: bool = False
+    """Serve P(B wins against A) from the cached 1 - P(A wins against B), only for a classifier calibrated to be symmetric"""
+
+    candidate_limit: int = 256
+    """Maximum number of queued opponents scored for one player, the most similar by features are kept; 0 scores them all"""
+
+    candidate_index_max_age: float = 1.0
+    """Seconds after which the candidate index of a queue shared by worker processes is rebuilt to see their changes"""
+
+    team_pool_size: int = 200
+    """Number of queued players with the closest ratings a team match is formed from"""
+
+    team_splits_per_group: int = 8
+    """Number of the most rating-balanced team splits of every group of players scored by the classifier"""
+
+    queue_backend: str = "memory"
+    """Store of the matchmaking queue: `memory` for a single process, `sqlite` to share it between worker processes"""
+
+    queue_sqlite_path: str = "matchmaking_queue.db"
+    """Path to the SQLite database of the `sqlite` queue store, shared by the processes using the same path"""
+
+    queue_journal_dir: str | None = None
+    """Directory of the journal the in-memory queue is recovered from after a restart, disabled if not set"""
+
+    queue_journal_flush_interval: float = 0.05
+    """Seconds between two writes of the queue journal, the queue changes of this period can be lost by a crash"""
+
+    queue_journal_compact_events: int = 100_000
+    """Number of queue journal events after which the journal is compacted into the queue snapshot"""
+
+    @staticmethod
+    def from_env(prefix: str = "MATCHMAKING_") -> "Settings":
+        """Create the settings from the environment variables"""
+        values = {
+            name: os.environ[f"{prefix}{name.upper()}"]
+            for name in Settings.model_fields
+            if f"{prefix}{name.upper()}" in os.environ
+        }
+        return Settings(**values)
+
+
+settings = Settings.from_env()
+"""Settings of the running application"""
@@ -5,9 +5,9 @@ from fastapi.middleware.cors import CORSMiddleware
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
 
 from core import ResultWithData
-from routers import api_router
+from routers import api_router, matchmaking_lifespan
 
-app = FastAPI()
+app = FastAPI(lifespan=matchmaking_lifespan)
 app.include_router(api_router)
 
 app.add_middleware(
@@ -1 +1,18 @@
+from .features import *
+from .player_snapshot import *
+from .player_store import *
+from .player_updater import *
+from .prediction_cache import *
+from .inference import *
+from .model_artifacts import *
+from .queue_store import *
+from .player_queue import *
+from .sqlite_queue_store import *
+from .queue_journal import *
+from .candidate_index import *
 from .matchmaker import *
+from .batch_matchmaker import *
+from .team_matchmaker import *
+from .matchmaking_service import *
+from .match_notifier import *
+from .game_file_watcher import *
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import numpy as np
+from core import metrics_registry
+from .matchmaker import MATCHES, SELECTION_SECONDS, Matchmaker
+
+TICK_SECONDS = metrics_registry.histogram("matchmaking_batch_tick_seconds", "Time spent in one batch matchmaking tick")
+
+class BatchMatchmaker:
+    """
+    Scheduler mode of the matchmaking that pairs the whole queue at once on a fixed tick.
+    On every tick the candidate pairs are the rating neighbours within each cluster, all of them
+    are scored in one model call, and the pairs are chosen by a global matching minimizing |p - target|.
+    The formed matches are kept in the queue store until the players poll them.
+    """
+    logger = logging.getLogger()
+
+    def __init__(
+        self,
+        matchmaker: Matchmaker,
+        target: float = 0.5,
+        tolerance: float = 0.1,
+        rating_window: float = 200,
+        neighbors: int = 8,
+    ) -> None:
+        """
+        Args:
+            matchmaker: The matchmaker owning the queue, the players data and the classifier.
+            target: The target probability that a player wins.
+            tolerance: The maximum difference between the target probability and the predicted probability.
+            rating_window: The maximum rating difference between two paired players.
+            neighbors: The number of next players by rating considered as opponents of each player.
+        """
+        self.matchmaker = matchmaker
+        self.target = target
+        self.tolerance = tolerance
+        self.rating_window = rating_window
+        self.neighbors = neighbors
+
+    def pop_match(self, profile_id: int) -> dict | None:
+        """
+        Get the match formed for a player and forget it.
+        Args:
+            profile_id: The profile ID of the player.
+        Returns:
+            The match data in the same format as `Matchmaker.find_match_for_player`, or None if the player has no match yet.
+        """
+        return self.matchmaker.players_queue.pop_match(profile_id)
+
+    def run_tick(self) -> list[dict]:
+        """
+        Pair as many queued players as possible.
+        The queue lock is only held to snapshot the candidate pairs and to claim the selected ones,
+        the queue keeps serving requests while the pairs are scored and selected.
+        Returns:
+            The list of formed matches.
+        """
+        matchmaker = self.matchmaker
+
+        with TICK_SECONDS.time():
+            with matchmaker.queue_lock:
+                artifacts = matchmaker.artifacts
+                rows_A, rows_B = self._collect_candidate_pairs()
+
+            if len(rows_A) == 0:
+                return []
+
+            probs = matchmaker.predict_match_outcomes_by_rows(rows_A, rows_B, artifacts)
+
+            with SELECTION_SECONDS.time("batch"):
+                costs = np.abs(probs - self.target)
+                selected = self._select_pairs(rows_A, rows_B, costs)
+
+            players_df = artifacts.player_store.players_df
+            profile_ids = artifacts.player_store.profile_ids
+            candidate_matches = [
+                (int(profile_ids[rows_A[i]]), int(profile_ids[rows_B[i]]), {
+                    "player_1": players_df.iloc[rows_A[i]].to_dict(),
+                    "player_2": players_df.iloc[rows_B[i]].to_dict(),
+                    "player_1_win_prob": float(probs[i]),
+                })
+                for i in selected
+            ]
+            matches: list[dict] = []
+
+            with matchmaker.queue_lock:
+                # The pairs were scored by the previous models, the next tick pairs the queue again
+                if matchmaker.artifacts is not artifacts:
+                    return []
+
+                for profile_id_A, profile_id_B, match in candidate_matches:
+                    # Skip the pairs that left the queue meanwhile or were matched by another process sharing the queue
+                    claimed_entries = matchmaker.players_queue.claim_pair(profile_id_A, profile_id_B)
+
+                    if claimed_entries is None:
+                        continue
+
+                    for entry in claimed_entries:
+                        matchmaker.observe_match_wait(entry)
+                        matchmaker.players_queue.put_match(entry.profile_id, match)
+
+                    matches.append(match)
+
+        if matches:
+            MATCHES.inc(len(matches), "batch")
+            self.logger.info(f"Batch matchmaking formed {len(matches)} matches from {len(rows_A)} candidate pairs")
+
+        return matches
+
+    async def run(self, interval: float) -> None:
+        """
+        Run the matchmaking ticks forever, each one in a worker thread.
+        Args:
+            interval: Seconds between the starts of two ticks.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            started_at = loop.time()
+
+            try:
+                await asyncio.to_thread(self.run_tick)
+            except Exception:
+                self.logger.exception("Batch matchmaking tick failed")
+
+            await asyncio.sleep(max(0.0, interval - (loop.time() - started_at)))
+
+    def _collect_candidate_pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Collect the candidate pairs: every queued player with its next `neighbors` players
+        by rating in the same cluster, within the rating window.
+        Returns:
+            The row indices of players A and players B of the candidate pairs.
+        """
+        store = self.matchmaker.player_store
+        queue = self.matchmaker.players_queue
+        pairs_A: list[np.ndarray] = []
+        pairs_B: list[np.ndarray] = []
+
+        for cluster in queue.clusters():
+            if queue.cluster_size(cluster) < 2:
+                continue
+
+            rows = store.get_rows(queue.cluster_members(cluster)) # ordered by rating
+            ratings = store.ratings[rows]
+
+            for offset in range(1, min(self.neighbors, len(rows) - 1) + 1):
+                within_window = ratings[offset:] - ratings[:-offset] <= self.rating_window
+                pairs_A.append(rows[:-offset][within_window])
+                pairs_B.append(rows[offset:][within_window])
+
+        if not pairs_A:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        return np.concatenate(pairs_A), np.concatenate(pairs_B)
+
+    def _select_pairs(self, rows_A: np.ndarray, rows_B: np.ndarray, costs: np.ndarray) -> list[int]:
+        """
+        Choose disjoint pairs with low total cost, greedily taking the cheapest remaining pair.
+        Greedy matching approximates the min-cost matching for the cost of sorting the candidate pairs.
+        Returns:
+            The indices of the selected candidate pairs.
+        """
+        order = np.argsort(costs, kind="stable")
+        order = order[costs[order] <= self.tolerance]
+        matched: set[int] = set()
+        selected: list[int] = []
+
+        for i, row_A, row_B in zip(order.tolist(), rows_A[order].tolist(), rows_B[order].tolist()):
+            if row_A in matched or row_B in matched:
+                continue
+
+            matched.add(row_A)
+            matched.add(row_B)
+            selected.append(i)
+
+        return selected
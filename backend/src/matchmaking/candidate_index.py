@@ -0,0 +1,175 @@
+import time
+import numpy as np
+from sklearn.neighbors import KDTree
+from core import metrics_registry
+from .player_store import PlayerStore
+from .queue_store import QueueEvent, QueueEventType, QueueStore
+
+REBUILD_SECONDS = metrics_registry.histogram("matchmaking_candidate_index_rebuild_seconds", "Time spent rebuilding the candidate index of the queued players")
+QUERY_SECONDS = metrics_registry.histogram("matchmaking_candidate_index_query_seconds", "Time spent finding the most similar queued players")
+
+class CandidateIndex:
+    """
+    Nearest-neighbour index over the model features of the queued players, z-score normalized with the mean
+    and the standard deviation of all the players, so every feature weighs the same in the distance.
+    The queued players are kept in one KD-tree per cluster, so a search can be restricted to the cluster of the player,
+    rebuilt from the queue only when the changes since the last build exceed a fraction of them. Meanwhile joining players are searched by brute force and leaving players
+    are filtered out of the tree results, so a query stays sub-linear in the queue size.
+    The index follows the queue through its events, queue stores shared by several processes
+    are also rebuilt every `max_age` seconds to see the players queued by the other processes.
+    """
+    players_queue: QueueStore
+    max_age: float | None
+    """Seconds after which the index is rebuilt from the queue regardless of the changes, never if None"""
+
+    REBUILD_FRACTION = 0.1
+    """Fraction of the indexed players that may change before the KD-trees are rebuilt"""
+
+    MIN_REBUILD_CHANGES = 1024
+    """Number of changes always tolerated before the KD-trees are rebuilt, so a small queue is not rebuilt on every change"""
+
+    def __init__(self, players_queue: QueueStore, max_age: float | None = None) -> None:
+        """
+        Args:
+            players_queue: The queue of the players waiting for a match, the index subscribes to its events.
+            max_age: Seconds after which the index is rebuilt from the queue, never if None.
+        """
+        self.players_queue = players_queue
+        self.max_age = max_age
+        self._player_store: PlayerStore | None = None
+        self._mean = np.zeros(0)
+        self._scale = np.ones(0)
+        # KD-tree and profile IDs of the indexed players of every cluster
+        self._trees: dict[int, tuple[KDTree, np.ndarray]] = {}
+        # Cluster of the KD-tree every indexed player is in
+        self._tree_clusters: dict[int, int] = {}
+        self._built_at = 0.0
+        self._is_built = False
+        # Indexed players that left the queue or whose features changed since the build
+        self._stale: set[int] = set()
+        # Players that joined the queue or whose features changed since the build, searched by brute force
+        self._added: dict[int, None] = {}
+        players_queue.subscribe(self._on_queue_event)
+
+    def __len__(self) -> int:
+        return len(self._tree_clusters) - len(self._stale) + len(self._added)
+
+    def invalidate(self) -> None:
+        """
+        Rebuild the index from the queue on the next query, e.g. after players were added with `add_many`.
+        """
+        self._is_built = False
+
+    def refresh_player(self, profile_id: int) -> None:
+        """
+        Re-index a queued player whose features changed.
+        Args:
+            profile_id: The profile ID of the player.
+        """
+        if profile_id in self._tree_clusters and profile_id not in self._stale:
+            self._stale.add(profile_id)
+            self._added[profile_id] = None
+
+    def nearest(self, player_store: PlayerStore, player_row: int, k: int, exclude: int | None = None, cluster: int | None = None) -> list[int]:
+        """
+        Find the queued players with the most similar features to a player.
+        Args:
+            player_store: The players data store the features are read from, the index is rebuilt when the store changes.
+            player_row: The row index of the player in the player store.
+            k: The maximum number of players to return.
+            exclude: The profile ID to skip, usually the searching player.
+            cluster: Restrict the search to the players of a cluster, search the whole queue if None.
+        Returns:
+            Up to `k` profile IDs ordered by the distance to the player.
+        """
+        if player_store is not self._player_store or not self._is_built or self._is_outdated():
+            self.rebuild(player_store)
+
+        with QUERY_SECONDS.time():
+            point = self._normalize(player_store.features[player_row][np.newaxis, :])
+            profile_ids: list[int] = []
+            distances: list[float] = []
+
+            if cluster is None:
+                trees = list(self._trees.values())
+            else:
+                trees = [self._trees[cluster]] if cluster in self._trees else []
+
+            for tree, tree_ids in trees:
+                # Enough neighbours to fill k after dropping the stale players and the excluded player
+                tree_k = min(len(tree_ids), k + len(self._stale) + 1)
+                tree_distances, positions = tree.query(point, k=tree_k)
+
+                for distance, profile_id in zip(tree_distances[0].tolist(), tree_ids[positions[0]].tolist()):
+                    if profile_id not in self._stale and profile_id != exclude:
+                        profile_ids.append(profile_id)
+                        distances.append(distance)
+
+            if self._added:
+                rows = player_store.get_rows(list(self._added))
+
+                if cluster is not None:
+                    rows = rows[player_store.clusters[rows] == cluster]
+
+                added_distances = np.linalg.norm(self._normalize(player_store.features[rows]) - point, axis=1)
+                profile_ids.extend(player_store.profile_ids[rows].tolist())
+                distances.extend(added_distances.tolist())
+
+            order = np.argsort(distances, kind="stable")
+            return [profile_ids[i] for i in order.tolist() if profile_ids[i] != exclude][:k]
+
+    def rebuild(self, player_store: PlayerStore) -> None:
+        """
+        Rebuild the KD-trees of the clusters from the players currently in the queue.
+        Args:
+            player_store: The players data store the features are read from.
+        """
+        with REBUILD_SECONDS.time():
+            if player_store is not self._player_store:
+                features = player_store.features.astype(np.float64)
+                std = features.std(axis=0)
+                self._mean = features.mean(axis=0)
+                self._scale = np.where(std > 0, std, 1.0)
+                self._player_store = player_store
+
+            rows = player_store.get_rows(list(self.players_queue))
+            clusters = player_store.clusters[rows]
+            self._trees = {}
+
+            for cluster in np.unique(clusters).tolist():
+                cluster_rows = rows[clusters == cluster]
+                tree_ids = player_store.profile_ids[cluster_rows].astype(np.int64)
+                self._trees[cluster] = (KDTree(self._normalize(player_store.features[cluster_rows])), tree_ids)
+
+            self._tree_clusters = dict(zip(player_store.profile_ids[rows].tolist(), clusters.tolist()))
+            self._stale.clear()
+            self._added.clear()
+            self._built_at = time.monotonic()
+            self._is_built = True
+
+    def _is_outdated(self) -> bool:
+        """Whether the changes since the build outweigh the KD-trees or the build is older than `max_age`"""
+        changes_count = len(self._stale) + len(self._added)
+
+        if changes_count > max(self.MIN_REBUILD_CHANGES, self.REBUILD_FRACTION * len(self._tree_clusters)):
+            return True
+
+        return self.max_age is not None and time.monotonic() - self._built_at > self.max_age
+
+    def _normalize(self, features: np.ndarray) -> np.ndarray:
+        return (features - self._mean) / self._scale
+
+    def _on_queue_event(self, event: QueueEvent) -> None:
+        if not self._is_built:
+            return
+
+        profile_id = event.profile_id
+
+        if event.type == QueueEventType.ENQUEUED:
+            if profile_id not in self._tree_clusters or profile_id in self._stale:
+                self._added[profile_id] = None
+        else:
+            self._added.pop(profile_id, None)
+
+            if profile_id in self._tree_clusters:
+                self._stale.add(profile_id)
@@ -0,0 +1,186 @@
+import argparse
+import json
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+from core import get_model_path
+from .features import CLUSTER_FEATURE_COLUMNS, CLUSTER_NUMERICAL_COLUMNS
+
+CLUSTER_MODEL_FORMAT_VERSION = 1
+"""Version of the cluster model file layout, bumped on incompatible changes"""
+
+logger = logging.getLogger()
+
+def get_default_cluster_model_path() -> str:
+    """
+    Get the path to the cluster model next to the classifier in the models directory.
+    """
+    return get_model_path("cluster_model.json")
+
+class ClusterModel:
+    """
+    Assigns players to the nearest cluster centroid in the standardized `CLUSTER_FEATURE_COLUMNS` space,
+    so new and updated players get a cluster without clustering all the players again.
+    For the KMeans clusters of the pipeline the centroids are the KMeans centers and the assignment is exact,
+    for clusters computed offline (e.g. HDBSCAN) the centroids are the mean of every cluster's players
+    and the assignment approximates the offline clustering.
+    """
+    mean: np.ndarray
+    """Values subtracted from the cluster features, 0 for the unscaled columns"""
+
+    scale: np.ndarray
+    """Values the centered cluster features are divided by, 1 for the unscaled columns"""
+
+    centroids: np.ndarray
+    """Centroids of shape (clusters, len(CLUSTER_FEATURE_COLUMNS)) in the standardized space"""
+
+    labels: np.ndarray
+    """Cluster label of every centroid"""
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray, centroids: np.ndarray, labels: np.ndarray) -> None:
+        """
+        Raises:
+            ValueError: If the shapes do not match `CLUSTER_FEATURE_COLUMNS` or there are no centroids.
+        """
+        columns_count = len(CLUSTER_FEATURE_COLUMNS)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, columns_count)
+        self.labels = np.asarray(labels, dtype=np.int64)
+
+        if self.mean.shape != (columns_count,) or self.scale.shape != (columns_count,):
+            raise ValueError(f"The cluster model scaling must have {columns_count} values")
+
+        if len(self.centroids) == 0 or len(self.labels) != len(self.centroids):
+            raise ValueError("The cluster model needs at least one centroid and one label per centroid")
+
+        self._centroid_norms = (self.centroids ** 2).sum(axis=1)
+
+    def __len__(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def fit(players_df: pd.DataFrame, clusters_count: int, random_state: int | None = None) -> "ClusterModel":
+        """
+        Cluster the players with KMeans on the standardized numerical columns plus the encoded rank level and input type.
+        Args:
+            players_df: The players data with the `CLUSTER_FEATURE_COLUMNS`.
+            clusters_count: The number of clusters.
+            random_state: The seed of the clustering.
+        """
+        scaler = StandardScaler().fit(players_df[CLUSTER_NUMERICAL_COLUMNS])
+        unscaled_count = len(CLUSTER_FEATURE_COLUMNS) - len(CLUSTER_NUMERICAL_COLUMNS)
+        mean = np.concatenate((scaler.mean_, np.zeros(unscaled_count)))
+        scale = np.concatenate((scaler.scale_, np.ones(unscaled_count)))
+        player_features = (players_df[CLUSTER_FEATURE_COLUMNS].to_numpy(dtype=np.float64) - mean) / scale
+        kmeans = KMeans(n_clusters=clusters_count, max_iter=1000, random_state=random_state).fit(player_features)
+        return ClusterModel(mean, scale, kmeans.cluster_centers_, np.arange(clusters_count))
+
+    @staticmethod
+    def from_labels(players_df: pd.DataFrame) -> "ClusterModel":
+        """
+        Build the centroids of clusters computed offline, as the mean standardized features of every cluster's players.
+        Players labelled as noise (negative cluster) are left out, so they are never assigned to new players.
+        Args:
+            players_df: The players data with the `CLUSTER_FEATURE_COLUMNS` and the `cluster` column.
+        Raises:
+            ValueError: If no player has a cluster.
+        """
+        numerical = players_df[CLUSTER_NUMERICAL_COLUMNS].to_numpy(dtype=np.float64)
+        std = np.nanstd(numerical, axis=0)
+        unscaled_count = len(CLUSTER_FEATURE_COLUMNS) - len(CLUSTER_NUMERICAL_COLUMNS)
+        mean = np.concatenate((np.nanmean(numerical, axis=0), np.zeros(unscaled_count)))
+        scale = np.concatenate((np.where(std > 0, std, 1.0), np.ones(unscaled_count)))
+        player_features = pd.DataFrame((players_df[CLUSTER_FEATURE_COLUMNS].to_numpy(dtype=np.float64) - mean) / scale)
+        clusters = players_df["cluster"].to_numpy(dtype=np.int64)
+        centroids = player_features[clusters >= 0].groupby(clusters[clusters >= 0]).mean()
+
+        if centroids.empty:
+            raise ValueError("No player has a cluster to build the centroids from")
+
+        return ClusterModel(mean, scale, centroids.to_numpy(), centroids.index.to_numpy())
+
+    def assign(self, values: np.ndarray) -> np.ndarray:
+        """
+        Assign players to the nearest centroid.
+        Missing values count as the average player's value.
+        Args:
+            values: The raw values of shape (N, len(CLUSTER_FEATURE_COLUMNS)) in `CLUSTER_FEATURE_COLUMNS` order.
+        Returns:
+            The cluster label of every player.
+        """
+        player_features = (np.asarray(values, dtype=np.float64).reshape(-1, len(CLUSTER_FEATURE_COLUMNS)) - self.mean) / self.scale
+        player_features[np.isnan(player_features)] = 0.0
+        # The squared distances without the players' norms, which do not change the nearest centroid
+        distances = self._centroid_norms - 2 * player_features @ self.centroids.T
+        return self.labels[distances.argmin(axis=1)]
+
+    def assign_players(self, players_df: pd.DataFrame) -> np.ndarray:
+        """
+        Assign the players of a DataFrame with the `CLUSTER_FEATURE_COLUMNS` to the nearest centroid.
+        Returns:
+            The cluster label of every player.
+        """
+        return self.assign(players_df[CLUSTER_FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+
+    def save(self, path: str) -> None:
+        """
+        Write the cluster model as a JSON file.
+        """
+        data = {
+            "version": CLUSTER_MODEL_FORMAT_VERSION,
+            "columns": CLUSTER_FEATURE_COLUMNS,
+            "mean": self.mean.tolist(),
+            "scale": self.scale.tolist(),
+            "centroids": self.centroids.tolist(),
+            "labels": self.labels.tolist(),
+        }
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @staticmethod
+    def load(path: str) -> "ClusterModel":
+        """
+        Read a cluster model written by `save`.
+        Raises:
+            ValueError: If the file is not a cluster model compatible with this version of the backend.
+            OSError: If the file cannot be read.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                data: dict = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Cannot parse the cluster model {path}: {e}") from e
+
+        version = data.get("version")
+
+        if version != CLUSTER_MODEL_FORMAT_VERSION:
+            raise ValueError(f"Unsupported cluster model version {version}, expected {CLUSTER_MODEL_FORMAT_VERSION}")
+
+        if data.get("columns") != CLUSTER_FEATURE_COLUMNS:
+            raise ValueError(f"The cluster model {path} is computed from other columns than the players clusters")
+
+        try:
+            return ClusterModel(data["mean"], data["scale"], data["centroids"], data["labels"])
+        except KeyError as e:
+            raise ValueError(f"The cluster model {path} misses {e}") from e
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the cluster model from the clusters of clustered_players.csv.")
+    parser.add_argument("--input", default=get_model_path("clustered_players.csv"), help="Path to the players CSV file")
+    parser.add_argument("--output", default=get_default_cluster_model_path(), help="Path to the cluster model file")
+    args = parser.parse_args()
+
+    players_df = pd.read_csv(args.input)
+    cluster_model = ClusterModel.from_labels(players_df)
+    cluster_model.save(args.output)
+    agreement = float((cluster_model.assign_players(players_df) == players_df["cluster"].to_numpy()).mean())
+    logger.info(f"Cluster model with {len(cluster_model)} clusters written to {args.output}, {agreement:.1%} of the players are assigned their cluster")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
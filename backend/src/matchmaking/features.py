@@ -0,0 +1,65 @@
+import numpy as np
+
+PLAYER_FEATURE_COLUMNS = [
+    "rating", "win_rate", "games_count", "wins_count",
+    "rank_level_encoded", "avg_mmr_diff_10", "avg_mmr_diff_25",
+    "avg_mmr_diff_50", "avg_mmr_diff_75", "avg_mmr_diff_100",
+    "avg_mmr", "avg_opp_mmr", "avg_game_length", "input_type_encoded",
+]
+"""Per-player feature columns in the same order as used during training"""
+
+MATCH_FEATURE_COLUMNS = [f"{column}_A" for column in PLAYER_FEATURE_COLUMNS] + [f"{column}_B" for column in PLAYER_FEATURE_COLUMNS]
+"""Classifier input columns, player A's features followed by player B's features"""
+
+CLUSTER_NUMERICAL_COLUMNS = [
+    "rating", "games_count", "wins_count",
+    "avg_mmr_diff_10", "avg_mmr_diff_25", "avg_mmr_diff_50",
+    "avg_mmr_diff_75", "avg_mmr_diff_100", "avg_mmr",
+    "avg_opp_mmr", "avg_game_length", "win_rate",
+]
+"""Player columns standardized before clustering"""
+
+CLUSTER_FEATURE_COLUMNS = [*CLUSTER_NUMERICAL_COLUMNS, "rank_level_encoded", "input_type_encoded"]
+"""Player columns the clusters are computed from, the encoded rank level and input type are not scaled"""
+
+MMR_DIFF_WINDOWS = (10, 25, 50, 75, 100)
+"""Numbers of the last games averaged by the `avg_mmr_diff_*` features"""
+
+RANK_LEVELS: dict[str, tuple[int, int]] = {
+    "Bronze 1": (0, 0),
+    "Bronze 2": (400, 1),
+    "Bronze 3": (450, 2),
+    "Silver 1": (500, 3),
+    "Silver 2": (600, 4),
+    "Silver 3": (650, 5),
+    "Gold 1": (700, 6),
+    "Gold 2": (800, 7),
+    "Gold 3": (900, 8),
+    "Platinum 1": (1000, 9),
+    "Platinum 2": (1100, 10),
+    "Platinum 3": (1150, 11),
+    "Diamond 1": (1200, 12),
+    "Diamond 2": (1300, 13),
+    "Diamond 3": (1350, 14),
+    "Conqueror 1": (1400, 15),
+    "Conqueror 2": (1500, 16),
+    "Conqueror 3": (1600, 17),
+}
+"""Rank level name -> (minimum rating, encoded value)"""
+
+INPUT_TYPES = {"keyboard": 0, "controller": 1}
+"""Input type -> encoded value, unknown input types are encoded as keyboard"""
+
+def get_rank_levels(ratings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the rank levels of the players by their ratings.
+    Args:
+        ratings: The ELO ratings of the players.
+    Returns:
+        The rank level names ("Unranked" below the lowest level) and the encoded rank levels.
+    """
+    names = np.array([*RANK_LEVELS, "Unranked"], dtype=object)
+    thresholds = np.array([threshold for threshold, _ in RANK_LEVELS.values()])
+    encoded_values = np.array([encoded for _, encoded in RANK_LEVELS.values()] + [0])
+    levels = np.searchsorted(thresholds, np.asarray(ratings), side="right") - 1 # -1 picks "Unranked"
+    return names[levels], encoded_values[levels]
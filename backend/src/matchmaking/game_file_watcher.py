@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from .matchmaking_service import MatchmakingService
+from .pipeline import iter_game_chunks
+
+class GameFileWatcher:
+    """
+    Applies files of finished games dropped into a directory to the players data.
+    Files are JSON arrays or JSON lines of game records (optionally gzip-compressed), as read by the pipeline,
+    and are renamed with the `APPLIED_SUFFIX` once applied. A file that cannot be read or applied is renamed with
+    the `FAILED_SUFFIX`, so it does not block the files after it; the games of its chunks applied before the error stay applied.
+    Writers should create the files under another name
+    and rename them into the directory, so that a file is never read while it is being written.
+    """
+    logger = logging.getLogger()
+
+    FILE_EXTENSIONS = (".json", ".jsonl", ".json.gz", ".jsonl.gz")
+    APPLIED_SUFFIX = ".applied"
+    FAILED_SUFFIX = ".failed"
+
+    def __init__(self, matchmaking_service: MatchmakingService, directory: str, chunk_size: int = 10_000) -> None:
+        """
+        Args:
+            matchmaking_service: The service applying the games, serialized with the other matchmaking commands.
+            directory: The directory to watch.
+            chunk_size: The maximum number of games applied by one command.
+        """
+        self.matchmaking_service = matchmaking_service
+        self.directory = directory
+        self.chunk_size = chunk_size
+
+    async def poll(self) -> int:
+        """
+        Apply the files currently in the directory, oldest first.
+        Returns:
+            The number of applied files.
+        """
+        paths = await asyncio.to_thread(self._list_files)
+        applied_count = 0
+
+        for path in paths:
+            try:
+                games_count = await self._apply_file(path)
+            except Exception:
+                self.logger.exception(f"Applying finished games from {path} failed, renaming it with {self.FAILED_SUFFIX}")
+                os.replace(path, f"{path}{self.FAILED_SUFFIX}")
+                continue
+
+            os.replace(path, f"{path}{self.APPLIED_SUFFIX}")
+            self.logger.info(f"Applied {games_count} games from {path}")
+            applied_count += 1
+
+        return applied_count
+
+    async def run(self, interval: float) -> None:
+        """
+        Poll the directory forever.
+        Args:
+            interval: Seconds between two polls.
+        """
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                self.logger.exception(f"Applying finished games from {self.directory} failed")
+
+            await asyncio.sleep(interval)
+
+    async def _apply_file(self, path: str) -> int:
+        """
+        Apply the games of a file chunk by chunk, reading every chunk in a worker thread so that
+        only one chunk is held in memory at a time.
+        Returns:
+            The number of applied games.
+        """
+        chunks = iter_game_chunks(path, self.chunk_size)
+        games_count = 0
+
+        try:
+            while (games := await asyncio.to_thread(next, chunks, None)) is not None:
+                await self.matchmaking_service.apply_games(games)
+                games_count += len(games)
+        finally:
+            chunks.close()
+
+        return games_count
+
+    def _list_files(self) -> list[str]:
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(self.FILE_EXTENSIONS)
+        ]
+        return sorted(paths, key=os.path.getmtime)
@@ -0,0 +1,218 @@
+import json
+from abc import ABC, abstractmethod
+import numpy as np
+from xgboost import XGBClassifier
+
+class InferenceBackend(ABC):
+    """
+    Predictor of the match outcome classifier.
+    """
+    name: str
+    """Name of the backend used in the settings"""
+
+    @abstractmethod
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predict the probabilities that player A wins.
+        Args:
+            X: The match features matrix of shape (n, 28).
+        Returns:
+            The array of n probabilities.
+        """
+
+
+class SklearnBackend(InferenceBackend):
+    """
+    The scikit-learn interface of the XGBoost classifier, builds a DMatrix for every call.
+    """
+    name = "sklearn"
+
+    def __init__(self, classifier: XGBClassifier) -> None:
+        self.classifier = classifier
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self.classifier.predict_proba(X)[:, 1]
+
+
+class InplaceBackend(InferenceBackend):
+    """
+    XGBoost's inplace prediction on the booster, skips the DMatrix construction.
+    """
+    name = "inplace"
+
+    def __init__(self, classifier: XGBClassifier) -> None:
+        self.booster = classifier.get_booster()
+        self.iteration_range = get_iteration_range(classifier)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range, validate_features=False)
+
+
+class NumpyTreeBackend(InferenceBackend):
+    """
+    Pure NumPy evaluator of the boosted trees flattened into node arrays.
+    All trees are walked level by level for a block of rows at once.
+    Leaves point to themselves, so walking past a leaf keeps the row on it.
+    """
+    name = "numpy"
+
+    ROWS_PER_CHUNK = 2048
+    """Number of rows walked at once, bounds the memory of the (rows, trees) node matrix"""
+
+    def __init__(self, classifier: XGBClassifier) -> None:
+        booster = classifier.get_booster()
+        feature_index = {name: i for i, name in enumerate(booster.feature_names or [])}
+        tree_count = get_iteration_range(classifier)[1] or booster.num_boosted_rounds()
+        features: list[int] = []
+        thresholds: list[float] = []
+        yes_nodes: list[int] = []
+        no_nodes: list[int] = []
+        missing_nodes: list[int] = []
+        values: list[float] = []
+        roots: list[int] = []
+        self.max_depth = 0
+
+        for tree_dump in booster.get_dump(dump_format="json")[:tree_count]:
+            offset = len(features)
+            nodes: dict[int, dict] = {}
+            stack = [(json.loads(tree_dump), 0)]
+
+            while stack:
+                node, depth = stack.pop()
+                nodes[node["nodeid"]] = node
+                self.max_depth = max(self.max_depth, depth)
+                stack.extend((child, depth + 1) for child in node.get("children", []))
+
+            size = max(nodes) + 1
+            features.extend([0] * size)
+            thresholds.extend([np.inf] * size)
+            yes_nodes.extend(range(offset, offset + size))
+            no_nodes.extend(range(offset, offset + size))
+            missing_nodes.extend(range(offset, offset + size))
+            values.extend([0.0] * size)
+            roots.append(offset)
+
+            for node_id, node in nodes.items():
+                i = offset + node_id
+
+                if "leaf" in node:
+                    values[i] = node["leaf"]
+                    continue
+
+                split = node["split"]
+                features[i] = feature_index[split] if split in feature_index else int(split.lstrip("f"))
+                thresholds[i] = node["split_condition"]
+                yes_nodes[i] = offset + node["yes"]
+                no_nodes[i] = offset + node["no"]
+                missing_nodes[i] = offset + node["missing"]
+
+        self.features = np.array(features, dtype=np.intp)
+        self.thresholds = np.array(thresholds, dtype=np.float32)
+        self.yes_nodes = np.array(yes_nodes, dtype=np.intp)
+        self.no_nodes = np.array(no_nodes, dtype=np.intp)
+        self.missing_nodes = np.array(missing_nodes, dtype=np.intp)
+        self.values = np.array(values, dtype=np.float64)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.base_margin = get_base_margin(classifier)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        probs = np.empty(len(X))
+
+        for start in range(0, len(X), self.ROWS_PER_CHUNK):
+            end = start + self.ROWS_PER_CHUNK
+            probs[start:end] = self._predict_chunk(X[start:end])
+
+        return probs
+
+    def _predict_chunk(self, X: np.ndarray) -> np.ndarray:
+        rows = np.arange(len(X))[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+
+        for _ in range(self.max_depth):
+            x = X[rows, self.features[nodes]]
+            next_nodes = np.where(x < self.thresholds[nodes], self.yes_nodes[nodes], self.no_nodes[nodes])
+            nodes = np.where(np.isnan(x), self.missing_nodes[nodes], next_nodes)
+
+        margin = self.values[nodes].sum(axis=1) + self.base_margin
+        return 1.0 / (1.0 + np.exp(-margin))
+
+
+class TreeliteBackend(InferenceBackend):
+    """
+    Treelite's tree interpreter, available when the `treelite` package is installed.
+    """
+    name = "treelite"
+
+    def __init__(self, classifier: XGBClassifier) -> None:
+        try:
+            import treelite
+        except ImportError as e:
+            raise ImportError("The treelite inference backend requires the treelite package") from e
+
+        self.model = treelite.frontend.from_xgboost(classifier.get_booster())
+        self._predict = treelite.gtil.predict
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        probs = np.asarray(self._predict(self.model, np.asarray(X, dtype=np.float32)))
+        return probs.reshape(len(X), -1)[:, -1]
+
+
+INFERENCE_BACKENDS: dict[str, type[InferenceBackend]] = {
+    backend.name: backend
+    for backend in (SklearnBackend, InplaceBackend, NumpyTreeBackend, TreeliteBackend)
+}
+"""Available inference backends by name"""
+
+def create_inference_backend(name: str, classifier: XGBClassifier) -> InferenceBackend:
+    """
+    Create an inference backend for the classifier.
+    Args:
+        name: The name of the backend, one of `INFERENCE_BACKENDS`.
+        classifier: The trained classifier.
+    Raises:
+        ValueError: If the backend name is unknown.
+    """
+    backend = INFERENCE_BACKENDS.get(name)
+
+    if backend is None:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {list(INFERENCE_BACKENDS)}")
+
+    return backend(classifier)
+
+def check_backend_parity(backend: InferenceBackend, reference: InferenceBackend, X: np.ndarray, tolerance: float = 1e-5) -> float:
+    """
+    Check that a backend predicts the same probabilities as the reference backend.
+    Args:
+        backend: The backend to check.
+        reference: The reference backend, usually `SklearnBackend`.
+        X: The match features to predict.
+        tolerance: The maximum allowed absolute difference.
+    Returns:
+        The maximum absolute difference between the predictions.
+    Raises:
+        ValueError: If the difference exceeds the tolerance.
+    """
+    max_diff = float(np.max(np.abs(backend.predict_proba(X) - reference.predict_proba(X)), initial=0.0))
+
+    if max_diff > tolerance:
+        raise ValueError(f"Inference backend '{backend.name}' differs from '{reference.name}' by {max_diff}")
+
+    return max_diff
+
+def get_iteration_range(classifier: XGBClassifier) -> tuple[int, int]:
+    """
+    Get the range of boosting rounds used for prediction, limited to the best iteration if the model was trained with early stopping.
+    """
+    try:
+        return 0, classifier.best_iteration + 1
+    except AttributeError:
+        return 0, 0
+
+def get_base_margin(classifier: XGBClassifier) -> float:
+    """
+    Get the global bias of the classifier in the margin (log-odds) space.
+    """
+    config = json.loads(classifier.get_booster().save_config())
+    base_score = float(str(config["learner"]["learner_model_param"]["base_score"]).strip("[]"))
+    return float(np.log(base_score / (1.0 - base_score)))
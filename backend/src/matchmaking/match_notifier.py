@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import math
+from dataclasses import dataclass
+from enum import StrEnum
+from core import metrics_registry
+from .matchmaker import Matchmaker
+from .queue_store import QueueEvent, QueueEventType
+
+NOTIFICATIONS = metrics_registry.counter("matchmaking_notifications_total", "Notifications pushed to the subscribed players", ("type",))
+NOTIFY_TICK_SECONDS = metrics_registry.histogram("matchmaking_notify_tick_seconds", "Time spent collecting the queue status of the subscribed players")
+
+class NotificationType(StrEnum):
+    STATUS = "status"
+    MATCH = "match"
+    DEQUEUED = "dequeued"
+
+
+@dataclass(slots=True, frozen=True)
+class QueueStatus:
+    position: int
+    """1-based position of the player among the queued players by the time of joining"""
+    queue_length: int
+    wait_seconds: float
+    """Seconds the player has been waiting"""
+    estimated_wait_seconds: float | None
+    """Seconds until the players ahead are matched at the observed match rate, None until a match is observed"""
+
+
+@dataclass(slots=True, frozen=True)
+class Notification:
+    type: NotificationType
+    payload: QueueStatus | dict | None = None
+    """The `QueueStatus` of a status notification or the match data of a match notification"""
+
+    @property
+    def is_final(self) -> bool:
+        """Whether the player left the queue, no notification follows"""
+        return self.type != NotificationType.STATUS
+
+
+class NotificationSubscription:
+    """
+    Notifications of one player for one client connection, read in the order they were pushed.
+    The subscription is closed after the final notification.
+    """
+    profile_id: int
+    is_closed = False
+    last_status: QueueStatus | None = None
+    """The last pushed queue status, a status is pushed again only when it changes"""
+
+    def __init__(self, profile_id: int) -> None:
+        self.profile_id = profile_id
+        self._notifications: asyncio.Queue[Notification] = asyncio.Queue()
+
+    def push(self, notification: Notification) -> None:
+        if self.is_closed:
+            return
+
+        self._notifications.put_nowait(notification)
+        NOTIFICATIONS.inc(1, notification.type.value)
+
+        if notification.is_final:
+            self.is_closed = True
+        else:
+            self.last_status = notification.payload
+
+    async def get(self) -> Notification:
+        """
+        Wait for the next notification.
+        """
+        return await self._notifications.get()
+
+
+class MatchNotifier:
+    """
+    Pushes the matchmaking notifications to the subscribed players instead of the players polling the API:
+    the queue position and the estimated wait while the player waits, then the formed match,
+    or the leaving of the queue without a match.
+    The matches formed on request are published by the matchmaking service, the matches of the batch matchmaking
+    are read from the queue store as soon as the player leaves the queue and forgotten there once pushed.
+    A player matched on request whose match is not published within `MATCH_PUBLISH_TICKS` ticks is notified
+    as dequeued, so the connection is never left waiting.
+    The subscriptions are managed on the event loop, the queue is read in a worker thread on every tick.
+    """
+    interval: float
+    """Seconds between two refreshes of the queue statuses"""
+    match_rate: float | None = None
+    """Players matched per second, smoothed over `MATCH_RATE_WINDOW`, None until a tick observed matches"""
+    logger = logging.getLogger()
+
+    MATCH_RATE_WINDOW = 60.0
+    """Seconds over which the match rate is smoothed"""
+
+    ESTIMATE_CHANGE_THRESHOLD = 0.1
+    """Relative change of the estimated wait pushed to a player whose position did not change"""
+
+    MATCH_PUBLISH_TICKS = 2
+    """Ticks a player matched on request waits for the match to be published before being notified as dequeued"""
+
+    def __init__(self, matchmaker: Matchmaker, interval: float = 0.25) -> None:
+        """
+        Args:
+            matchmaker: The matchmaker owning the queue.
+            interval: Seconds between two refreshes of the queue statuses.
+        """
+        self.matchmaker = matchmaker
+        self.interval = interval
+        self._subscriptions: dict[int, list[NotificationSubscription]] = {}
+        # Subscribed players matched on request whose match is not published yet, with the ticks waited
+        self._matched_ids: dict[int, int] = {}
+        self._matched_count = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup = asyncio.Event()
+
+    def subscribe(self, profile_id: int) -> NotificationSubscription:
+        """
+        Subscribe to the notifications of a player, the current queue status is pushed on the next tick.
+        Must be called on the event loop running `run`.
+        """
+        subscription = NotificationSubscription(profile_id)
+        self._subscriptions.setdefault(profile_id, []).append(subscription)
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription: NotificationSubscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.profile_id)
+
+        if subscriptions is None or subscription not in subscriptions:
+            return
+
+        subscriptions.remove(subscription)
+
+        if not subscriptions:
+            del self._subscriptions[subscription.profile_id]
+            self._matched_ids.pop(subscription.profile_id, None)
+
+    def subscriptions_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish_match(self, match: dict) -> None:
+        """
+        Push a formed match to both of its players. Must be called on the event loop running `run`.
+        Args:
+            match: The match data in the same format as `Matchmaker.find_match_for_player`.
+        """
+        for key in ("player_1", "player_2"):
+            profile_id = int(match[key]["profile_id"])
+            self._matched_ids.pop(profile_id, None)
+
+            for subscription in self._subscriptions.pop(profile_id, []):
+                subscription.push(Notification(NotificationType.MATCH, match))
+
+    async def acknowledge_match(self, profile_id: int, match: dict) -> None:
+        """
+        Forget the match stored for a player by the batch matchmaking once it was pushed to the player,
+        until then it can still be polled. A match formed on request is not stored, so nothing is forgotten.
+        Args:
+            profile_id: The profile ID of the player the match was pushed to.
+            match: The pushed match data.
+        """
+        await asyncio.to_thread(self._forget_stored_match, profile_id, match)
+
+    async def run(self) -> None:
+        """
+        Refresh the statuses of the subscribed players forever, every `interval` seconds
+        or as soon as a subscribed player leaves the queue.
+        """
+        self._loop = asyncio.get_running_loop()
+        # An event binds to the loop it is first awaited on, so every run gets its own
+        self._wakeup = asyncio.Event()
+        players_queue = self.matchmaker.players_queue
+        players_queue.subscribe(self._on_queue_event)
+        last_tick_at = self._loop.time()
+
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except TimeoutError:
+                    pass
+
+                self._wakeup.clear()
+                now = self._loop.time()
+                self._update_match_rate(now - last_tick_at)
+                last_tick_at = now
+
+                try:
+                    await self._tick()
+                except Exception:
+                    self.logger.exception("Matchmaking notifications tick failed")
+        finally:
+            players_queue.unsubscribe(self._on_queue_event)
+
+    async def _tick(self) -> None:
+        """
+        Collect the queue status or the stored match of every subscribed player and push the changes.
+        """
+        profile_ids = list(self._subscriptions)
+
+        if not profile_ids:
+            return
+
+        states = await asyncio.to_thread(self._collect_states, profile_ids)
+
+        for profile_id, state in states.items():
+            subscriptions = self._subscriptions.get(profile_id)
+
+            if not subscriptions:
+                continue
+
+            if isinstance(state, QueueStatus):
+                estimated_wait = None if not self.match_rate else round(state.position / self.match_rate, 1)
+                status = QueueStatus(state.position, state.queue_length, state.wait_seconds, estimated_wait)
+
+                for subscription in subscriptions:
+                    if self._is_status_changed(subscription.last_status, status):
+                        subscription.push(Notification(NotificationType.STATUS, status))
+            elif state is not None:
+                self.publish_match(state)
+            elif self._matched_ids.get(profile_id, self.MATCH_PUBLISH_TICKS) < self.MATCH_PUBLISH_TICKS:
+                # Matched on request, the match is published by the matchmaking service
+                self._matched_ids[profile_id] += 1
+            else:
+                self._matched_ids.pop(profile_id, None)
+
+                for subscription in self._subscriptions.pop(profile_id):
+                    subscription.push(Notification(NotificationType.DEQUEUED))
+
+    def _collect_states(self, profile_ids: list[int]) -> dict[int, QueueStatus | dict | None]:
+        """
+        Get the queue status of the queued players, the stored match of the players matched by the batch
+        matchmaking, None for the other players.
+        """
+        players_queue = self.matchmaker.players_queue
+
+        with self.matchmaker.queue_lock, NOTIFY_TICK_SECONDS.time():
+            now = players_queue.clock()
+            queue_length = len(players_queue)
+            positions = players_queue.positions(profile_ids)
+            states: dict[int, QueueStatus | dict | None] = {}
+
+            for profile_id in profile_ids:
+                entry = players_queue.get(profile_id) if profile_id in positions else None
+
+                if entry is not None:
+                    states[profile_id] = QueueStatus(positions[profile_id], queue_length, round(now - entry.enqueued_at, 1), None)
+                else:
+                    states[profile_id] = players_queue.get_match(profile_id)
+
+        return states
+
+    def _forget_stored_match(self, profile_id: int, match: dict) -> None:
+        players_queue = self.matchmaker.players_queue
+
+        with self.matchmaker.queue_lock:
+            # The player may have polled the match meanwhile, or queued again and been matched anew
+            if players_queue.get_match(profile_id) == match:
+                players_queue.pop_match(profile_id)
+
+    def _is_status_changed(self, last_status: QueueStatus | None, status: QueueStatus) -> bool:
+        """
+        Check if a status is worth pushing: the position changed or the estimated wait changed noticeably,
+        so the players are not notified on every tick while the match rate drifts.
+        """
+        if last_status is None or last_status.position != status.position:
+            return True
+
+        last_estimate, estimate = last_status.estimated_wait_seconds, status.estimated_wait_seconds
+
+        if last_estimate is None or estimate is None:
+            return last_estimate != estimate
+
+        return abs(estimate - last_estimate) > self.ESTIMATE_CHANGE_THRESHOLD * last_estimate
+
+    def _update_match_rate(self, elapsed: float) -> None:
+        if elapsed <= 0:
+            return
+
+        matched_count, self._matched_count = self._matched_count, 0
+        rate = matched_count / elapsed
+
+        if self.match_rate is None:
+            self.match_rate = rate if matched_count else None
+        else:
+            weight = 1.0 - math.exp(-elapsed / self.MATCH_RATE_WINDOW)
+            self.match_rate += weight * (rate - self.match_rate)
+
+    def _on_queue_event(self, event: QueueEvent) -> None:
+        """
+        Called by the queue in the thread changing it, hands the changes of the subscribed players over to the event loop.
+        """
+        if event.type == QueueEventType.MATCHED:
+            self._matched_count += 1
+
+        if event.type != QueueEventType.ENQUEUED and event.profile_id in self._subscriptions and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._on_subscribed_player_left, event)
+
+    def _on_subscribed_player_left(self, event: QueueEvent) -> None:
+        if event.type == QueueEventType.MATCHED and event.profile_id in self._subscriptions:
+            self._matched_ids.setdefault(event.profile_id, 0)
+
+        self._wakeup.set()
@@ -1,31 +1,233 @@
+import gc
 import logging
+import random
+import threading
+import time
 import numpy as np
 import pandas as pd
-from joblib import load
 from xgboost import XGBClassifier
-from core import get_model_path
+from core import metrics_registry, settings
+from .candidate_index import CandidateIndex
+from .features import CLUSTER_FEATURE_COLUMNS
+from .inference import InferenceBackend
+from .model_artifacts import ModelArtifacts, load_model_artifacts
+from .pipeline import build_new_players_df
+from .player_store import PlayerStore, get_player_store, set_player_store
+from .player_updater import PlayerUpdater
+from .prediction_cache import PredictionCache
+from .queue_journal import QueueJournal
+from .queue_store import QueueEntry, QueueEventType, QueueStore, create_queue_store
+
+FEATURES_SECONDS = metrics_registry.histogram("matchmaking_features_seconds", "Time spent building the match features")
+INFERENCE_SECONDS = metrics_registry.histogram("matchmaking_inference_seconds", "Time spent in one classifier call")
+INFERENCE_PAIRS = metrics_registry.counter("matchmaking_inference_pairs_total", "Pairs scored by the classifier")
+SELECTION_SECONDS = metrics_registry.histogram("matchmaking_selection_seconds", "Time spent selecting opponents from the scored candidates", ("mode",))
+PAIR_SECONDS = metrics_registry.histogram("matchmaking_pair_seconds", "Time spent finding a match for a player")
+PAIR_BATCH_SECONDS = metrics_registry.histogram("matchmaking_pair_batch_seconds", "Time spent finding the matches of several players at once")
+QUEUE_OPERATION_SECONDS = metrics_registry.histogram("matchmaking_queue_operation_seconds", "Time spent adding or removing a player from the queue", ("operation",))
+MATCHES = metrics_registry.counter("matchmaking_matches_total", "Formed matches", ("method",))
+MATCH_WAIT_SECONDS = metrics_registry.histogram(
+    "matchmaking_match_wait_seconds",
+    "Time the matched players waited in the queue",
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+MODEL_RELOADS = metrics_registry.counter("matchmaking_model_reloads_total", "Hot reloads of the classifier and the players data", ("result",))
 
 class Matchmaker:
-    classifier_model: XGBClassifier
-    players_df: pd.DataFrame
+    artifacts: ModelArtifacts
+    """The classifier and the players data currently served, replaced as a whole by a hot reload"""
+    prediction_cache: PredictionCache
     is_model_loaded = False
-    players_queue: list[int]
+    players_queue: QueueStore
+    """Queue of the players waiting for a match, selected by the `queue_backend` setting"""
+    queue_journal: QueueJournal | None = None
+    """Journal the in-memory queue is recovered from after a restart, None if the `queue_journal_dir` setting is not set"""
+    candidate_index: CandidateIndex
+    """Index of the queued players by features, narrowing the candidates scored for a player"""
+    candidate_limit: int
+    """Maximum number of queued opponents scored for one player, 0 to score all of them"""
+    elo_window: float
+    """Initial maximum rating difference of the ELO fallback matchmaking"""
+    elo_window_growth: float
+    """Rating points the ELO fallback window widens by per second of waiting"""
     logger = logging.getLogger()
 
+    MAX_CLAIM_ATTEMPTS = 3
+    """Number of opponents tried when the chosen ones are matched first by another process sharing the queue"""
+
+    def __init__(
+        self,
+        player_store: PlayerStore | None = None,
+        prediction_cache: PredictionCache | None = None,
+        players_queue: QueueStore | None = None,
+    ) -> None:
+        """
+        Args:
+            player_store: The players data store. Defaults to the store shared by the whole process.
+            prediction_cache: The cache of predicted pair probabilities. Defaults to a new cache, symmetric if set in the settings.
+            players_queue: The queue of the players waiting for a match. Defaults to the store selected by the settings.
+        """
+        self.artifacts = ModelArtifacts(None, None, player_store if player_store is not None else get_player_store())
+        self.prediction_cache = prediction_cache if prediction_cache is not None else PredictionCache(symmetric=settings.prediction_cache_symmetric)
+        self.player_updater = PlayerUpdater(self.player_store)
+        self.players_queue = players_queue if players_queue is not None else create_queue_store(settings.queue_backend, settings.queue_sqlite_path)
+        self.queue_lock = threading.RLock()
+        self.candidate_index = CandidateIndex(self.players_queue, settings.candidate_index_max_age if self.players_queue.is_shared else None)
+        self.candidate_limit = settings.candidate_limit
+        self.elo_window = settings.elo_window
+        self.elo_window_growth = settings.elo_window_growth
+
+    @property
+    def classifier_model(self) -> XGBClassifier:
+        """The classifier predicting the match outcomes."""
+        return self.artifacts.classifier_model
+
+    @property
+    def inference_backend(self) -> InferenceBackend:
+        """The backend evaluating the classifier, selected by the `inference_backend` setting."""
+        return self.artifacts.inference_backend
+
+    @property
+    def player_store(self) -> PlayerStore:
+        """The players data store."""
+        return self.artifacts.player_store
+
+    @property
+    def players_df(self) -> pd.DataFrame:
+        """The players DataFrame held by the player store."""
+        return self.player_store.players_df
+
     def load_models(self) -> None:
         """
-        Load the classifier model and the players DataFrame from disk.
+        Load the classifier model and the players data from disk.
+        Use `reload_models` to replace them once they are loaded.
         """
         if self.is_model_loaded:
             return
 
-        self.classifier_model = load(get_model_path("classifier_model.xgb"))
-        self.players_df = pd.read_csv(get_model_path("clustered_players.csv"))
-        self.players_queue = self.players_df["profile_id"].tolist() # TODO: Initialize queue with all players, for real scenario this should be empty
+        self.artifacts = load_model_artifacts(inference_backend=settings.inference_backend, player_store=self.player_store)
+        store = self.player_store
+
+        # A shared queue outlives the process by itself
+        if settings.queue_journal_dir and not self.players_queue.is_shared:
+            self.queue_journal = QueueJournal(settings.queue_journal_dir, settings.queue_journal_flush_interval, settings.queue_journal_compact_events)
+            self._recover_queue(self.queue_journal)
+        else:
+            self.players_queue.add_many(zip(store.profile_ids.tolist(), store.clusters.tolist(), store.ratings.tolist())) # TODO: Initialize queue with all players, for real scenario this should be empty
+
+        self.candidate_index.invalidate()
         self.is_model_loaded = True
         self.logger.info("Models loaded successfully")
         self.logger.info(f"Players data shape: {self.players_df.shape}")
 
+    def _recover_queue(self, queue_journal: QueueJournal) -> None:
+        """
+        Restore the queued players from the journal with their enqueue times and start journaling the queue.
+        The clusters and the ratings are taken from the players data, players missing in it are left out.
+        """
+        started_at = time.perf_counter()
+        store = self.player_store
+        recovered = queue_journal.recover()
+        recovered = recovered[np.isin(recovered["profile_id"], store.profile_ids)]
+        profile_ids = recovered["profile_id"].tolist()
+        rows = store.get_rows(profile_ids)
+        entries = zip(profile_ids, store.clusters[rows].tolist(), store.ratings[rows].tolist())
+
+        # The restored entries live as long as they are queued, collecting while creating them only costs time
+        is_gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            with self.queue_lock:
+                restored_count = self.players_queue.add_many(entries, recovered["enqueued_at"].tolist())
+                queue_journal.start(self.players_queue)
+        finally:
+            if is_gc_enabled:
+                gc.enable()
+
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        self.logger.info(f"Recovered {restored_count} queued players from the queue journal in {elapsed_ms:.0f} ms")
+
+    def load_artifacts(self, model_path: str | None = None, players_path: str | None = None) -> ModelArtifacts:
+        """
+        Load and validate a new version of the classifier and the players data without serving it.
+        Safe to call from a background thread while the current version serves requests.
+        Args:
+            model_path: The path to the pickled classifier, `classifier_model.xgb` in the models directory by default.
+            players_path: The path to the players CSV file, `clustered_players.csv` in the models directory by default.
+        Returns:
+            The loaded artifacts, to be passed to `swap_artifacts`.
+        Raises:
+            ValueError: If the artifacts are invalid.
+            OSError: If a file cannot be read.
+        """
+        try:
+            return load_model_artifacts(model_path, players_path, settings.inference_backend, version=self.artifacts.version + 1)
+        except (ValueError, OSError):
+            MODEL_RELOADS.inc(1, "failed")
+            raise
+
+    def swap_artifacts(self, artifacts: ModelArtifacts) -> None:
+        """
+        Start serving new artifacts, keeping the queue.
+        Queued players missing in the new players data leave the queue, the others keep their position
+        with their new cluster and rating. All cached predictions are dropped since they came from the previous version.
+        Args:
+            artifacts: The artifacts returned by `load_artifacts`.
+        """
+        with self.queue_lock:
+            previous = self.artifacts
+            self.artifacts = artifacts
+            self.player_updater = PlayerUpdater(artifacts.player_store)
+            self.prediction_cache.clear()
+
+            # The services reading the shared store, e.g. the players queries, switch to the new players data too
+            if previous.player_store is get_player_store():
+                set_player_store(artifacts.player_store)
+
+            removed_count = self._sync_queue()
+            self.is_model_loaded = True
+
+        MODEL_RELOADS.inc(1, "succeeded")
+        self.logger.info(f"Serving models version {artifacts.version} with {len(artifacts.player_store)} players, {removed_count} queued players not found in the new players data were removed from the queue")
+
+    def reload_models(self, model_path: str | None = None, players_path: str | None = None) -> ModelArtifacts:
+        """
+        Load, validate and start serving a new version of the classifier and the players data, keeping the queue.
+        The current version keeps serving if the new one fails to load.
+        Args:
+            model_path: The path to the pickled classifier, `classifier_model.xgb` in the models directory by default.
+            players_path: The path to the players CSV file, `clustered_players.csv` in the models directory by default.
+        Returns:
+            The new artifacts.
+        Raises:
+            ValueError: If the artifacts are invalid.
+            OSError: If a file cannot be read.
+        """
+        artifacts = self.load_artifacts(model_path, players_path)
+        self.swap_artifacts(artifacts)
+        return artifacts
+
+    def _sync_queue(self) -> int:
+        """
+        Update the clusters and the ratings of the queued players from the current players data.
+        Returns:
+            The number of queued players removed because they are missing in the players data.
+        """
+        store = self.player_store
+        removed_count = 0
+
+        for entry in self.players_queue.entries():
+            row = store.get_row(entry.profile_id)
+
+            if row is None:
+                self.players_queue.remove(entry.profile_id)
+                removed_count += 1
+            else:
+                self.players_queue.update(entry.profile_id, int(store.clusters[row]), float(store.ratings[row]))
+
+        return removed_count
+
     def add_player_to_queue(self, player_id: int) -> bool:
         """
         Add a player to the queue.
@@ -35,33 +237,56 @@ class Matchmaker:
             True if the player was successfully added to the queue, False otherwise.
         """
         # Check if player exists
-        player_exists = (self.players_df["profile_id"] == player_id).any()
+        row = self.player_store.get_row(player_id)
 
-        if not player_exists:
+        if row is None:
             self.logger.error(f"Player {player_id} not found in the database")
             return False
-        
-        # Add player to queue
-        self.players_queue.append(player_id)
-        self.logger.info(f"Player {player_id} added to queue")
+
+        # Add player to queue, joining twice keeps the original position
+        cluster = int(self.player_store.clusters[row])
+        rating = float(self.player_store.ratings[row])
+
+        with self.queue_lock, QUEUE_OPERATION_SECONDS.time("add"):
+            is_added = self.players_queue.add(player_id, cluster, rating)
+
+        if is_added:
+            self.logger.debug(f"Player {player_id} added to queue")
+        else:
+            self.logger.debug(f"Player {player_id} is already in the queue")
+
         return True
-    
-    def remove_player_from_queue(self, player_id: int) -> bool:
+
+    def remove_player_from_queue(self, player_id: int, event_type: QueueEventType = QueueEventType.DEQUEUED) -> bool:
         """
         Remove a player from the queue.
         Args:
             player_id: The profile ID of the player to remove from the queue.
+            event_type: The reason of the removal reported to the queue listeners.
         Returns:
             True if the player was successfully removed from the queue, False otherwise.
         """
-        try:
-            self.players_queue.remove(player_id)
-            self.logger.info(f"Player {player_id} removed from queue")
-            return True
-        except ValueError:
+        with self.queue_lock, QUEUE_OPERATION_SECONDS.time("remove"):
+            entry = self.players_queue.remove(player_id, event_type)
+
+        if entry is None:
             self.logger.error(f"Player {player_id} not found in the queue")
             return False
 
+        if event_type == QueueEventType.MATCHED:
+            self.observe_match_wait(entry)
+
+        self.logger.debug(f"Player {player_id} removed from queue")
+        return True
+
+    def observe_match_wait(self, entry: QueueEntry) -> None:
+        """
+        Record the time a matched player waited in the queue.
+        Args:
+            entry: The queue entry of the player removed with a match.
+        """
+        MATCH_WAIT_SECONDS.observe(self.players_queue.clock() - entry.enqueued_at)
+
     def predict_match_outcome(self, player_id_A: int, player_id_B: int) -> float:
         """
         Predict the probability that player A wins against player B.
@@ -73,22 +298,98 @@ class Matchmaker:
         """
         if not self.is_model_loaded:
             raise ValueError("Models are not loaded. Call load_models() first.")
-        
-        self.logger.info(f"Predicting match outcome between {player_id_A} and {player_id_B}")
 
-        # Retrieve players info
-        pA: pd.Series = self.players_df.loc[self.players_df["profile_id"] == player_id_A].squeeze()
-        pB: pd.Series = self.players_df.loc[self.players_df["profile_id"] == player_id_B].squeeze()
-        
+        cached_prob, cache_key = self.prediction_cache.get(player_id_A, player_id_B, self.artifacts.version)
+
+        if cached_prob is not None:
+            return cached_prob
+
+        # Retrieve players rows
+        row_A = self._get_player_row(player_id_A)
+        row_B = self._get_player_row(player_id_B)
+
         # Extract features
-        X_match = self._get_match_features(pA, pB)
-        
+        X_match = self._get_match_features(row_A, row_B)
+
         # Predict probability that A wins
-        prob = self.classifier_model.predict_proba(X_match)[:,1]
-        self.logger.info(f"Predicted probability that {pA["name"]} (ID: {player_id_A}) wins against {pB["name"]} (ID: {player_id_B}): {prob}")
+        prob = float(self._predict_proba(X_match)[0])
+        self.prediction_cache.put(cache_key, prob)
+
+        if self._is_debug_sampled():
+            self.logger.debug(f"Predicted probability that player {player_id_A} wins against player {player_id_B}: {prob}")
+
         return prob
-    
-    def find_match_for_player(self, profile_id: int, target=0.5, tolerance=0.1) -> dict:
+
+    def predict_match_outcomes(self, player_ids_A: list[int], player_ids_B: list[int]) -> np.ndarray:
+        """
+        Predict the probabilities that players A win against players B, pair by pair.
+        Cached pairs are served from the prediction cache, the rest are scored using a single model call.
+        Args:
+            player_ids_A: The profile IDs of players A.
+            player_ids_B: The profile IDs of players B, the same length as `player_ids_A`.
+        Returns:
+            The array of probabilities that each player A wins against the corresponding player B.
+        """
+        if not self.is_model_loaded:
+            raise ValueError("Models are not loaded. Call load_models() first.")
+
+        rows_A = np.array([self._get_player_row(pid) for pid in player_ids_A], dtype=np.intp)
+        rows_B = np.array([self._get_player_row(pid) for pid in player_ids_B], dtype=np.intp)
+        probs = np.full(len(rows_A), np.nan)
+        cache_keys = []
+        artifacts_version = self.artifacts.version
+
+        for i, (player_id_A, player_id_B) in enumerate(zip(player_ids_A, player_ids_B)):
+            cached_prob, cache_key = self.prediction_cache.get(player_id_A, player_id_B, artifacts_version)
+            cache_keys.append(cache_key)
+
+            if cached_prob is not None:
+                probs[i] = cached_prob
+
+        missing = np.flatnonzero(np.isnan(probs))
+
+        if len(missing) > 0:
+            probs[missing] = self.predict_match_outcomes_by_rows(rows_A[missing], rows_B[missing])
+
+            self.prediction_cache.put_many([cache_keys[i] for i in missing.tolist()], probs[missing])
+
+        return probs
+
+    def predict_match_outcomes_by_rows(self, rows_A: np.ndarray, rows_B: np.ndarray, artifacts: ModelArtifacts | None = None) -> np.ndarray:
+        """
+        Predict the probabilities that players A win against players B, pair by pair, using a single model call.
+        The prediction cache is bypassed, which suits large one-off batches.
+        Args:
+            rows_A: The row indices of players A in the player store.
+            rows_B: The row indices of players B in the player store, the same length as `rows_A`.
+            artifacts: The artifacts the rows come from, the current ones by default.
+                Requests spanning many calls pass the artifacts they started with to be unaffected by a hot reload.
+        Returns:
+            The array of probabilities that each player A wins against the corresponding player B.
+        """
+        artifacts = artifacts if artifacts is not None else self.artifacts
+
+        with FEATURES_SECONDS.time():
+            features = artifacts.player_store.features
+            X_matches = np.hstack((features[rows_A], features[rows_B]))
+
+        return self.predict_match_outcomes_by_features(X_matches, artifacts)
+
+    def predict_match_outcomes_by_features(self, X_matches: np.ndarray, artifacts: ModelArtifacts | None = None) -> np.ndarray:
+        """
+        Predict the probabilities that players A win from prepared match features, using a single model call.
+        The prediction cache is bypassed, e.g. for the aggregated features of teams.
+        Args:
+            X_matches: The match features of shape (N, 28), the features of player A followed by the features of player B
+                in `MATCH_FEATURE_COLUMNS` order.
+            artifacts: The artifacts whose classifier scores the features, the current ones by default.
+        Returns:
+            The array of probabilities that each player A wins.
+        """
+        artifacts = artifacts if artifacts is not None else self.artifacts
+        return self._predict_proba(X_matches, artifacts.inference_backend)
+
+    def find_match_for_player(self, profile_id: int, target=0.5, tolerance=0.1) -> dict | None:
         """
         Find a match for a player in the queue.
         Args:
@@ -101,139 +402,450 @@ class Matchmaker:
         if not self.is_model_loaded:
             raise ValueError("Models are not loaded. Call load_models() first.")
 
+        with self.queue_lock, PAIR_SECONDS.time():
+            return self._find_match_for_player(profile_id, target, tolerance)
+
+    def find_matches_for_players(self, profile_ids: list[int], target=0.5, tolerance=0.1) -> list[dict | None]:
+        """
+        Find matches for several players in order, e.g. the pair requests that arrived together.
+        The candidates of all the players are scored in one model call, then the players claim their opponents in order:
+        a player whose best opponent was claimed by a previous player takes the next best one,
+        and a player left without a candidate within the tolerance is paired like in `find_match_for_player`,
+        mostly from the cached predictions.
+        Args:
+            profile_ids: The profile IDs of the players for whom to find a match.
+            target: The target probability that the opponent will win.
+            tolerance: The maximum difference between the target probability and the predicted probability.
+        Returns:
+            The match data of every player in the same format as `find_match_for_player`, None for the players without a match.
+        Raises:
+            ValueError: If the models are not loaded or a player does not exist.
+        """
+        if not self.is_model_loaded:
+            raise ValueError("Models are not loaded. Call load_models() first.")
+
+        with self.queue_lock, PAIR_BATCH_SECONDS.time():
+            store = self.player_store
+            player_rows = [self._get_player_row(profile_id) for profile_id in profile_ids]
+            queued = [profile_id in self.players_queue for profile_id in profile_ids]
+            candidate_rows = [
+                store.get_rows(self._collect_candidates(profile_id, player_row, int(store.clusters[player_row]), is_queued))
+                for profile_id, player_row, is_queued in zip(profile_ids, player_rows, queued)
+            ]
+            candidate_probs = self._predict_candidates(player_rows, candidate_rows)
+
+            return [
+                self._claim_best_candidate(*args, target, tolerance)
+                for args in zip(profile_ids, player_rows, queued, candidate_rows, candidate_probs)
+            ]
+
+    def _predict_candidates(self, player_rows: list[int], candidate_rows: list[np.ndarray]) -> list[np.ndarray]:
+        """
+        Predict the probabilities that every player wins against each of its candidates.
+        Cached pairs are served from the prediction cache, the rest of all the players are scored using a single model call.
+        Returns:
+            The array of probabilities of every player, in the order of its candidates.
+        """
+        artifacts = self.artifacts
+        profile_ids = artifacts.player_store.profile_ids
+        candidate_probs: list[np.ndarray] = []
+        missing_rows_A: list[np.ndarray] = []
+        missing_rows_B: list[np.ndarray] = []
+        missing_keys: list = []
+
+        for player_row, rows in zip(player_rows, candidate_rows):
+            probs, missing, cache_keys = self.prediction_cache.get_many(int(profile_ids[player_row]), profile_ids[rows].tolist(), artifacts.version)
+            candidate_probs.append(probs)
+            missing_rows_A.append(np.full(int(missing.sum()), player_row, dtype=np.intp))
+            missing_rows_B.append(rows[missing])
+            missing_keys.extend(key for key, m in zip(cache_keys, missing) if m)
+
+        if missing_keys:
+            missing_probs = self.predict_match_outcomes_by_rows(np.concatenate(missing_rows_A), np.concatenate(missing_rows_B), artifacts)
+            self.prediction_cache.put_many(missing_keys, missing_probs)
+            offset = 0
+
+            for probs in candidate_probs:
+                missing = np.isnan(probs)
+                missing_count = int(missing.sum())
+                probs[missing] = missing_probs[offset:offset + missing_count]
+                offset += missing_count
+
+        return candidate_probs
+
+    def _claim_best_candidate(
+        self,
+        profile_id: int,
+        player_row: int,
+        is_queued: bool,
+        candidate_rows: np.ndarray,
+        probs: np.ndarray,
+        target: float,
+        tolerance: float,
+    ) -> dict | None:
+        """
+        Claim the best scored candidate of a player still in the queue, see `find_matches_for_players`.
+        """
+        # The player was matched by a previous player, pair it again like a single request would
+        if (profile_id in self.players_queue) != is_queued:
+            return self._find_match_for_player(profile_id, target, tolerance)
+
+        candidate_ids: list[int] = self.player_store.profile_ids[candidate_rows].tolist()
+        diffs = np.abs(probs - target)
+        diffs[diffs > tolerance] = np.inf
+        # Skip the candidates claimed by the previous players
+        diffs[np.array([candidate_id not in self.players_queue for candidate_id in candidate_ids], dtype=bool)] = np.inf
+
+        for _ in range(self.MAX_CLAIM_ATTEMPTS):
+            best_diff = diffs.min() if len(diffs) > 0 else np.inf
+
+            if not np.isfinite(best_diff):
+                break
+
+            # Break ties randomly to avoid always picking the same candidate
+            best_idx = np.random.choice(np.flatnonzero(diffs == best_diff))
+
+            if self._claim_match(profile_id, candidate_ids[best_idx], is_queued):
+                MATCHES.inc(1, "cluster")
+                return {
+                    "player_1": self.players_df.iloc[player_row].to_dict(),
+                    "player_2": self.players_df.iloc[candidate_rows[best_idx]].to_dict(),
+                    "player_1_win_prob": float(probs[best_idx]),
+                }
+
+            if is_queued and profile_id not in self.players_queue:
+                return None
+
+            diffs[best_idx] = np.inf
+
+        return self._find_match_for_player(profile_id, target, tolerance)
+
+    def _find_match_for_player(self, profile_id: int, target: float, tolerance: float) -> dict | None:
+        player_row = self._get_player_row(profile_id)
+        player: pd.Series = self.players_df.iloc[player_row]
+        is_queued = profile_id in self.players_queue
+        is_logged = self._is_debug_sampled()
+
+        for _ in range(self.MAX_CLAIM_ATTEMPTS):
+            selection = self._select_opponent(profile_id, player_row, target, tolerance, is_queued, is_logged)
+
+            if selection is None:
+                return None
+
+            best_partner, last_prob, method = selection
+
+            # Remove matched players from the queue
+            if self._claim_match(profile_id, best_partner["profile_id"], is_queued):
+                MATCHES.inc(1, method)
+                return {
+                    "player_1": player.to_dict(),
+                    "player_2": best_partner,
+                    "player_1_win_prob": last_prob
+                }
+
+            # The player itself was matched by another process
+            if is_queued and profile_id not in self.players_queue:
+                return None
+
+            self.logger.debug(f"Opponent {best_partner["profile_id"]} of player {profile_id} was matched by another process, trying the next one")
+
+        return None
+
+    def _select_opponent(self, profile_id: int, player_row: int, target: float, tolerance: float, is_queued: bool, is_logged: bool) -> tuple[dict, float, str] | None:
+        """
+        Choose the opponent of a player among the queued players.
+        Returns:
+            The opponent player data, the probability that the player wins and the matching method (`cluster` or `elo`),
+            or None if no opponent is available.
+        """
         # Find player's cluster
-        player: pd.Series = self.players_df.loc[self.players_df["profile_id"] == profile_id].squeeze()
-        player_cluster: int = player["cluster"]
-        self.logger.info(f"Trying to match player '{player["name"]}' (ID: {profile_id}) from cluster {player_cluster}")
-        
+        player: pd.Series = self.players_df.iloc[player_row]
+        player_cluster = int(self.player_store.clusters[player_row])
+
+        if is_logged:
+            self.logger.debug(f"Trying to match player '{player["name"]}' (ID: {profile_id}) from cluster {player_cluster}")
+
+        cluster_rows = self.player_store.get_rows(self._collect_candidates(profile_id, player_row, player_cluster, is_queued))
+
+        # Score all candidates at once and pick the one closest to the target probability
+        if len(cluster_rows) > 0:
+            probs = self._predict_match_outcomes(player_row, cluster_rows)
+
+            with SELECTION_SECONDS.time("single"):
+                diffs = np.abs(probs - target)
+                diffs[diffs > tolerance] = np.inf
+                best_diff = diffs.min()
+
+                if np.isfinite(best_diff):
+                    # Break ties randomly to avoid always picking the same candidate
+                    best_idx = np.random.choice(np.flatnonzero(diffs == best_diff))
+                    best_partner = self.players_df.iloc[cluster_rows[best_idx]].to_dict()
+                    last_prob = float(probs[best_idx])
+
+                    if is_logged:
+                        self.logger.debug(f"Matched '{player["name"]}' (ID: {profile_id}) with '{best_partner["name"]}' (ID: {best_partner["profile_id"]}) using cluster, win probability {last_prob}")
+
+                    return best_partner, last_prob, "cluster"
+
+        # If no perfect match found, use ELO rating to find an opponent
+        if is_logged:
+            self.logger.debug(f"No perfect match found for '{player["name"]}' (ID: {profile_id}). Trying to find an opponent using ELO rating")
+
+        best_partner = self._find_opponent_using_elo(profile_id)
+
+        if best_partner is None:
+            return None
+
+        return best_partner, self.predict_match_outcome(profile_id, best_partner["profile_id"]), "elo"
+
+    def _collect_candidates(self, profile_id: int, player_row: int, player_cluster: int, is_queued: bool) -> list[int]:
+        """
+        Collect the queued opponents to score for a player: the players of the same cluster,
+        or all the queued players if nobody else is in the cluster.
+        When they are more than `candidate_limit`, only the queued players with the most similar features are kept,
+        searched within the cluster unless the cluster is empty.
+        Returns:
+            The profile IDs of the candidates, excluding the player itself.
+        """
+        queue = self.players_queue
+        limit = self.candidate_limit
+
+        if 0 < limit < queue.cluster_size(player_cluster) - is_queued:
+            return self.candidate_index.nearest(self.player_store, player_row, limit, exclude=profile_id, cluster=player_cluster)
+
         # Collect candidates from the queue in the same cluster (excluding the player itself)
-        candidates = [pid for pid in self.players_queue if pid != profile_id]
-        cluster_candidates = self.players_df.loc[self.players_df["profile_id"].isin(candidates) & (self.players_df["cluster"] == player_cluster)]
-        
+        candidate_ids = [pid for pid in queue.cluster_members(player_cluster) if pid != profile_id]
+
         # If no candidates in same cluster, we can relax and consider all candidates
-        if cluster_candidates.empty:
-            cluster_candidates = self.players_df.loc[self.players_df["profile_id"].isin(candidates)]
-        
-        # Shuffle the candidates to avoid always picking the same one
-        cluster_candidates = cluster_candidates.sample(frac=1)
-
-        # Attempt to find the best partner
-        best_partner: dict | None = None
-        best_diff = float("inf")
-        last_prob: float | None = None # Store the last probability for logging
-
-        for _, opponent in cluster_candidates.iterrows():
-            self.logger.info(f"Trying to match '{player["name"]}' (ID: {profile_id}) with '{opponent["name"]}' (ID: {opponent["profile_id"]})")
-            prob = self.predict_match_outcome(profile_id, opponent["profile_id"])
-            diff = abs(prob - target)
-
-            if diff < best_diff and diff <= tolerance:
-                best_diff = diff
-                best_partner = opponent.to_dict()
-                last_prob = prob
-        
-        if best_partner is not None:
-            self.logger.info(f"Matched '{player["name"]}' (ID: {profile_id}) with '{best_partner["name"]}' (ID: {best_partner["profile_id"]}) using cluster")
-            self.logger.info(f"The probability that {player["name"]} wins against {best_partner["name"]} is {last_prob}")
+        if not candidate_ids:
+            if 0 < limit < len(queue) - is_queued:
+                return self.candidate_index.nearest(self.player_store, player_row, limit, exclude=profile_id)
+
+            candidate_ids = [pid for pid in queue if pid != profile_id]
+
+        return candidate_ids
+
+    def _claim_match(self, profile_id: int, opponent_id: int, is_queued: bool) -> bool:
+        """
+        Remove a matched player and the opponent from the queue at once.
+        A player pairing from outside the queue only claims the opponent.
+        Returns:
+            False if another process sharing the queue matched one of them first.
+        """
+        if is_queued:
+            entries = self.players_queue.claim_pair(profile_id, opponent_id)
         else:
-            # If no perfect match found, use ELO rating to find an opponent
-            self.logger.info(f"No perfect match found for '{player["name"]}' (ID: {profile_id}). Trying to find an opponent using ELO rating")
-            best_partner = self._find_opponent_using_elo(profile_id)
-            last_prob = self.predict_match_outcome(profile_id, best_partner["profile_id"])
-
-        # Remove matched players from the queue
-        self.remove_player_from_queue(profile_id)
-        self.remove_player_from_queue(best_partner["profile_id"])
-        return {
-            "player_1": player.to_dict(),
-            "player_2": best_partner,
-            "player_1_win_prob": last_prob
-        }
-            
+            entry = self.players_queue.remove(opponent_id, QueueEventType.MATCHED)
+            entries = None if entry is None else (entry,)
+
+        if entries is None:
+            return False
+
+        for entry in entries:
+            self.observe_match_wait(entry)
+
+        self.logger.debug(f"Players {profile_id} and {opponent_id} removed from queue")
+        return True
+
+    def _predict_match_outcomes(self, player_row: int, opponent_rows: np.ndarray) -> np.ndarray:
+        """
+        Predict the probabilities that a player wins against each of the given opponents.
+        Cached pairs are served from the prediction cache, the rest are scored using a single model call.
+        Args:
+            player_row: The row index of the player in the player store.
+            opponent_rows: The row indices of the opponents in the player store.
+        Returns:
+            The array of probabilities that the player wins against each opponent.
+        """
+        profile_ids = self.player_store.profile_ids
+        player_id = int(profile_ids[player_row])
+        opponent_ids: list[int] = profile_ids[opponent_rows].tolist()
+        probs, missing, cache_keys = self.prediction_cache.get_many(player_id, opponent_ids, self.artifacts.version)
+
+        if missing.any():
+            X_matches = self._get_match_features_batch(player_row, opponent_rows[missing])
+            missing_probs = self._predict_proba(X_matches)
+            probs[missing] = missing_probs
+            self.prediction_cache.put_many([key for key, m in zip(cache_keys, missing) if m], missing_probs)
+
+        return probs
+
+    def _predict_proba(self, X_matches: np.ndarray, inference_backend: InferenceBackend | None = None) -> np.ndarray:
+        """
+        Score the match features with the inference backend, the current one by default.
+        Returns:
+            The array of probabilities that players A win.
+        """
+        inference_backend = inference_backend if inference_backend is not None else self.inference_backend
+
+        with INFERENCE_SECONDS.time():
+            probs = inference_backend.predict_proba(X_matches)
+
+        INFERENCE_PAIRS.inc(len(X_matches))
+        return probs
+
+    def _is_debug_sampled(self) -> bool:
+        """Whether a hot-path debug message should be logged, only a `debug_log_sample_rate` fraction of them are"""
+        return self.logger.isEnabledFor(logging.DEBUG) and random.random() < settings.debug_log_sample_rate
+
+    def apply_games(self, games: list[dict]) -> list[int]:
+        """
+        Update the stats of the players of finished games and invalidate their cached predictions.
+        Args:
+            games: The finished game records, see `PlayerUpdater.apply_games`.
+        Returns:
+            The profile IDs of the updated players.
+        """
+        with self.queue_lock:
+            updated_ids = self.player_updater.apply_games(games)
+
+            for player_id in set(updated_ids):
+                self.invalidate_player(player_id)
+
+            self._assign_clusters(list(set(updated_ids)))
+
+        if updated_ids:
+            self.logger.info(f"Applied {len(games)} games, updated {len(set(updated_ids))} players")
+
+        return updated_ids
+
+    def register_players(self, players: list[dict]) -> list[int]:
+        """
+        Add players missing in the players data, e.g. newcomers, so they can queue right away.
+        Their clusters are assigned by the cluster model. Players that already exist are skipped.
+        Args:
+            players: The player records, see `build_new_players_df`.
+        Returns:
+            The profile IDs of the added players.
+        """
+        if not self.is_model_loaded:
+            raise ValueError("Models are not loaded. Call load_models() first.")
+
+        with self.queue_lock:
+            store = self.player_store
+            new_players = list({player["profile_id"]: player for player in players if not store.contains(player["profile_id"])}.values())
+
+            if not new_players:
+                return []
+
+            players_df = build_new_players_df(new_players)
+            players_df["cluster"] = self.artifacts.cluster_model.assign_players(players_df)
+            store.add_players(players_df)
+
+        self.logger.info(f"Registered {len(players_df)} new players")
+        return players_df["profile_id"].tolist()
+
+    def _assign_clusters(self, player_ids: list[int]) -> None:
+        """
+        Assign the clusters of players whose stats changed with the cluster model.
+        Queued players move to their new cluster and rating in the queue.
+        """
+        cluster_model = self.artifacts.cluster_model
+
+        if cluster_model is None or not player_ids:
+            return
+
+        store = self.player_store
+        rows = store.get_rows(player_ids)
+        clusters = cluster_model.assign(store.players_df[CLUSTER_FEATURE_COLUMNS].iloc[rows].to_numpy(dtype=np.float64))
+
+        for row, cluster in zip(rows.tolist(), clusters.tolist()):
+            player_id = int(store.profile_ids[row])
+
+            if cluster != store.clusters[row]:
+                store.update_player(player_id, {"cluster": cluster})
+
+            self.players_queue.update(player_id, cluster, float(store.ratings[row]))
+
+    def invalidate_player(self, player_id: int) -> None:
+        """
+        Invalidate the cached predictions involving a player.
+        Must be called whenever the player's stats change.
+        Args:
+            player_id: The profile ID of the player.
+        """
+        self.prediction_cache.invalidate_player(player_id)
+        self.candidate_index.refresh_player(player_id)
+
     def queue_length(self) -> int:
         """
         Get the number of players in the queue waiting for a match.
         """
         return len(self.players_queue)
-    
-    def _find_opponent_using_elo(self, player_id: int) -> dict:
+
+    def find_closest_opponents_by_rating(self, player_id: int, k: int = 1) -> list[QueueEntry]:
+        """
+        Find the queued opponents with the closest ELO ratings to a player's rating.
+        The allowed rating difference starts at `elo_window` and widens by `elo_window_growth`
+        for every second the player has been waiting in the queue.
+        Args:
+            player_id: The profile ID of the player for whom to find opponents.
+            k: The maximum number of opponents to return.
+        Returns:
+            Up to `k` queue entries ordered by the rating difference.
+        """
+        player_elo = float(self.player_store.ratings[self._get_player_row(player_id)])
+        wait_time = self.players_queue.wait_time(player_id) or 0.0
+        max_diff = self.elo_window + self.elo_window_growth * wait_time
+        return self.players_queue.nearest_by_rating(player_elo, k=k, max_diff=max_diff, exclude=player_id)
+
+    def _find_opponent_using_elo(self, player_id: int) -> dict | None:
         """
         Find an opponent for a player with the closest ELO rating.
         Args:
             player_id: The profile ID of the player for whom to find an opponent.
         Returns:
-            The profile ID of the player to match with.
+            The opponent player data, or None if no queued player is within the rating window.
         """
-        # Retrieve player's ELO rating
-        player: pd.Series = self.players_df.loc[self.players_df["profile_id"] == player_id].squeeze()
-        player_elo: float = player["rating"]
+        closest_opponents = self.find_closest_opponents_by_rating(player_id)
 
-        # Find the closest ELO rating to the player's ELO rating
-        opponents = self.players_df.loc[self.players_df["profile_id"] != player_id]
-        #closest_opponent = opponents.iloc[(opponents["rating"] - player_elo).abs().argsort()[:1]]
-        closest_opponent: pd.Series | None = None
+        if closest_opponents:
+            closest_opponent = closest_opponents[0]
+            self.logger.debug(f"Matched player {player_id} with player {closest_opponent.profile_id} using ELO rating")
+            return self.players_df.iloc[self._get_player_row(closest_opponent.profile_id)].to_dict()
 
-        for _, opponent in opponents.iterrows():
-            if opponent["profile_id"] in self.players_queue:
-                closest_opponent = opponent
-                break
-        
-        if closest_opponent is not None:
-            self.logger.info(f"Matched '{player["name"]}' (ID: {player_id}) with '{closest_opponent["name"]}' (ID: {closest_opponent["profile_id"]}) using ELO rating")
-            return closest_opponent.to_dict()
-    
-        self.logger.warning(f"No available opponents in the queue for player '{player["name"]}' (ID: {player_id})")
-        return {}
+        self.logger.warning(f"No available opponents in the queue for player {player_id}")
+        return None
+
+    def _get_player_row(self, player_id: int) -> int:
+        """
+        Get the row index of a player in the player store.
+        Raises:
+            ValueError: If the player does not exist.
+        """
+        row = self.player_store.get_row(player_id)
+
+        if row is None:
+            raise ValueError(f"Player {player_id} not found")
+
+        return row
 
-    def _get_match_features(self, pA: pd.Series, pB: pd.Series) -> np.ndarray:
+    def _get_match_features(self, row_A: int, row_B: int) -> np.ndarray:
         """
         Extract features for the match prediction model.
         Args:
-            pA: The row (Series) from players_df representing player A.
-            pB: The row (Series) from players_df representing player B.
-        Returns:
-            The feature vector for the match prediction model.
-        """
-        # pA and pB are rows (Series) from players_df representing each player.
-        # Extract relevant features as done during training:
-        rating_A = pA["rating"]
-        rating_B = pB["rating"]
-        win_rate_A = pA["win_rate"]
-        win_rate_B = pB["win_rate"]
-        games_count_A = pA["games_count"]
-        games_count_B = pB["games_count"]
-        wins_count_A = pA["wins_count"]
-        wins_count_B = pB["wins_count"]
-        rank_level_encoded_A = pA["rank_level_encoded"]
-        rank_level_encoded_B = pB["rank_level_encoded"]
-        avg_mmr_diff_10_A = pA["avg_mmr_diff_10"]
-        avg_mmr_diff_10_B = pB["avg_mmr_diff_10"]
-        avg_mmr_diff_25_A = pA["avg_mmr_diff_25"]
-        avg_mmr_diff_25_B = pB["avg_mmr_diff_25"]
-        avg_mmr_diff_50_A = pA["avg_mmr_diff_50"]
-        avg_mmr_diff_50_B = pB["avg_mmr_diff_50"]
-        avg_mmr_diff_75_A = pA["avg_mmr_diff_75"]
-        avg_mmr_diff_75_B = pB["avg_mmr_diff_75"]
-        avg_mmr_diff_100_A = pA["avg_mmr_diff_100"]
-        avg_mmr_diff_100_B = pB["avg_mmr_diff_100"]
-        avg_mmr_A = pA["avg_mmr"]
-        avg_mmr_B = pB["avg_mmr"]
-        avg_opp_mmr_A = pA["avg_opp_mmr"]
-        avg_opp_mmr_B = pB["avg_opp_mmr"]
-        avg_game_length_A = pA["avg_game_length"]
-        avg_game_length_B = pB["avg_game_length"]
-        input_type_encoded_A = pA["input_type_encoded"]
-        input_type_encode_B = pB["input_type_encoded"]
-        
-        # Return feature vector in the same order as training
-        features = np.array([[
-            rating_A, win_rate_A, games_count_A, wins_count_A, 
-            rank_level_encoded_A, avg_mmr_diff_10_A, avg_mmr_diff_25_A,
-            avg_mmr_diff_50_A, avg_mmr_diff_75_A, avg_mmr_diff_100_A, 
-            avg_mmr_A, avg_opp_mmr_A, avg_game_length_A, input_type_encoded_A,
-            rating_B, win_rate_B, games_count_B, wins_count_B, 
-            rank_level_encoded_B, avg_mmr_diff_10_B, avg_mmr_diff_25_B, 
-            avg_mmr_diff_50_B, avg_mmr_diff_75_B, avg_mmr_diff_100_B, 
-            avg_mmr_B, avg_opp_mmr_B, avg_game_length_B, input_type_encode_B
-        ]])
-        return features
+            row_A: The row index of player A in the player store.
+            row_B: The row index of player B in the player store.
+        Returns:
+            The feature vector for the match prediction model,
+            player A's features followed by player B's features in the same order as training.
+        """
+        with FEATURES_SECONDS.time():
+            features = self.player_store.features
+            return np.concatenate((features[row_A], features[row_B]))[np.newaxis, :]
+
+    def _get_match_features_batch(self, row_A: int, rows_B: np.ndarray) -> np.ndarray:
+        """
+        Extract features for the match prediction model for player A against many opponents.
+        Args:
+            row_A: The row index of player A in the player store.
+            rows_B: The row indices of the opponents (player B) in the player store.
+        Returns:
+            The feature matrix of shape (len(rows_B), 28), one row per opponent,
+            in the same column order as `_get_match_features`.
+        """
+        with FEATURES_SECONDS.time():
+            features = self.player_store.features
+            features_B = features[rows_B]
+            features_A = np.broadcast_to(features[row_A], features_B.shape)
+            return np.hstack((features_A, features_B))
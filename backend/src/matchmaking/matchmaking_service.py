@@ -0,0 +1,325 @@
+import asyncio
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from enum import StrEnum
+from itertools import groupby
+from .matchmaker import Matchmaker
+from .model_artifacts import ModelArtifacts
+from .team_matchmaker import TeamMatchmaker
+
+class CommandType(StrEnum):
+    ADD_TO_QUEUE = "add_to_queue"
+    REMOVE_FROM_QUEUE = "remove_from_queue"
+    FIND_MATCH = "find_match"
+    APPLY_GAMES = "apply_games"
+    REGISTER_PLAYERS = "register_players"
+    SWAP_ARTIFACTS = "swap_artifacts"
+    PREDICT = "predict"
+    ADD_TO_TEAM_QUEUE = "add_to_team_queue"
+    REMOVE_FROM_TEAM_QUEUE = "remove_from_team_queue"
+    FIND_TEAM_MATCH = "find_team_match"
+
+
+MUTATING_COMMANDS = frozenset((CommandType.APPLY_GAMES, CommandType.REGISTER_PLAYERS, CommandType.SWAP_ARTIFACTS))
+"""Commands changing the players data or the models the predictions and the matches are computed with"""
+
+@dataclass(slots=True)
+class Command:
+    type: CommandType
+    args: tuple
+    future: asyncio.Future = field(repr=False)
+
+
+class MatchmakingService:
+    """
+    Asynchronous front of the `Matchmaker` and the team matchmakers for the API handlers.
+    A single owner task executes the commands in arrival order, so concurrent requests never race
+    on the queue. Commands that arrive while the owner task is busy are drained together and split
+    after every command changing the players data or the models. Within a split, all the predictions
+    are coalesced into one model call, the queue commands run back to back in one worker thread and
+    the consecutive pair requests score their candidates in one model call.
+    Callers await the result of their own command. The matches formed on request are also handed to the match
+    listeners as soon as they are claimed, even if the caller went away meanwhile.
+    """
+    logger = logging.getLogger()
+
+    def __init__(self, matchmaker: Matchmaker, team_matchmakers: dict[int, TeamMatchmaker] | None = None, max_batch_size: int = 256) -> None:
+        """
+        Args:
+            matchmaker: The matchmaker executing the commands.
+            team_matchmakers: The matchmakers of the team ladders by team size, executing the team commands.
+            max_batch_size: The maximum number of commands drained at once.
+        """
+        self.matchmaker = matchmaker
+        self.team_matchmakers = team_matchmakers if team_matchmakers is not None else {}
+        self.max_batch_size = max_batch_size
+        self._commands: asyncio.Queue[Command] | None = None
+        self._owner_task: asyncio.Task | None = None
+        self._reload_lock = asyncio.Lock()
+        self._match_listeners: list[Callable[[dict], None]] = []
+
+    def subscribe_matches(self, listener: Callable[[dict], None]) -> None:
+        """
+        Register a listener called on the event loop with every match formed by a pair request.
+        """
+        self._match_listeners.append(listener)
+
+    async def start(self) -> None:
+        """
+        Start the owner task. Called automatically on the first command.
+        """
+        if self._owner_task is None or self._owner_task.done():
+            self._commands = asyncio.Queue()
+            self._owner_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the owner task. Pending commands are cancelled.
+        """
+        if self._owner_task is None:
+            return
+
+        self._owner_task.cancel()
+
+        try:
+            await self._owner_task
+        except asyncio.CancelledError:
+            pass
+
+        while self._commands is not None and not self._commands.empty():
+            self._commands.get_nowait().future.cancel()
+
+        self._owner_task = None
+
+    async def add_player_to_queue(self, player_id: int) -> bool:
+        return await self._submit(CommandType.ADD_TO_QUEUE, player_id)
+
+    async def remove_player_from_queue(self, player_id: int) -> bool:
+        return await self._submit(CommandType.REMOVE_FROM_QUEUE, player_id)
+
+    async def find_match_for_player(self, player_id: int) -> dict | None:
+        return await self._submit(CommandType.FIND_MATCH, player_id)
+
+    async def predict_match_outcome(self, player_id_A: int, player_id_B: int) -> float:
+        return await self._submit(CommandType.PREDICT, player_id_A, player_id_B)
+
+    async def add_player_to_team_queue(self, team_size: int, player_id: int) -> bool:
+        return await self._submit(CommandType.ADD_TO_TEAM_QUEUE, team_size, player_id)
+
+    async def remove_player_from_team_queue(self, team_size: int, player_id: int) -> bool:
+        return await self._submit(CommandType.REMOVE_FROM_TEAM_QUEUE, team_size, player_id)
+
+    async def find_team_match(self, team_size: int, player_id: int) -> dict | None:
+        return await self._submit(CommandType.FIND_TEAM_MATCH, team_size, player_id)
+
+    async def apply_games(self, games: list[dict]) -> list[int]:
+        return await self._submit(CommandType.APPLY_GAMES, games)
+
+    async def register_players(self, players: list[dict]) -> list[int]:
+        return await self._submit(CommandType.REGISTER_PLAYERS, players)
+
+    async def reload_models(self, model_path: str | None = None, players_path: str | None = None) -> ModelArtifacts:
+        """
+        Hot reload the classifier and the players data without stopping the service.
+        The new version is loaded and validated in a worker thread while the commands keep being served,
+        then swapped in by a command, so the commands before it finish on the previous version,
+        the commands after it run on the new one and the queue is kept. One reload runs at a time.
+        Args:
+            model_path: The path to the pickled classifier, `classifier_model.xgb` in the models directory by default.
+            players_path: The path to the players CSV file, `clustered_players.csv` in the models directory by default.
+        Returns:
+            The new artifacts.
+        Raises:
+            ValueError: If the artifacts are invalid, the previous version keeps serving.
+            OSError: If a file cannot be read, the previous version keeps serving.
+        """
+        async with self._reload_lock:
+            artifacts = await asyncio.to_thread(self.matchmaker.load_artifacts, model_path, players_path)
+            await self._submit(CommandType.SWAP_ARTIFACTS, artifacts)
+            return artifacts
+
+    async def _submit(self, command_type: CommandType, *args):
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._commands.put_nowait(Command(command_type, args, future))
+        return await future
+
+    async def _run(self) -> None:
+        commands = self._commands
+
+        while True:
+            batch = [await commands.get()]
+
+            while len(batch) < self.max_batch_size and not commands.empty():
+                batch.append(commands.get_nowait())
+
+            await self._execute_batch(batch)
+
+    async def _execute_batch(self, batch: list[Command]) -> None:
+        """
+        Execute the drained commands split after every mutating command, so the predictions and the matches
+        requested before it are computed on the players data and the models they arrived on.
+        """
+        start = 0
+
+        for end, command in enumerate(batch, 1):
+            if command.type not in MUTATING_COMMANDS and end < len(batch):
+                continue
+
+            commands = batch[start:end]
+            start = end
+
+            try:
+                results = await asyncio.to_thread(self._execute_commands, commands)
+            except Exception as e:
+                self.logger.exception("Matchmaking commands failed")
+                results = [e] * len(commands)
+
+            self._publish_matches(commands, results)
+            self._resolve(commands, results)
+
+    def _execute_commands(self, commands: list[Command]) -> list:
+        """
+        Run the commands of a split: the coalesced predictions, then the queue commands in arrival order,
+        ending with the mutating command. Returns a result or an exception for each command.
+        """
+        results: list = [None] * len(commands)
+        predictions = [i for i, command in enumerate(commands) if command.type == CommandType.PREDICT]
+        queue_commands = [i for i, command in enumerate(commands) if command.type != CommandType.PREDICT]
+
+        if predictions:
+            try:
+                prediction_results = self._execute_predictions([commands[i] for i in predictions])
+            except Exception as e:
+                prediction_results = [e] * len(predictions)
+
+            for i, result in zip(predictions, prediction_results):
+                results[i] = result
+
+        if queue_commands:
+            for i, result in zip(queue_commands, self._execute_queue_commands([commands[i] for i in queue_commands])):
+                results[i] = result
+
+        return results
+
+    def _execute_queue_commands(self, commands: list[Command]) -> list:
+        """Run the queue commands in arrival order, returning a result or an exception for each"""
+        results = []
+
+        for command_type, group in groupby(commands, key=lambda command: command.type):
+            if command_type == CommandType.FIND_MATCH:
+                results.extend(self._execute_find_matches(list(group)))
+                continue
+
+            for command in group:
+                try:
+                    results.append(self._execute_queue_command(command))
+                except Exception as e:
+                    results.append(e)
+
+        return results
+
+    def _execute_queue_command(self, command: Command):
+        matchmaker = self.matchmaker
+
+        match command.type:
+            case CommandType.ADD_TO_QUEUE:
+                return matchmaker.add_player_to_queue(*command.args)
+            case CommandType.REMOVE_FROM_QUEUE:
+                return matchmaker.remove_player_from_queue(*command.args)
+            case CommandType.APPLY_GAMES:
+                return matchmaker.apply_games(*command.args)
+            case CommandType.REGISTER_PLAYERS:
+                return matchmaker.register_players(*command.args)
+            case CommandType.SWAP_ARTIFACTS:
+                return matchmaker.swap_artifacts(*command.args)
+            case CommandType.ADD_TO_TEAM_QUEUE:
+                team_size, player_id = command.args
+                return self._get_team_matchmaker(team_size).add_player_to_queue(player_id)
+            case CommandType.REMOVE_FROM_TEAM_QUEUE:
+                team_size, player_id = command.args
+                return self._get_team_matchmaker(team_size).remove_player_from_queue(player_id)
+            case CommandType.FIND_TEAM_MATCH:
+                team_size, player_id = command.args
+                return self._get_team_matchmaker(team_size).find_match(player_id)
+
+    def _get_team_matchmaker(self, team_size: int) -> TeamMatchmaker:
+        team_matchmaker = self.team_matchmakers.get(team_size)
+
+        if team_matchmaker is None:
+            raise ValueError(f"Unsupported team size {team_size}")
+
+        return team_matchmaker
+
+    def _execute_find_matches(self, commands: list[Command]) -> list:
+        """Find the matches of consecutive pair requests scoring their candidates together, returning a match, None or an exception for each"""
+        store = self.matchmaker.player_store
+        results: list = [None] * len(commands)
+        valid: list[int] = []
+
+        # Reject the unknown players, so they do not fail the other requests
+        for i, command in enumerate(commands):
+            if store.contains(command.args[0]):
+                valid.append(i)
+            else:
+                results[i] = ValueError(f"Player {command.args[0]} not found")
+
+        if valid:
+            try:
+                matches = self.matchmaker.find_matches_for_players([commands[i].args[0] for i in valid])
+            except Exception as e:
+                matches = [e] * len(valid)
+
+            for i, match in zip(valid, matches):
+                results[i] = match
+
+        return results
+
+    def _execute_predictions(self, commands: list[Command]) -> list:
+        """Score all the predictions with one model call, returning a probability or an exception for each"""
+        store = self.matchmaker.player_store
+        results: list = [None] * len(commands)
+        valid: list[int] = []
+
+        # Reject the pairs with unknown players, so they do not fail the whole batch
+        for i, command in enumerate(commands):
+            missing = [pid for pid in command.args if not store.contains(pid)]
+
+            if missing:
+                results[i] = ValueError(f"Player {missing[0]} not found")
+            else:
+                valid.append(i)
+
+        if valid:
+            probs = self.matchmaker.predict_match_outcomes(
+                [commands[i].args[0] for i in valid],
+                [commands[i].args[1] for i in valid],
+            )
+
+            for i, prob in zip(valid, probs.tolist()):
+                results[i] = prob
+
+        return results
+
+    def _publish_matches(self, commands: list[Command], results: list) -> None:
+        """Hand the matches formed by the pair commands to the match listeners, whether their callers still wait or not"""
+        for command, result in zip(commands, results):
+            if command.type != CommandType.FIND_MATCH or not isinstance(result, dict):
+                continue
+
+            for listener in self._match_listeners:
+                try:
+                    listener(result)
+                except Exception:
+                    self.logger.exception("Matchmaking match listener failed")
+
+    def _resolve(self, commands: list[Command], results: list) -> None:
+        for command, result in zip(commands, results):
+            if command.future.done():
+                continue
+
+            if isinstance(result, Exception):
+                command.future.set_exception(result)
+            else:
+                command.future.set_result(result)
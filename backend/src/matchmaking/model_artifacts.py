@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+import numpy as np
+from joblib import load
+from xgboost import XGBClassifier
+from core import get_model_path
+from .cluster_model import ClusterModel, get_default_cluster_model_path
+from .features import MATCH_FEATURE_COLUMNS
+from .inference import InferenceBackend, SklearnBackend, check_backend_parity, create_inference_backend
+from .player_store import PlayerStore
+
+MATCH_FEATURES_COUNT = len(MATCH_FEATURE_COLUMNS)
+"""Number of the classifier inputs, player A's features followed by player B's features"""
+
+logger = logging.getLogger()
+
+@dataclass(slots=True, frozen=True)
+class ModelArtifacts:
+    """
+    The classifier, the players data and the cluster model the matchmaker serves from.
+    They are loaded and validated together and swapped as one object on a hot reload,
+    so a request holding the artifacts never mixes a model with the players data of another version.
+    """
+    classifier_model: XGBClassifier | None
+    inference_backend: InferenceBackend | None
+    player_store: PlayerStore
+    version: int = 0
+    """Number of the artifacts load, 1 for the artifacts loaded on startup and 0 before loading"""
+
+    loaded_at: float = 0.0
+    """Timestamp when the artifacts were loaded"""
+
+    model_version: str | None = None
+    """Version of the classifier from its schema file written by the training, None for a classifier without schema"""
+
+    cluster_model: ClusterModel | None = None
+    """Assigns the clusters of new and updated players"""
+
+
+def load_model_artifacts(
+    model_path: str | None = None,
+    players_path: str | None = None,
+    inference_backend: str = "inplace",
+    player_store: PlayerStore | None = None,
+    version: int = 1,
+    sample_size: int = 1024,
+    cluster_model_path: str | None = None,
+) -> ModelArtifacts:
+    """
+    Load the classifier, the players data and the cluster model from disk and validate them.
+    Nothing is shared with the artifacts currently served, so this can run in the background.
+    Args:
+        model_path: The path to the pickled classifier, `classifier_model.xgb` in the models directory by default.
+        players_path: The path to the players CSV file, `clustered_players.csv` in the models directory by default.
+        inference_backend: The name of the inference backend evaluating the classifier.
+        player_store: The store to load the players data into, a new store by default.
+        version: The version number of the loaded artifacts.
+        sample_size: The number of random pairs of players the inference backend is checked on.
+        cluster_model_path: The path to the cluster model, `cluster_model.json` in the models directory by default.
+            Without the file the centroids of the players data clusters are used.
+    Returns:
+        The loaded artifacts.
+    Raises:
+        ValueError: If the artifacts are invalid.
+        OSError: If a file cannot be read.
+    """
+    model_path = model_path or get_model_path("classifier_model.xgb")
+
+    try:
+        classifier_model = load(model_path)
+    except OSError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Cannot unpickle the classifier {model_path}: {e}") from e
+
+    if not isinstance(classifier_model, XGBClassifier):
+        raise ValueError(f"Expected an XGBClassifier in {model_path}, got {type(classifier_model).__name__}")
+
+    features_count = getattr(classifier_model, "n_features_in_", None)
+
+    if features_count != MATCH_FEATURES_COUNT:
+        raise ValueError(f"The classifier expects {features_count} features, the match features have {MATCH_FEATURES_COUNT}")
+
+    schema = read_model_schema(model_path)
+
+    player_store = player_store if player_store is not None else PlayerStore()
+
+    try:
+        player_store.load(players_path)
+    except KeyError as e:
+        raise ValueError(f"The players data misses the column {e}") from e
+
+    if len(player_store) < 2:
+        raise ValueError(f"The players data has {len(player_store)} players, at least 2 are required")
+
+    backend = _create_inference_backend(inference_backend, classifier_model, player_store, sample_size)
+    cluster_model = _load_cluster_model(cluster_model_path or get_default_cluster_model_path(), player_store)
+    return ModelArtifacts(classifier_model, backend, player_store, version, time.time(), None if schema is None else schema.get("version"), cluster_model)
+
+def _load_cluster_model(cluster_model_path: str, player_store: PlayerStore) -> ClusterModel:
+    """
+    Load the cluster model, or build the centroids of the players data clusters if the file does not exist.
+    Raises:
+        ValueError: If the cluster model is invalid or assigns labels that are not clusters of the players data.
+    """
+    if os.path.exists(cluster_model_path):
+        cluster_model = ClusterModel.load(cluster_model_path)
+    else:
+        try:
+            cluster_model = ClusterModel.from_labels(player_store.players_df)
+        except KeyError as e:
+            raise ValueError(f"The players data misses the column {e}") from e
+
+        logger.info(f"Cluster model {cluster_model_path} not found, using the centroids of the {len(cluster_model)} clusters of the players data")
+
+    unknown_labels = set(cluster_model.labels.tolist()) - set(np.unique(player_store.clusters).tolist())
+
+    if unknown_labels:
+        raise ValueError(f"The cluster model assigns clusters missing in the players data: {sorted(unknown_labels)}")
+
+    return cluster_model
+
+def get_model_schema_path(model_path: str) -> str:
+    """
+    Get the path to the feature schema file of a classifier, e.g. `classifier_model.schema.json` for `classifier_model.xgb`.
+    """
+    return f"{os.path.splitext(model_path)[0]}.schema.json"
+
+def read_model_schema(model_path: str) -> dict | None:
+    """
+    Read the feature schema file written next to a classifier by the training and check it against the match features.
+    Args:
+        model_path: The path to the pickled classifier.
+    Returns:
+        The schema, or None if the classifier has no schema file, e.g. a classifier trained in the notebook.
+    Raises:
+        ValueError: If the schema is not valid JSON or lists other features than `MATCH_FEATURE_COLUMNS`.
+    """
+    schema_path = get_model_schema_path(model_path)
+
+    if not os.path.exists(schema_path):
+        return None
+
+    try:
+        with open(schema_path, encoding="utf-8") as f:
+            schema: dict = json.load(f)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Cannot parse the classifier schema {schema_path}: {e}") from e
+
+    if schema.get("features") != MATCH_FEATURE_COLUMNS:
+        raise ValueError(f"The classifier schema {schema_path} lists other features than the match features")
+
+    return schema
+
+def _create_inference_backend(name: str, classifier_model: XGBClassifier, player_store: PlayerStore, sample_size: int) -> InferenceBackend:
+    """
+    Create the inference backend and check it against the scikit-learn predictions on random pairs of players.
+    Scoring the pairs also warms the backend up before it serves requests.
+    Raises:
+        ValueError: If the backend is unknown or its predictions are not valid probabilities
+            or differ from the scikit-learn predictions.
+    """
+    reference = SklearnBackend(classifier_model)
+    backend = create_inference_backend(name, classifier_model)
+    rng = np.random.default_rng(0)
+    rows_A = rng.integers(len(player_store), size=sample_size)
+    rows_B = rng.integers(len(player_store), size=sample_size)
+    features = player_store.features
+    X_matches = np.hstack((features[rows_A], features[rows_B]))
+    probs = backend.predict_proba(X_matches)
+
+    if probs.shape != (sample_size,) or not np.all((probs >= 0) & (probs <= 1)):
+        raise ValueError(f"Inference backend '{backend.name}' does not predict probabilities of shape ({sample_size},) within [0, 1]")
+
+    if backend.name != reference.name:
+        max_diff = check_backend_parity(backend, reference, X_matches)
+        logger.info(f"Inference backend '{backend.name}' matches '{reference.name}' within {max_diff:.2e}")
+
+    return backend
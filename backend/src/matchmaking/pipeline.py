@@ -0,0 +1,329 @@
+import argparse
+import gzip
+import json
+import logging
+from collections.abc import Iterator
+from typing import TextIO
+import numpy as np
+import pandas as pd
+from core import get_data_path, get_model_path
+from .cluster_model import ClusterModel, get_default_cluster_model_path
+from .features import INPUT_TYPES, MMR_DIFF_WINDOWS, get_rank_levels
+from .player_snapshot import get_default_snapshot_path, write_player_snapshot
+
+CLUSTERS_COUNT = 25
+"""Number of KMeans clusters of the players, the same as in the BuildModel notebook"""
+
+LEADERBOARD_DEFAULTS = {"rank": 0, "games_count": 0, "wins_count": 0, "last_game_at": "", "country": "unknown"}
+"""Leaderboard values of the new players that are not in the leaderboard dump yet"""
+
+AGGREGATE_NUMERICAL_COLUMNS = [*(f"avg_mmr_diff_{window}" for window in MMR_DIFF_WINDOWS), "avg_mmr", "avg_opp_mmr", "avg_game_length"]
+
+PLAYER_GAME_COLUMNS = ["game_id", "profile_id", "finished_dt", "duration", "mmr", "mmr_diff", "civilization", "input_type"]
+
+READ_BUFFER_SIZE = 1 << 20
+"""Characters read from the games file at once when parsing a JSON array"""
+
+logger = logging.getLogger()
+
+def iter_game_chunks(games_path: str, chunk_size: int) -> Iterator[list[dict]]:
+    """
+    Stream the games from a JSON array file (as downloaded from aoe4world) or a JSON lines file, optionally gzip-compressed.
+    Args:
+        games_path: The path to the games file.
+        chunk_size: The maximum number of games per chunk.
+    Returns:
+        An iterator over chunks of game records, only one chunk is held in memory at a time.
+    """
+    opener = gzip.open if games_path.endswith(".gz") else open
+
+    with opener(games_path, "rt", encoding="utf-8") as file:
+        first_char = _peek_first_char(file)
+        games = _iter_json_array(file) if first_char == "[" else (json.loads(line) for line in file if line.strip())
+        chunk: list[dict] = []
+
+        for game in games:
+            chunk.append(game)
+
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+def _peek_first_char(file: TextIO) -> str:
+    """Get the first non-whitespace character of a file and rewind it"""
+    while True:
+        char = file.read(1)
+
+        if not char or not char.isspace():
+            file.seek(0)
+            return char
+
+def _iter_json_array(file: TextIO) -> Iterator[dict]:
+    """Decode the items of a top-level JSON array one by one, reading the file in bounded pieces"""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_BUFFER_SIZE).lstrip().removeprefix("[")
+    position = 0
+
+    while True:
+        # Skip the separators between the items
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+
+        if position < len(buffer) and buffer[position] == "]":
+            return
+
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+            yield item
+        except json.JSONDecodeError:
+            more = file.read(READ_BUFFER_SIZE)
+
+            if not more:
+                raise
+
+            buffer = buffer[position:] + more
+            position = 0
+
+def flatten_games(games: list[dict]) -> pd.DataFrame:
+    """
+    Flatten game records into one row per player and game with the opponent's MMR.
+    Args:
+        games: The game records, each with the players grouped in a `teams` list of lists.
+    Returns:
+        The player games with the `PLAYER_GAME_COLUMNS` and `opp_mmr` columns.
+        Games with a single player are dropped, they have no opponent.
+    """
+    columns: dict[str, list] = {column: [] for column in PLAYER_GAME_COLUMNS}
+
+    for game in games:
+        for team in game["teams"]:
+            for player_info in team:
+                columns["game_id"].append(game["game_id"])
+                columns["profile_id"].append(player_info["profile_id"])
+                columns["finished_dt"].append(game["finished_at"])
+                columns["duration"].append(game.get("duration"))
+                columns["mmr"].append(player_info.get("mmr"))
+                columns["mmr_diff"].append(player_info.get("mmr_diff"))
+                columns["civilization"].append(player_info.get("civilization"))
+                columns["input_type"].append(player_info.get("input_type"))
+
+    player_games = pd.DataFrame(columns)
+    player_games["finished_dt"] = pd.to_datetime(player_games["finished_dt"], utc=True, format="ISO8601")
+
+    for column in ("duration", "mmr", "mmr_diff"):
+        player_games[column] = pd.to_numeric(player_games[column], errors="coerce")
+
+    # The opponent's MMR is the mean MMR of the other players of the game, i.e. the opponent's MMR in 1v1 games
+    games_mmr = player_games.groupby("game_id")["mmr"]
+    players_count = player_games.groupby("game_id")["profile_id"].transform("size")
+    opp_mmr_count = games_mmr.transform("count") - player_games["mmr"].notna()
+    opp_mmr_sum = games_mmr.transform("sum") - player_games["mmr"].fillna(0)
+    player_games["opp_mmr"] = (opp_mmr_sum / opp_mmr_count).where(opp_mmr_count > 0)
+    return player_games[players_count > 1].reset_index(drop=True)
+
+
+class PlayerAggregator:
+    """
+    Per-player aggregates of the player games accumulated chunk by chunk.
+    Means are kept as running sums and counts, the civilizations as counts and
+    the MMR differences as the last `max(MMR_DIFF_WINDOWS)` games of every player,
+    so the memory is bounded by the number of players rather than the number of games.
+    """
+
+    def __init__(self) -> None:
+        self.tail_size = max(MMR_DIFF_WINDOWS)
+        self._sums: pd.DataFrame | None = None
+        self._civilization_counts: pd.Series | None = None
+        self._first_games: pd.DataFrame | None = None
+        self._tails: pd.DataFrame | None = None
+
+    def update(self, player_games: pd.DataFrame) -> None:
+        """
+        Add a chunk of player games, as returned by `flatten_games`.
+        """
+        grouped = player_games.groupby("profile_id")
+        sums = pd.DataFrame({
+            "mmr_sum": grouped["mmr"].sum(),
+            "mmr_count": grouped["mmr"].count(),
+            "opp_mmr_sum": grouped["opp_mmr"].sum(),
+            "opp_mmr_count": grouped["opp_mmr"].count(),
+            "duration_sum": grouped["duration"].sum(),
+            "duration_count": grouped["duration"].count(),
+        })
+        self._sums = sums if self._sums is None else self._sums.add(sums, fill_value=0)
+
+        civilization_counts = player_games.groupby(["profile_id", "civilization"]).size()
+        self._civilization_counts = civilization_counts if self._civilization_counts is None else self._civilization_counts.add(civilization_counts, fill_value=0)
+
+        first_games = player_games[["profile_id", "finished_dt", "input_type"]]
+        self._first_games = self._keep_first_games(first_games if self._first_games is None else pd.concat([self._first_games, first_games]))
+
+        tails = player_games[["profile_id", "finished_dt", "mmr_diff"]]
+        tails = tails if self._tails is None else pd.concat([self._tails, tails])
+        tails = tails.sort_values(["profile_id", "finished_dt"], kind="stable")
+        self._tails = tails.groupby("profile_id").tail(self.tail_size).reset_index(drop=True)
+
+    def result(self) -> pd.DataFrame:
+        """
+        Get the aggregates of every player seen so far.
+        Returns:
+            The players aggregates with the `profile_id`, `avg_mmr_diff_*`, `avg_mmr`, `avg_opp_mmr`,
+            `avg_game_length`, `common_civ`, `input_type` and `input_type_encoded` columns.
+        """
+        if self._sums is None:
+            raise ValueError("No player games were aggregated")
+
+        sums = self._sums
+        aggregates = pd.DataFrame(index=sums.index)
+        tails = self._tails
+        positions_from_end = tails.groupby("profile_id").cumcount(ascending=False).to_numpy()
+
+        for window in MMR_DIFF_WINDOWS:
+            aggregates[f"avg_mmr_diff_{window}"] = tails[positions_from_end < window].groupby("profile_id")["mmr_diff"].mean()
+
+        aggregates["avg_mmr"] = sums["mmr_sum"] / sums["mmr_count"].replace(0, np.nan)
+        aggregates["avg_opp_mmr"] = sums["opp_mmr_sum"] / sums["opp_mmr_count"].replace(0, np.nan)
+        aggregates["avg_game_length"] = sums["duration_sum"] / sums["duration_count"].replace(0, np.nan)
+
+        # The most played civilization, ties are resolved alphabetically like `Series.mode`
+        civilizations = self._civilization_counts.rename("count").reset_index()
+        civilizations = civilizations.sort_values(["profile_id", "count", "civilization"], ascending=[True, False, True])
+        aggregates["common_civ"] = civilizations.drop_duplicates("profile_id").set_index("profile_id")["civilization"]
+
+        aggregates["input_type"] = self._first_games.set_index("profile_id")["input_type"]
+        aggregates["input_type_encoded"] = aggregates["input_type"].map(INPUT_TYPES).fillna(0).astype(np.int64)
+        return aggregates.rename_axis("profile_id").reset_index()
+
+    @staticmethod
+    def _keep_first_games(games: pd.DataFrame) -> pd.DataFrame:
+        """Keep the earliest game of every player"""
+        return games.sort_values("finished_dt", kind="stable").drop_duplicates("profile_id")
+
+
+def build_players_df(leaderboard_df: pd.DataFrame, aggregates: pd.DataFrame) -> pd.DataFrame:
+    """
+    Join the leaderboard with the players aggregates into the layout of `clustered_players.csv` (without the cluster).
+    Players without games get zero aggregates, like in the BuildModel notebook.
+    """
+    leaderboard_df = leaderboard_df.copy()
+    leaderboard_df["rank_level"], leaderboard_df["rank_level_encoded"] = get_rank_levels(leaderboard_df["rating"].to_numpy())
+    players_df = leaderboard_df.merge(aggregates, on="profile_id", how="left")
+    players_df["win_rate"] = players_df["wins_count"] / players_df["games_count"]
+
+    for column in [*AGGREGATE_NUMERICAL_COLUMNS, "input_type_encoded"]:
+        players_df[column] = players_df[column].fillna(0)
+
+    players_df["country"] = players_df["country"].fillna("unknown")
+    players_df["name"] = players_df["name"].fillna("unknown")
+    players_df["common_civ"] = players_df["common_civ"].fillna("unknown")
+    players_df["input_type"] = players_df["input_type"].fillna("keyboard")
+    return players_df
+
+def build_new_players_df(players: list[dict]) -> pd.DataFrame:
+    """
+    Build the players data of players missing in the leaderboard dump, e.g. newcomers registered through the API,
+    in the layout of `clustered_players.csv` without the cluster.
+    Args:
+        players: The player records with `profile_id`, `name` and `rating`, optionally the other leaderboard columns
+            (`LEADERBOARD_DEFAULTS` otherwise) and the aggregates `avg_mmr_diff_*`, `avg_mmr`, `avg_opp_mmr`,
+            `avg_game_length`, `common_civ` and `input_type` (filled like for the players without games otherwise).
+    """
+    records = pd.DataFrame(players)
+    leaderboard_df = records.reindex(columns=["profile_id", "name", "rating", *LEADERBOARD_DEFAULTS]).fillna(LEADERBOARD_DEFAULTS)
+    leaderboard_df = leaderboard_df.astype({"profile_id": np.int64, "rating": np.float64, "rank": np.int64, "games_count": np.int64, "wins_count": np.int64})
+
+    aggregates = records.reindex(columns=["profile_id", *AGGREGATE_NUMERICAL_COLUMNS, "common_civ", "input_type"])
+    aggregates = aggregates.astype({"profile_id": np.int64, **{column: np.float64 for column in AGGREGATE_NUMERICAL_COLUMNS}})
+    aggregates["input_type_encoded"] = aggregates["input_type"].map(INPUT_TYPES).fillna(0).astype(np.int64)
+
+    players_df = build_players_df(leaderboard_df, aggregates)
+    # Players without games have no win rate yet
+    players_df["win_rate"] = players_df["win_rate"].fillna(0)
+    return players_df
+
+def assign_clusters(players_df: pd.DataFrame, clusters_count: int = CLUSTERS_COUNT, random_state: int | None = None) -> np.ndarray:
+    """
+    Cluster the players with KMeans on the standardized numerical columns plus the encoded rank level and input type.
+    Returns:
+        The cluster label of every player.
+    """
+    return ClusterModel.fit(players_df, clusters_count, random_state).assign_players(players_df)
+
+def run_pipeline(
+    games_path: str,
+    leaderboard_path: str,
+    output_path: str,
+    snapshot_path: str | None = None,
+    cluster_model_path: str | None = None,
+    chunk_size: int = 50_000,
+    clusters_count: int = CLUSTERS_COUNT,
+    random_state: int | None = None,
+) -> pd.DataFrame:
+    """
+    Build the clustered players data loaded by the API from the games dump and the leaderboard.
+    Args:
+        games_path: The path to the games file, see `iter_game_chunks`.
+        leaderboard_path: The path to the leaderboard CSV file.
+        output_path: The path of the players CSV file to write.
+        snapshot_path: The path of the players snapshot directory to write, skipped if None.
+        cluster_model_path: The path of the cluster model file to write, skipped if None.
+        chunk_size: The number of games processed at once.
+        clusters_count: The number of player clusters.
+        random_state: The seed of the clustering.
+    Returns:
+        The clustered players data.
+    """
+    aggregator = PlayerAggregator()
+    games_count = 0
+
+    for games in iter_game_chunks(games_path, chunk_size):
+        aggregator.update(flatten_games(games))
+        games_count += len(games)
+        logger.info(f"Aggregated {games_count} games")
+
+    players_df = build_players_df(pd.read_csv(leaderboard_path), aggregator.result())
+    cluster_model = ClusterModel.fit(players_df, clusters_count, random_state)
+    players_df["cluster"] = cluster_model.assign_players(players_df)
+    players_df.to_csv(output_path, index=False)
+    logger.info(f"Clustered data of {len(players_df)} players written to {output_path}")
+
+    if cluster_model_path is not None:
+        cluster_model.save(cluster_model_path)
+        logger.info(f"Cluster model written to {cluster_model_path}")
+
+    if snapshot_path is not None:
+        write_player_snapshot(players_df, snapshot_path)
+        logger.info(f"Snapshot of {len(players_df)} players written to {snapshot_path}")
+
+    return players_df
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build clustered_players.csv from the games dump and the leaderboard.")
+    parser.add_argument("--games", default=get_data_path("games_rm_1v1_s8.json"), help="Path to the games JSON (array or lines) file, optionally gzip-compressed")
+    parser.add_argument("--leaderboard", default=get_data_path("leadersboards_rm_1v1_elo.csv.gz"), help="Path to the leaderboard CSV file")
+    parser.add_argument("--output", default=get_model_path("clustered_players.csv"), help="Path to the players CSV file to write")
+    parser.add_argument("--snapshot", default=get_default_snapshot_path(), help="Path to the players snapshot directory to write")
+    parser.add_argument("--no-snapshot", action="store_true", help="Do not write the players snapshot")
+    parser.add_argument("--cluster-model", default=get_default_cluster_model_path(), help="Path to the cluster model file to write")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Number of games processed at once")
+    parser.add_argument("--clusters", type=int, default=CLUSTERS_COUNT, help="Number of player clusters")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the clustering")
+    args = parser.parse_args()
+
+    run_pipeline(
+        args.games,
+        args.leaderboard,
+        args.output,
+        snapshot_path=None if args.no_snapshot else args.snapshot,
+        cluster_model_path=args.cluster_model,
+        chunk_size=args.chunk_size,
+        clusters_count=args.clusters,
+        random_state=args.seed,
+    )
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
@@ -0,0 +1,499 @@
+import time
+from bisect import bisect_left, insort
+from collections.abc import Callable, Iterable, Iterator
+from itertools import repeat
+from .queue_store import QueueEntry, QueueEventType, QueueStore
+
+class RatingIndex:
+    """
+    Sorted index of (rating, profile_id) pairs.
+    Items are kept in a list of bounded sorted sublists, so adding, removing and locating
+    an item costs O(log n) plus a copy of at most `LOAD_FACTOR * 2` items.
+    """
+    LOAD_FACTOR = 512
+    """Target size of a sublist, sublists are split once they grow twice as large"""
+
+    def __init__(self, items: Iterable[tuple[float, int]] = ()) -> None:
+        self._lists: list[list[tuple[float, int]]] = []
+        self._maxes: list[tuple[float, int]] = []
+        self._len = 0
+        self.update(items)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[tuple[float, int]]:
+        for sublist in self._lists:
+            yield from sublist
+
+    def update(self, items: Iterable[tuple[float, int]]) -> None:
+        """
+        Add many items at once by re-sorting the whole index.
+        """
+        merged = sorted([*self, *items])
+        load = self.LOAD_FACTOR
+        self._lists = [merged[i:i + load] for i in range(0, len(merged), load)]
+        self._maxes = [sublist[-1] for sublist in self._lists]
+        self._len = len(merged)
+
+    def add(self, rating: float, profile_id: int) -> None:
+        """
+        Add a player to the index.
+        """
+        item = (rating, profile_id)
+        self._len += 1
+
+        if not self._lists:
+            self._lists.append([item])
+            self._maxes.append(item)
+            return
+
+        i = bisect_left(self._maxes, item)
+
+        if i == len(self._maxes):
+            i -= 1
+            self._lists[i].append(item)
+            self._maxes[i] = item
+        else:
+            insort(self._lists[i], item)
+
+        sublist = self._lists[i]
+
+        if len(sublist) > 2 * self.LOAD_FACTOR:
+            self._lists.insert(i + 1, sublist[self.LOAD_FACTOR:])
+            del sublist[self.LOAD_FACTOR:]
+            self._maxes[i] = sublist[-1]
+            self._maxes.insert(i + 1, self._lists[i + 1][-1])
+
+    def remove(self, rating: float, profile_id: int) -> bool:
+        """
+        Remove a player from the index.
+        Returns:
+            True if the player was removed, False if it was not in the index.
+        """
+        item = (rating, profile_id)
+        i = bisect_left(self._maxes, item)
+
+        if i == len(self._maxes):
+            return False
+
+        sublist = self._lists[i]
+        j = bisect_left(sublist, item)
+
+        if sublist[j] != item:
+            return False
+
+        del sublist[j]
+        self._len -= 1
+
+        if not sublist:
+            del self._lists[i]
+            del self._maxes[i]
+        elif j == len(sublist):
+            self._maxes[i] = sublist[-1]
+
+        return True
+
+    def iter_nearest(self, rating: float) -> Iterator[tuple[float, int]]:
+        """
+        Iterate over the items ordered by the distance of their rating to the given rating.
+        Locating the start position costs O(log n), each next item costs O(1).
+        """
+        if not self._lists:
+            return
+
+        probe = (rating, -1 << 63)
+        i = min(bisect_left(self._maxes, probe), len(self._lists) - 1)
+        j = bisect_left(self._lists[i], probe)
+        left = self._step_left(i, j)
+        right = self._step_right(i, j)
+
+        while left is not None or right is not None:
+            if right is None or (left is not None and rating - self._lists[left[0]][left[1]][0] <= self._lists[right[0]][right[1]][0] - rating):
+                yield self._lists[left[0]][left[1]]
+                left = self._step_left(*left)
+            else:
+                yield self._lists[right[0]][right[1]]
+                right = self._step_right(right[0], right[1] + 1)
+
+    def _step_left(self, i: int, j: int) -> tuple[int, int] | None:
+        """Position of the item before (i, j), or None at the start of the index"""
+        j -= 1
+
+        while j < 0:
+            i -= 1
+
+            if i < 0:
+                return None
+
+            j = len(self._lists[i]) - 1
+
+        return i, j
+
+    def _step_right(self, i: int, j: int) -> tuple[int, int] | None:
+        """Position (i, j) normalized to the next existing item, or None past the end of the index"""
+        while j >= len(self._lists[i]):
+            i += 1
+            j = 0
+
+            if i >= len(self._lists):
+                return None
+
+        return i, j
+
+
+class EnqueueOrderIndex:
+    """
+    Order-statistic index of the players by the order they joined the queue.
+    Every player gets an increasing sequence number counted in a Fenwick tree, so adding, removing
+    and getting the position of a player cost O(log n). The sequence numbers are compacted
+    once they run past the capacity of the tree, which costs O(n) at most every n additions.
+    """
+    MIN_CAPACITY = 1024
+    """Smallest number of sequence numbers the tree is sized for"""
+
+    def __init__(self) -> None:
+        self._seqs: dict[int, int] = {}
+        self._tree = [0] * (self.MIN_CAPACITY + 1)
+        self._next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self._seqs)
+
+    def add(self, profile_id: int) -> None:
+        """
+        Add a player after all the players in the index, a player already in the index keeps its position.
+        """
+        if profile_id in self._seqs:
+            return
+
+        if self._next_seq >= len(self._tree) - 1:
+            self._compact()
+
+        seq = self._next_seq
+        self._next_seq += 1
+        self._seqs[profile_id] = seq
+        self._add_count(seq, 1)
+
+    def remove(self, profile_id: int) -> None:
+        """
+        Remove a player from the index, if present.
+        """
+        seq = self._seqs.pop(profile_id, None)
+
+        if seq is not None:
+            self._add_count(seq, -1)
+
+    def position(self, profile_id: int) -> int | None:
+        """
+        Get the 1-based position of a player by the order of joining, or None if the player is not in the index.
+        """
+        seq = self._seqs.get(profile_id)
+
+        if seq is None:
+            return None
+
+        tree = self._tree
+        position = 0
+        i = seq + 1
+
+        while i > 0:
+            position += tree[i]
+            i &= i - 1
+
+        return position
+
+    def _add_count(self, seq: int, delta: int) -> None:
+        tree = self._tree
+        size = len(tree)
+        i = seq + 1
+
+        while i < size:
+            tree[i] += delta
+            i += i & -i
+
+    def _compact(self) -> None:
+        """Renumber the players from 0 in the order of joining, which is the insertion order of the sequence numbers, and rebuild the tree in O(n)."""
+        count = len(self._seqs)
+        capacity = max(self.MIN_CAPACITY, 2 * count)
+        tree = [0] * (capacity + 1)
+        tree[1:count + 1] = [1] * count
+
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+
+            if parent <= capacity:
+                tree[parent] += tree[i]
+
+        self._seqs = dict(zip(self._seqs, range(count)))
+        self._tree = tree
+        self._next_seq = count
+
+
+class PlayerQueue(QueueStore):
+    """
+    In-memory matchmaking queue of the players waiting for a match, private to the process.
+    Keeps a membership index, per-cluster buckets, rating-sorted indexes over the whole queue
+    and every cluster and an index of the enqueue order, so that enqueue, dequeue, nearest-rating
+    and queue position lookups take O(log n).
+    Listeners are notified about every change of the queue.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        """
+        Args:
+            clock: The function returning the current timestamp in seconds, used for enqueue times.
+        """
+        super().__init__(clock)
+        self._entries: dict[int, QueueEntry] = {}
+        self._order_index = EnqueueOrderIndex()
+        self._rating_index = RatingIndex()
+        self._cluster_indexes: dict[int, RatingIndex] = {}
+        self._matches: dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, profile_id: int) -> bool:
+        return profile_id in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the profile IDs of the queued players in the order they joined."""
+        return iter(self._entries)
+
+    def get(self, profile_id: int) -> QueueEntry | None:
+        """
+        Get the queue entry of a player, or None if the player is not queued.
+        """
+        return self._entries.get(profile_id)
+
+    def entries(self) -> list[QueueEntry]:
+        """
+        Get the entries of all queued players in the order they joined.
+        """
+        return list(self._entries.values())
+
+    def add(self, profile_id: int, cluster: int, rating: float, enqueued_at: float | None = None) -> bool:
+        """
+        Add a player to the queue, dropping the player's match that was not polled yet.
+        Args:
+            profile_id: The profile ID of the player.
+            cluster: The cluster of the player.
+            rating: The ELO rating of the player.
+            enqueued_at: The enqueue timestamp, defaults to the current time.
+        Returns:
+            True if the player was added, False if the player was already queued.
+        """
+        if profile_id in self._entries:
+            return False
+
+        entry = QueueEntry(profile_id, cluster, rating, self.clock() if enqueued_at is None else enqueued_at)
+        self._entries[profile_id] = entry
+        self._order_index.add(profile_id)
+        self._rating_index.add(rating, profile_id)
+        self._get_cluster_index(cluster).add(rating, profile_id)
+        # A player joining the queue again is no longer interested in the previous match
+        self._matches.pop(profile_id, None)
+        self._notify(QueueEventType.ENQUEUED, profile_id, entry.enqueued_at)
+        return True
+
+    def add_many(self, entries: Iterable[tuple[int, int, float]], enqueued_at: Iterable[float] | None = None) -> int:
+        """
+        Add many players at once, sorting the rating indexes once instead of inserting one by one.
+        Listeners are not notified.
+        Args:
+            entries: The (profile_id, cluster, rating) tuples of the players.
+            enqueued_at: The enqueue timestamps aligned with the entries, e.g. of recovered players. Defaults to the current time.
+        Returns:
+            The number of players added.
+        """
+        timestamps = repeat(self.clock()) if enqueued_at is None else enqueued_at
+        new_entries = [
+            QueueEntry(profile_id, cluster, rating, timestamp)
+            for (profile_id, cluster, rating), timestamp in zip(entries, timestamps)
+            if profile_id not in self._entries
+        ]
+        items = [(entry.rating, entry.profile_id) for entry in new_entries]
+        by_cluster: dict[int, list[tuple[float, int]]] = {}
+
+        for entry, item in zip(new_entries, items):
+            self._entries[entry.profile_id] = entry
+            self._order_index.add(entry.profile_id)
+            by_cluster.setdefault(entry.cluster, []).append(item)
+
+        self._rating_index.update(items)
+
+        for cluster, items in by_cluster.items():
+            self._get_cluster_index(cluster).update(items)
+
+        return len(new_entries)
+
+    def remove(self, profile_id: int, event_type: QueueEventType = QueueEventType.DEQUEUED) -> QueueEntry | None:
+        """
+        Remove a player from the queue.
+        Args:
+            profile_id: The profile ID of the player.
+            event_type: The event type reported to the listeners, `MATCHED` when the player leaves the queue with a match.
+        Returns:
+            The removed entry, or None if the player was not queued.
+        """
+        entry = self._entries.pop(profile_id, None)
+
+        if entry is None:
+            return None
+
+        self._order_index.remove(profile_id)
+        self._rating_index.remove(entry.rating, profile_id)
+        cluster_index = self._cluster_indexes[entry.cluster]
+        cluster_index.remove(entry.rating, profile_id)
+
+        if not cluster_index:
+            del self._cluster_indexes[entry.cluster]
+
+        self._notify(event_type, profile_id, self.clock())
+        return entry
+
+    def update(self, profile_id: int, cluster: int, rating: float) -> bool:
+        """
+        Change the cluster and the rating of a queued player, keeping the position in the queue and the enqueue time.
+        Listeners are not notified since the player stays in the queue.
+        Returns:
+            True if the player was updated, False if the player is not queued.
+        """
+        entry = self._entries.get(profile_id)
+
+        if entry is None:
+            return False
+
+        if entry.cluster == cluster and entry.rating == rating:
+            return True
+
+        self._rating_index.remove(entry.rating, profile_id)
+        cluster_index = self._cluster_indexes[entry.cluster]
+        cluster_index.remove(entry.rating, profile_id)
+
+        if not cluster_index:
+            del self._cluster_indexes[entry.cluster]
+
+        self._entries[profile_id] = QueueEntry(profile_id, cluster, rating, entry.enqueued_at)
+        self._rating_index.add(rating, profile_id)
+        self._get_cluster_index(cluster).add(rating, profile_id)
+        return True
+
+    def claim_pair(self, profile_id_A: int, profile_id_B: int) -> tuple[QueueEntry, QueueEntry] | None:
+        """
+        Remove two players from the queue as matched, only if both of them are still queued.
+        Atomic as long as the callers serialize the queue operations, like the matchmaker's queue lock does.
+        Returns:
+            The removed entries of player A and player B, or None if one of them is not queued anymore.
+        """
+        if profile_id_A == profile_id_B or profile_id_A not in self._entries or profile_id_B not in self._entries:
+            return None
+
+        return self.remove(profile_id_A, QueueEventType.MATCHED), self.remove(profile_id_B, QueueEventType.MATCHED)
+
+    def claim_players(self, profile_ids: list[int]) -> list[QueueEntry] | None:
+        """
+        Remove players from the queue as matched, only if all of them are still queued.
+        Atomic as long as the callers serialize the queue operations, like the matchmaker's queue lock does.
+        Returns:
+            The removed entries in the order of the profile IDs, or None if one of them is not queued anymore.
+        """
+        if len(set(profile_ids)) != len(profile_ids) or any(profile_id not in self._entries for profile_id in profile_ids):
+            return None
+
+        return [self.remove(profile_id, QueueEventType.MATCHED) for profile_id in profile_ids]
+
+    def cluster_size(self, cluster: int) -> int:
+        """
+        Get the number of queued players in a cluster.
+        """
+        cluster_index = self._cluster_indexes.get(cluster)
+        return len(cluster_index) if cluster_index else 0
+
+    def cluster_members(self, cluster: int) -> list[int]:
+        """
+        Get the profile IDs of the queued players in a cluster, ordered by rating.
+        """
+        cluster_index = self._cluster_indexes.get(cluster)
+        return [profile_id for _, profile_id in cluster_index] if cluster_index else []
+
+    def clusters(self) -> list[int]:
+        """
+        Get the clusters that have at least one queued player.
+        """
+        return list(self._cluster_indexes)
+
+    def nearest_by_rating(
+        self,
+        rating: float,
+        k: int = 1,
+        max_diff: float = float("inf"),
+        cluster: int | None = None,
+        exclude: int | None = None,
+    ) -> list[QueueEntry]:
+        """
+        Find the queued players with the closest ratings.
+        Args:
+            rating: The rating to search around.
+            k: The maximum number of players to return.
+            max_diff: The maximum rating difference.
+            cluster: Restrict the search to a cluster, search the whole queue if None.
+            exclude: The profile ID to skip, usually the searching player.
+        Returns:
+            Up to `k` queue entries ordered by the rating difference.
+        """
+        index = self._rating_index if cluster is None else self._cluster_indexes.get(cluster)
+        nearest: list[QueueEntry] = []
+
+        if not index:
+            return nearest
+
+        for other_rating, profile_id in index.iter_nearest(rating):
+            if len(nearest) >= k or abs(other_rating - rating) > max_diff:
+                break
+
+            if profile_id != exclude:
+                nearest.append(self._entries[profile_id])
+
+        return nearest
+
+    def positions(self, profile_ids: list[int]) -> dict[int, int]:
+        """
+        Get the positions of players in the queue by the time of joining, in O(log n) per player from the enqueue order index.
+        Returns:
+            The 1-based position of every queued player of the profile IDs, the players not queued are left out.
+        """
+        positions: dict[int, int] = {}
+
+        for profile_id in profile_ids:
+            position = self._order_index.position(profile_id)
+
+            if position is not None:
+                positions[profile_id] = position
+
+        return positions
+
+    def max_wait_time(self) -> float:
+        """
+        Get the number of seconds the longest waiting player has been in the queue, 0 if the queue is empty.
+        """
+        oldest_entry = next(iter(self._entries.values()), None)
+        return 0.0 if oldest_entry is None else self.clock() - oldest_entry.enqueued_at
+
+    def put_match(self, profile_id: int, match: dict) -> None:
+        self._matches[profile_id] = match
+
+    def get_match(self, profile_id: int) -> dict | None:
+        return self._matches.get(profile_id)
+
+    def pop_match(self, profile_id: int) -> dict | None:
+        return self._matches.pop(profile_id, None)
+
+    def _get_cluster_index(self, cluster: int) -> RatingIndex:
+        cluster_index = self._cluster_indexes.get(cluster)
+
+        if cluster_index is None:
+            cluster_index = self._cluster_indexes[cluster] = RatingIndex()
+
+        return cluster_index
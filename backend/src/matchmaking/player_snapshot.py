@@ -0,0 +1,143 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from core import get_model_path
+from .features import PLAYER_FEATURE_COLUMNS
+
+SNAPSHOT_FORMAT_VERSION = 1
+"""Version of the snapshot layout, bumped on incompatible changes"""
+
+MANIFEST_FILE = "manifest.json"
+FEATURES_FILE = "features.npy"
+
+logger = logging.getLogger()
+
+def get_default_snapshot_path() -> str:
+    """
+    Get the path to the players snapshot directory next to `clustered_players.csv`.
+    """
+    return get_model_path("clustered_players.snapshot")
+
+def get_snapshot_path(csv_path: str) -> str:
+    """
+    Get the path to the players snapshot directory next to a players CSV file, e.g. `players.snapshot` for `players.csv`.
+    """
+    return f"{os.path.splitext(csv_path)[0]}.snapshot"
+
+def write_player_snapshot(players_df: pd.DataFrame, snapshot_path: str) -> None:
+    """
+    Write the players data as a binary snapshot directory.
+    Numeric columns are stored as `.npy` arrays, string columns are dictionary-encoded
+    into `int32` codes plus a list of categories kept in the manifest.
+    The model features are additionally stored as one contiguous float32 block.
+    Args:
+        players_df: The players data, in the same layout as `clustered_players.csv`.
+        snapshot_path: The directory to write the snapshot to. Replaced if it already exists.
+    """
+    tmp_path = f"{snapshot_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    players_df = players_df.reset_index(drop=True)
+    columns: list[dict] = []
+
+    for index, column in enumerate(players_df.columns):
+        series = players_df[column]
+        file_name = f"column_{index}.npy"
+
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            np.save(os.path.join(tmp_path, file_name), series.to_numpy())
+            columns.append({"name": column, "kind": "numeric", "file": file_name})
+        else:
+            # Missing values get the code -1
+            codes, categories = pd.factorize(series, use_na_sentinel=True)
+            np.save(os.path.join(tmp_path, file_name), codes.astype(np.int32))
+            columns.append({
+                "name": column,
+                "kind": "dictionary",
+                "file": file_name,
+                "categories": [str(category) for category in categories],
+            })
+
+    features = np.ascontiguousarray(players_df[PLAYER_FEATURE_COLUMNS].to_numpy(dtype=np.float32))
+    np.save(os.path.join(tmp_path, FEATURES_FILE), features)
+
+    manifest = {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "rows": len(players_df),
+        "columns": columns,
+        "feature_columns": PLAYER_FEATURE_COLUMNS,
+        "features_file": FEATURES_FILE,
+    }
+
+    # Write the manifest last, so a snapshot without it is never picked up
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(snapshot_path, ignore_errors=True)
+    os.replace(tmp_path, snapshot_path)
+
+def read_player_snapshot(snapshot_path: str) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Read a players snapshot written by `write_player_snapshot`.
+    Numeric columns and the features block are memory-mapped copy-on-write,
+    so processes reading the same snapshot share the pages through the OS page cache.
+    Args:
+        snapshot_path: The snapshot directory.
+    Returns:
+        The players DataFrame and the float32 features block in `PLAYER_FEATURE_COLUMNS` order.
+    Raises:
+        ValueError: If the snapshot is not compatible with this version of the backend.
+    """
+    with open(os.path.join(snapshot_path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest: dict = json.load(f)
+
+    if manifest["version"] != SNAPSHOT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest["version"]}, expected {SNAPSHOT_FORMAT_VERSION}")
+
+    if manifest["feature_columns"] != PLAYER_FEATURE_COLUMNS:
+        raise ValueError("Snapshot feature columns do not match the model features")
+
+    data: dict[str, np.ndarray] = {}
+
+    for column in manifest["columns"]:
+        values = np.load(os.path.join(snapshot_path, column["file"]), mmap_mode="c")
+
+        if column["kind"] == "dictionary":
+            categories = np.array(column["categories"] + [np.nan], dtype=object)
+            values = categories[values] # code -1 picks the trailing NaN
+
+        data[column["name"]] = values
+
+    players_df = pd.DataFrame(data, copy=False)
+    features = np.load(os.path.join(snapshot_path, manifest["features_file"]), mmap_mode="c")
+    return players_df, features
+
+def is_snapshot_fresh(snapshot_path: str, csv_path: str) -> bool:
+    """
+    Check that a snapshot exists and is not older than the CSV file it was built from.
+    """
+    manifest_path = os.path.join(snapshot_path, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_path):
+        return False
+
+    return not os.path.exists(csv_path) or os.path.getmtime(manifest_path) >= os.path.getmtime(csv_path)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert clustered_players.csv into a binary, memory-mappable snapshot.")
+    parser.add_argument("--input", default=get_model_path("clustered_players.csv"), help="Path to the players CSV file")
+    parser.add_argument("--output", default=get_default_snapshot_path(), help="Path to the snapshot directory")
+    args = parser.parse_args()
+
+    players_df = pd.read_csv(args.input)
+    write_player_snapshot(players_df, args.output)
+    logger.info(f"Snapshot of {len(players_df)} players written to {args.output}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
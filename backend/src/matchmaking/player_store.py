@@ -0,0 +1,242 @@
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from core import get_model_path
+from .features import PLAYER_FEATURE_COLUMNS
+from .player_snapshot import get_snapshot_path, is_snapshot_fresh, read_player_snapshot
+
+class PlayerStore:
+    """
+    In-memory store of the clustered players data shared by the matchmaker and the player service.
+    Keeps a hash index from profile ID to row and a contiguous float32 block of the model features,
+    so that players and their features can be looked up in O(1).
+    """
+    players_df: pd.DataFrame
+    """Full players data, one row per player"""
+
+    profile_ids: np.ndarray
+    """Profile IDs of the players, aligned with the rows of `players_df`"""
+
+    clusters: np.ndarray
+    """Cluster labels of the players, aligned with the rows of `players_df`"""
+
+    ratings: np.ndarray
+    """ELO ratings of the players, aligned with the rows of `players_df`"""
+
+    features: np.ndarray
+    """Float32 matrix of shape (N, 14) with the columns in `PLAYER_FEATURE_COLUMNS` order"""
+
+    version = 0
+    """Number of player updates applied to the store, used to detect stale data derived from the players"""
+
+    row_versions: np.ndarray
+    """The `version` of the last update of every row, 0 for rows never updated"""
+
+    column_versions: dict[str, int]
+    """The `version` of the last update of every updated column"""
+
+    is_data_loaded = False
+    logger = logging.getLogger()
+
+    def __init__(self) -> None:
+        self._row_index: dict[int, int] = {}
+        self._load_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def load(self, csv_path: str | None = None) -> None:
+        """
+        Load the players data from disk and build the profile ID index.
+        The binary snapshot is memory-mapped when it is available and up to date,
+        otherwise the CSV file is parsed.
+        Args:
+            csv_path: The path to the players CSV file, `clustered_players.csv` in the models directory by default.
+                The snapshot is looked up next to it.
+        """
+        with self._load_lock:
+            if self.is_data_loaded:
+                return
+
+            csv_path = csv_path or get_model_path("clustered_players.csv")
+            snapshot_path = get_snapshot_path(csv_path)
+
+            if is_snapshot_fresh(snapshot_path, csv_path):
+                players_df, features = read_player_snapshot(snapshot_path)
+                self._set_players_df(players_df, features)
+                self.logger.info(f"Players data loaded from snapshot {snapshot_path}")
+            else:
+                self._set_players_df(pd.read_csv(csv_path))
+
+            self.is_data_loaded = True
+            self.logger.info(f"Players data loaded successfully, shape: {self.players_df.shape}")
+
+    def load_dataframe(self, players_df: pd.DataFrame) -> None:
+        """
+        Load the players data from a DataFrame instead of the disk, e.g. synthetic data for benchmarks.
+        Args:
+            players_df: The players data with the same columns as `clustered_players.csv`.
+        """
+        with self._load_lock:
+            self._set_players_df(players_df)
+            self.is_data_loaded = True
+
+    def __len__(self) -> int:
+        return len(self.profile_ids) if self.is_data_loaded else 0
+
+    def contains(self, profile_id: int) -> bool:
+        """
+        Check if a player exists in the store.
+        """
+        return profile_id in self._row_index
+
+    def get_row(self, profile_id: int) -> int | None:
+        """
+        Get the row index of a player.
+        Args:
+            profile_id: The profile ID of the player.
+        Returns:
+            The row index of the player in `players_df`, or None if the player does not exist.
+        """
+        return self._row_index.get(profile_id)
+
+    def get_rows(self, profile_ids: list[int]) -> np.ndarray:
+        """
+        Get the row indices of many players, skipping the ones that do not exist.
+        Args:
+            profile_ids: The profile IDs of the players.
+        Returns:
+            The array of row indices in `players_df`.
+        """
+        row_index = self._row_index
+        rows = [row_index[pid] for pid in profile_ids if pid in row_index]
+        return np.fromiter(rows, dtype=np.intp, count=len(rows))
+
+    def get_player(self, profile_id: int) -> pd.Series | None:
+        """
+        Get a player's data.
+        Args:
+            profile_id: The profile ID of the player.
+        Returns:
+            The row (Series) from `players_df` representing the player, or None if the player does not exist.
+        """
+        row = self._row_index.get(profile_id)
+        return None if row is None else self.players_df.iloc[row]
+
+    def update_player(self, profile_id: int, values: dict[str, object]) -> None:
+        """
+        Update columns of a player's row in place, keeping the columnar arrays and the features consistent.
+        Args:
+            profile_id: The profile ID of the player.
+            values: The new values by column name.
+        Raises:
+            ValueError: If the player does not exist.
+        """
+        row = self._row_index.get(profile_id)
+
+        if row is None:
+            raise ValueError(f"Player {profile_id} not found")
+
+        players_df = self.players_df
+
+        with self._update_lock:
+            # Published once the row is written, so the data derived from the new version sees the new values
+            version = self.version + 1
+
+            for column, value in values.items():
+                players_df.iat[row, players_df.columns.get_loc(column)] = value
+                self.column_versions[column] = version
+
+                if column in self._feature_positions:
+                    self.features[row, self._feature_positions[column]] = value
+
+            if "rating" in values:
+                self.ratings[row] = values["rating"]
+
+            if "cluster" in values:
+                self.clusters[row] = values["cluster"]
+
+            self.version = version
+            self.row_versions[row] = version
+
+    def columns_updated_since(self, version: int) -> list[str]:
+        """
+        Get the columns updated in place after a version of the store, e.g. to refresh only the data derived from them.
+        """
+        return [column for column, column_version in self.column_versions.items() if column_version > version]
+
+    def add_players(self, players_df: pd.DataFrame) -> np.ndarray:
+        """
+        Append new players to the store.
+        The players data is copied into memory once per call, so add players in batches;
+        a memory-mapped snapshot stops being shared with the other processes.
+        Args:
+            players_df: The new players with the same columns as `clustered_players.csv`, including the `cluster`.
+        Returns:
+            The row indices of the new players.
+        Raises:
+            ValueError: If a column is missing or a player already exists.
+        """
+        missing_columns = [column for column in self.players_df.columns if column not in players_df.columns]
+
+        if missing_columns:
+            raise ValueError(f"The new players miss the columns {missing_columns}")
+
+        new_players_df = players_df[self.players_df.columns].reset_index(drop=True)
+        new_profile_ids = new_players_df["profile_id"].to_numpy(dtype=np.int64)
+
+        if new_players_df["profile_id"].duplicated().any() or any(pid in self._row_index for pid in new_profile_ids.tolist()):
+            raise ValueError("The new players contain existing or duplicated profile IDs")
+
+        with self._update_lock:
+            start = len(self.profile_ids)
+            self.version += 1
+            self.features = np.concatenate((self.features, new_players_df[PLAYER_FEATURE_COLUMNS].to_numpy(dtype=np.float32)))
+            self.clusters = np.concatenate((self.clusters, new_players_df["cluster"].to_numpy(dtype=np.int64)))
+            self.ratings = np.concatenate((self.ratings, new_players_df["rating"].to_numpy(dtype=np.float64)))
+            self.row_versions = np.concatenate((self.row_versions, np.full(len(new_players_df), self.version, dtype=np.int64)))
+            self.profile_ids = np.concatenate((self.profile_ids, new_profile_ids))
+            self.players_df = pd.concat([self.players_df, new_players_df], ignore_index=True)
+
+            # Indexed last, so a new player is never found before the arrays have its row
+            for row, pid in enumerate(new_profile_ids.tolist(), start):
+                self._row_index[pid] = row
+
+        return np.arange(start, start + len(new_players_df), dtype=np.intp)
+
+    def _set_players_df(self, players_df: pd.DataFrame, features: np.ndarray | None = None) -> None:
+        """
+        Replace the players data and rebuild the index and the columnar arrays.
+        Args:
+            players_df: The players data.
+            features: The precomputed float32 features block, built from `players_df` if not provided.
+        """
+        if not players_df.index.equals(pd.RangeIndex(len(players_df))):
+            players_df = players_df.reset_index(drop=True)
+
+        self.players_df = players_df
+        self.profile_ids = players_df["profile_id"].to_numpy(dtype=np.int64)
+        # The clusters and the ratings are copied since they are updated in place
+        self.clusters = players_df["cluster"].to_numpy(dtype=np.int64, copy=True)
+        self.ratings = players_df["rating"].to_numpy(dtype=np.float64, copy=True)
+        self.features = features if features is not None else np.ascontiguousarray(players_df[PLAYER_FEATURE_COLUMNS].to_numpy(dtype=np.float32))
+        self.row_versions = np.zeros(len(players_df), dtype=np.int64)
+        self.column_versions = {}
+        self._feature_positions = {column: i for i, column in enumerate(PLAYER_FEATURE_COLUMNS)}
+        self._row_index = {pid: row for row, pid in enumerate(self.profile_ids.tolist())}
+
+
+_shared_player_store = PlayerStore()
+
+def get_player_store() -> PlayerStore:
+    """
+    Get the player store shared by all the services of the process.
+    """
+    return _shared_player_store
+
+def set_player_store(player_store: PlayerStore) -> None:
+    """
+    Replace the player store shared by all the services of the process, e.g. with the players data of a hot reload.
+    Services holding the previous store keep reading it until they get the shared store again.
+    """
+    global _shared_player_store
+    _shared_player_store = player_store
@@ -0,0 +1,157 @@
+import logging
+from collections import OrderedDict
+from .features import MMR_DIFF_WINDOWS, get_rank_levels
+from .player_store import PlayerStore
+
+class MmrDiffHistory:
+    """
+    Ring buffer of a player's last MMR differences with a running sum per `MMR_DIFF_WINDOWS` window,
+    so adding a game and reading the window averages take O(1).
+    """
+    __slots__ = ("_values", "_sums", "_head", "_length")
+
+    CAPACITY = max(MMR_DIFF_WINDOWS)
+
+    def __init__(self, averages: list[float], games_count: int) -> None:
+        """
+        Seed the history with values reproducing the current window averages, since the games themselves are not kept.
+        Args:
+            averages: The current `avg_mmr_diff_*` values in `MMR_DIFF_WINDOWS` order.
+            games_count: The number of games the player has played.
+        """
+        length = max(0, min(int(games_count), self.CAPACITY))
+        newest_first: list[float] = []
+        covered, covered_sum = 0, 0.0
+
+        # Every segment between two windows gets the constant value keeping both averages
+        for window, average in zip(MMR_DIFF_WINDOWS, averages):
+            window = min(window, length)
+            window_sum = average * window
+
+            if window > covered:
+                newest_first.extend([(window_sum - covered_sum) / (window - covered)] * (window - covered))
+                covered, covered_sum = window, window_sum
+
+        self._values = [0.0] * self.CAPACITY
+        self._values[:length] = newest_first[::-1]
+        self._head = length % self.CAPACITY
+        self._length = length
+        self._sums = [sum(newest_first[:window]) for window in MMR_DIFF_WINDOWS]
+
+    def add(self, mmr_diff: float) -> None:
+        """
+        Add the MMR difference of the player's latest game.
+        """
+        for i, window in enumerate(MMR_DIFF_WINDOWS):
+            if self._length >= window:
+                self._sums[i] -= self._values[(self._head - window) % self.CAPACITY] # leaves the window
+
+            self._sums[i] += mmr_diff
+
+        self._values[self._head] = mmr_diff
+        self._head = (self._head + 1) % self.CAPACITY
+        self._length = min(self._length + 1, self.CAPACITY)
+
+    def averages(self) -> list[float]:
+        """
+        Get the average MMR differences over the `MMR_DIFF_WINDOWS` last games, 0 without games.
+        """
+        return [
+            window_sum / min(window, self._length) if self._length > 0 else 0.0
+            for window, window_sum in zip(MMR_DIFF_WINDOWS, self._sums)
+        ]
+
+
+class PlayerUpdater:
+    """
+    Applies finished 1v1 games to the players data in place: games and wins counts, win rate,
+    rating and rank level, and the rolling `avg_mmr_diff_*` windows. Each game updates only its two players.
+    """
+    logger = logging.getLogger()
+
+    MAX_TRACKED_GAMES = 100_000
+    """Number of the latest game IDs remembered to ignore games ingested twice"""
+
+    def __init__(self, player_store: PlayerStore) -> None:
+        self.player_store = player_store
+        self._histories: dict[int, MmrDiffHistory] = {}
+        self._game_ids: OrderedDict[int, None] = OrderedDict()
+
+    def apply_games(self, games: list[dict]) -> list[int]:
+        """
+        Apply finished games to the players data.
+        Games that are not 1v1, were already applied or involve unknown players are skipped.
+        Args:
+            games: The game records in the aoe4world format, with the players grouped in a `teams` list of lists.
+                A player record needs `profile_id` and `result`, and optionally `mmr_diff`, `rating` and `rating_diff`.
+        Returns:
+            The profile IDs of the updated players.
+        """
+        updated_ids: list[int] = []
+
+        for game in games:
+            teams = game.get("teams", [])
+            game_id = game.get("game_id")
+
+            if len(teams) != 2 or any(len(team) != 1 for team in teams):
+                self.logger.debug(f"Skipping game {game_id}, only 1v1 games are supported")
+                continue
+
+            if self._is_applied(game_id):
+                continue
+
+            for team in teams:
+                player_info = team[0]
+
+                if self.player_store.contains(player_info["profile_id"]):
+                    self._apply_player_game(player_info)
+                    updated_ids.append(player_info["profile_id"])
+
+        return updated_ids
+
+    def _is_applied(self, game_id: int | None) -> bool:
+        """Check if a game was already applied and remember it otherwise"""
+        if game_id is None:
+            return False
+
+        if game_id in self._game_ids:
+            return True
+
+        self._game_ids[game_id] = None
+
+        if len(self._game_ids) > self.MAX_TRACKED_GAMES:
+            self._game_ids.popitem(last=False)
+
+        return False
+
+    def _apply_player_game(self, player_info: dict) -> None:
+        profile_id = player_info["profile_id"]
+        player = self.player_store.get_player(profile_id)
+        games_count = int(player["games_count"]) + 1
+        wins_count = int(player["wins_count"]) + (player_info.get("result") == "win")
+        values: dict[str, object] = {
+            "games_count": games_count,
+            "wins_count": wins_count,
+            "win_rate": wins_count / games_count,
+        }
+
+        if player_info.get("rating") is not None:
+            rating = player_info["rating"] + (player_info.get("rating_diff") or 0)
+            rank_levels, rank_levels_encoded = get_rank_levels([rating])
+            values["rating"] = rating
+            values["rank_level"] = rank_levels[0]
+            values["rank_level_encoded"] = int(rank_levels_encoded[0])
+
+        if player_info.get("mmr_diff") is not None:
+            history = self._histories.get(profile_id)
+
+            if history is None:
+                averages = [float(player[f"avg_mmr_diff_{window}"]) for window in MMR_DIFF_WINDOWS]
+                history = self._histories[profile_id] = MmrDiffHistory(averages, games_count - 1)
+
+            history.add(float(player_info["mmr_diff"]))
+
+            for window, average in zip(MMR_DIFF_WINDOWS, history.averages()):
+                values[f"avg_mmr_diff_{window}"] = average
+
+        self.player_store.update_player(profile_id, values)
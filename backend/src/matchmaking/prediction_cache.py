@@ -0,0 +1,158 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CacheKey = tuple[int, int, int, int, int]
+"""Profile IDs of players A and B, their feature versions and the version of the artifacts that scored the pair"""
+
+class PredictionCache:
+    """
+    Bounded LRU cache of the predicted probabilities that player A wins against player B.
+    Entries are keyed by both profile IDs, their feature versions and the artifacts version, so invalidating a player
+    only bumps its version and the stale entries age out of the LRU order.
+    The lookups return the keys with the versions read before the features are, and the probabilities are stored
+    under these keys: a probability computed from the features of a player invalidated meanwhile is never served.
+    """
+    max_size: int
+    """Maximum number of cached pairs"""
+
+    symmetric: bool
+    """Whether P(B wins against A) may be served as 1 - P(A wins against B).
+    Only enable it when the model is calibrated to be symmetric."""
+
+    hits = 0
+    misses = 0
+
+    def __init__(self, max_size: int = 100_000, symmetric: bool = False) -> None:
+        self.max_size = max_size
+        self.symmetric = symmetric
+        self._entries: OrderedDict[CacheKey, float] = OrderedDict()
+        self._versions: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, player_id_A: int, player_id_B: int, artifacts_version: int = 0) -> tuple[float | None, CacheKey]:
+        """
+        Get the cached probability that player A wins against player B.
+        Args:
+            player_id_A: The profile ID of player A.
+            player_id_B: The profile ID of player B.
+            artifacts_version: The version of the artifacts scoring the pair.
+        Returns:
+            The cached probability, or None if the pair is not cached, and the key to store the computed probability under.
+        """
+        with self._lock:
+            key = self._key(player_id_A, player_id_B, artifacts_version)
+            prob = self._lookup(key)
+
+            if prob is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return prob, key
+
+    def get_many(self, player_id_A: int, player_ids_B: list[int], artifacts_version: int = 0) -> tuple[np.ndarray, np.ndarray, list[CacheKey]]:
+        """
+        Get the cached probabilities that player A wins against each of the players B.
+        Returns:
+            The array of probabilities (NaN for the pairs that are not cached), the boolean mask of the missing pairs
+            and the keys of all the pairs to store the computed probabilities under.
+        """
+        probs = np.full(len(player_ids_B), np.nan)
+
+        with self._lock:
+            keys = [self._key(player_id_A, player_id_B, artifacts_version) for player_id_B in player_ids_B]
+
+            for i, key in enumerate(keys):
+                prob = self._lookup(key)
+
+                if prob is not None:
+                    probs[i] = prob
+
+            missing = np.isnan(probs)
+            misses = int(missing.sum())
+            self.misses += misses
+            self.hits += len(player_ids_B) - misses
+
+        return probs, missing, keys
+
+    def put(self, key: CacheKey, prob: float) -> None:
+        """
+        Cache the probability that player A wins against player B.
+        Args:
+            key: The key returned by `get` before the features of the pair were read.
+            prob: The probability that player A wins.
+        """
+        with self._lock:
+            self._store(key, prob)
+
+    def put_many(self, keys: list[CacheKey], probs: np.ndarray) -> None:
+        """
+        Cache the probabilities of several pairs.
+        Args:
+            keys: The keys returned by `get_many` before the features of the pairs were read.
+            probs: The probabilities that players A win, in the order of the keys.
+        """
+        with self._lock:
+            for key, prob in zip(keys, probs.tolist()):
+                self._store(key, prob)
+
+    def invalidate_player(self, player_id: int) -> None:
+        """
+        Invalidate all the cached pairs involving a player, e.g. after the player's stats changed.
+        """
+        with self._lock:
+            self._versions[player_id] = self._versions.get(player_id, 0) + 1
+
+    def clear(self) -> None:
+        """
+        Drop all the cached pairs, e.g. after the model changed.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Get the cache counters.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, player_id_A: int, player_id_B: int, artifacts_version: int) -> CacheKey:
+        versions = self._versions
+        return (player_id_A, player_id_B, versions.get(player_id_A, 0), versions.get(player_id_B, 0), artifacts_version)
+
+    def _lookup(self, key: CacheKey) -> float | None:
+        prob = self._entries.get(key)
+
+        if prob is not None:
+            self._entries.move_to_end(key)
+            return prob
+
+        if self.symmetric:
+            player_id_A, player_id_B, version_A, version_B, artifacts_version = key
+            reversed_key = (player_id_B, player_id_A, version_B, version_A, artifacts_version)
+            prob = self._entries.get(reversed_key)
+
+            if prob is not None:
+                self._entries.move_to_end(reversed_key)
+                return 1.0 - prob
+
+        return None
+
+    def _store(self, key: CacheKey, prob: float) -> None:
+        self._entries[key] = prob
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
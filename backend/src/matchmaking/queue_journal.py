@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import numpy as np
+from core import metrics_registry
+from .queue_store import QueueEvent, QueueEventType, QueueStore
+
+JOURNAL_FORMAT_VERSION = 1
+"""Version of the journal and snapshot layout, bumped on incompatible changes"""
+
+JOURNAL_FILE = "queue.journal"
+SNAPSHOT_FILE = "queue.snapshot.npy"
+
+JOURNAL_HEADER = b"AOE4QJNL" + JOURNAL_FORMAT_VERSION.to_bytes(8, "little")
+"""Magic bytes and format version at the start of the journal file"""
+
+JOURNAL_RECORD_DTYPE = np.dtype([("event", "u1"), ("profile_id", "<i8"), ("timestamp", "<f8")])
+"""Fixed-size journal record, so the journal is read as one array and a torn last record is detected by the file size"""
+
+QUEUE_SNAPSHOT_DTYPE = np.dtype([("profile_id", "<i8"), ("enqueued_at", "<f8")])
+"""Entry of the snapshot of the queued players"""
+
+EVENT_CODES = {QueueEventType.ENQUEUED: 1, QueueEventType.DEQUEUED: 2, QueueEventType.MATCHED: 3}
+
+FLUSH_SECONDS = metrics_registry.histogram("matchmaking_queue_journal_flush_seconds", "Time spent writing and syncing a batch of queue journal events")
+JOURNAL_EVENTS = metrics_registry.counter("matchmaking_queue_journal_events_total", "Queue events written to the journal")
+COMPACTIONS = metrics_registry.counter("matchmaking_queue_journal_compactions_total", "Compactions of the queue journal into the snapshot")
+
+def replay_queue_journal(snapshot: np.ndarray, records: np.ndarray) -> np.ndarray:
+    """
+    Rebuild the queued players from a snapshot and the journal events written after it.
+    A player is only journaled as enqueued when not queued, so the last event of every player decides
+    whether the player is queued, and the events are applied at once instead of one by one.
+    Replaying events already contained in the snapshot gives the same state, e.g. after a crash during a compaction.
+    Args:
+        snapshot: The queued players of the snapshot, of `QUEUE_SNAPSHOT_DTYPE`.
+        records: The journal records, of `JOURNAL_RECORD_DTYPE`, in the order they were written.
+    Returns:
+        The queued players of `QUEUE_SNAPSHOT_DTYPE` in the order they joined.
+    """
+    if len(records) > 0:
+        # Index of the last event of every player, `np.unique` returns the first occurrence in the reversed records
+        journaled_ids, reversed_index = np.unique(records["profile_id"][::-1], return_index=True)
+        last_records = records[len(records) - 1 - reversed_index]
+        enqueued = last_records[last_records["event"] == EVENT_CODES[QueueEventType.ENQUEUED]]
+        journaled_entries = np.empty(len(enqueued), dtype=QUEUE_SNAPSHOT_DTYPE)
+        journaled_entries["profile_id"] = enqueued["profile_id"]
+        journaled_entries["enqueued_at"] = enqueued["timestamp"]
+        snapshot = np.concatenate((snapshot[~np.isin(snapshot["profile_id"], journaled_ids)], journaled_entries))
+
+    return snapshot[np.argsort(snapshot["enqueued_at"], kind="stable")]
+
+class QueueJournal:
+    """
+    Durable record of the in-memory queue: an append-only journal of the enqueue, dequeue and match events
+    and a compact snapshot of the queued players, from which the queue of a restarted process is recovered.
+    The queue listener only buffers the events, a background thread writes them in batches with one fsync per batch,
+    so the requests never wait for the disk. The events of the last `flush_interval` seconds are lost by a crash.
+    Once the journal holds `compact_events` events, it is folded into the snapshot and started again.
+    """
+    directory: str
+    flush_interval: float
+    """Seconds between two writes of the buffered events"""
+    compact_events: int
+    """Number of journal events after which the journal is compacted into the snapshot"""
+    logger = logging.getLogger()
+
+    def __init__(self, directory: str, flush_interval: float = 0.05, compact_events: int = 100_000) -> None:
+        """
+        Args:
+            directory: The directory of the journal and the snapshot, created if it does not exist.
+            flush_interval: Seconds between two writes of the buffered events.
+            compact_events: Number of journal events after which the journal is compacted into the snapshot.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.compact_events = compact_events
+        self.journal_path = os.path.join(directory, JOURNAL_FILE)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self._pending: list[tuple[int, int, float]] = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._journal_file = None
+        self._journal_events = 0
+        self._players_queue: QueueStore | None = None
+        self._stop = threading.Event()
+        self._writer: threading.Thread | None = None
+
+    def recover(self) -> np.ndarray:
+        """
+        Read the queued players from the snapshot and the journal.
+        A record torn by a crash at the end of the journal is ignored.
+        Returns:
+            The queued players of `QUEUE_SNAPSHOT_DTYPE` in the order they joined.
+        Raises:
+            ValueError: If the files were written by an incompatible version of the backend.
+        """
+        return replay_queue_journal(self._read_snapshot(), self._read_journal())
+
+    def start(self, players_queue: QueueStore) -> None:
+        """
+        Start journaling the changes of a queue: the current queue becomes the snapshot and the journal starts empty.
+        Call it once the recovered players are restored into the queue.
+        """
+        if self._writer is not None:
+            return
+
+        # Subscribed before the snapshot, so no change is missed; a change in both is replayed to the same state
+        self._players_queue = players_queue
+        players_queue.subscribe(self._on_queue_event)
+        entries = players_queue.entries()
+        snapshot = np.empty(len(entries), dtype=QUEUE_SNAPSHOT_DTYPE)
+        snapshot["profile_id"] = [entry.profile_id for entry in entries]
+        snapshot["enqueued_at"] = [entry.enqueued_at for entry in entries]
+
+        with self._write_lock:
+            self._write_snapshot(snapshot)
+            self._reset_journal()
+
+        self._writer = threading.Thread(target=self._run, name="queue-journal", daemon=True)
+        self._writer.start()
+
+    def flush(self) -> None:
+        """
+        Write and sync the buffered events now, e.g. before the process exits.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+
+        if not pending:
+            return
+
+        records = np.array(pending, dtype=JOURNAL_RECORD_DTYPE)
+
+        with self._write_lock, FLUSH_SECONDS.time():
+            if self._journal_file is None:
+                return
+
+            self._journal_file.write(records.tobytes())
+            self._journal_file.flush()
+            os.fsync(self._journal_file.fileno())
+            self._journal_events += len(records)
+            JOURNAL_EVENTS.inc(len(records))
+
+            if self._journal_events >= self.compact_events:
+                self._compact()
+
+    def close(self) -> None:
+        """
+        Stop journaling: the buffered events are written and the files are closed.
+        """
+        if self._players_queue is not None:
+            self._players_queue.unsubscribe(self._on_queue_event)
+            self._players_queue = None
+
+        if self._writer is not None:
+            self._stop.set()
+            self._writer.join()
+            self._writer = None
+
+        self.flush()
+
+        with self._write_lock:
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+
+    def _on_queue_event(self, event: QueueEvent) -> None:
+        """
+        Called by the queue in the thread changing it, only buffers the event.
+        """
+        with self._pending_lock:
+            self._pending.append((EVENT_CODES[event.type], event.profile_id, event.timestamp))
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError:
+                self.logger.exception("Writing the queue journal failed")
+
+    def _compact(self) -> None:
+        """
+        Fold the journal into the snapshot and start an empty journal. Called with the write lock held.
+        """
+        self._write_snapshot(self.recover())
+        self._reset_journal()
+        COMPACTIONS.inc()
+        self.logger.info(f"Queue journal compacted into {self.snapshot_path}")
+
+    def _reset_journal(self) -> None:
+        """
+        Replace the journal with an empty one. Called with the write lock held, after the snapshot is written.
+        """
+        if self._journal_file is not None:
+            self._journal_file.close()
+
+        tmp_path = f"{self.journal_path}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            f.write(JOURNAL_HEADER)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.journal_path)
+        self._sync_directory()
+        self._journal_file = open(self.journal_path, "ab")
+        self._journal_events = 0
+
+    def _write_snapshot(self, snapshot: np.ndarray) -> None:
+        tmp_path = f"{self.snapshot_path}.tmp"
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.snapshot_path)
+        self._sync_directory()
+
+    def _read_snapshot(self) -> np.ndarray:
+        if not os.path.exists(self.snapshot_path):
+            return np.empty(0, dtype=QUEUE_SNAPSHOT_DTYPE)
+
+        snapshot = np.load(self.snapshot_path)
+
+        if snapshot.dtype != QUEUE_SNAPSHOT_DTYPE:
+            raise ValueError(f"The queue snapshot {self.snapshot_path} has an unsupported layout {snapshot.dtype}")
+
+        return snapshot
+
+    def _read_journal(self) -> np.ndarray:
+        if not os.path.exists(self.journal_path):
+            return np.empty(0, dtype=JOURNAL_RECORD_DTYPE)
+
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+
+        if len(data) < len(JOURNAL_HEADER) or not data.startswith(JOURNAL_HEADER[:8]):
+            raise ValueError(f"{self.journal_path} is not a queue journal")
+
+        if not data.startswith(JOURNAL_HEADER):
+            raise ValueError(f"Unsupported queue journal version in {self.journal_path}, expected {JOURNAL_FORMAT_VERSION}")
+
+        records_count = (len(data) - len(JOURNAL_HEADER)) // JOURNAL_RECORD_DTYPE.itemsize
+        return np.frombuffer(data, dtype=JOURNAL_RECORD_DTYPE, count=records_count, offset=len(JOURNAL_HEADER))
+
+    def _sync_directory(self) -> None:
+        """
+        Make a replaced file durable, the rename is only durable once the directory is synced.
+        """
+        if os.name != "posix":
+            return
+
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
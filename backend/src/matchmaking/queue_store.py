@@ -0,0 +1,275 @@
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from enum import StrEnum
+
+class QueueEventType(StrEnum):
+    ENQUEUED = "enqueued"
+    DEQUEUED = "dequeued"
+    MATCHED = "matched"
+
+
+@dataclass(slots=True, frozen=True)
+class QueueEvent:
+    type: QueueEventType
+    profile_id: int
+    timestamp: float
+
+
+@dataclass(slots=True, frozen=True)
+class QueueEntry:
+    profile_id: int
+    cluster: int
+    rating: float
+    enqueued_at: float
+    """Timestamp when the player joined the queue, as returned by the queue's clock"""
+
+
+class QueueStore(ABC):
+    """
+    State of the matchmaking: the players waiting for a match and the formed matches waiting to be polled.
+    Listeners are notified about the changes made through this store object, changes made by other
+    processes sharing the same state are not reported.
+    """
+    is_shared = False
+    """Whether other processes change the same state, so the listeners do not see every change"""
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        """
+        Args:
+            clock: The function returning the current timestamp in seconds, used for enqueue times.
+                Stores shared by several processes need a clock that is consistent between them.
+        """
+        self.clock = clock
+        self._listeners: list[Callable[[QueueEvent], None]] = []
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def __contains__(self, profile_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over the profile IDs of the queued players in the order they joined."""
+
+    def subscribe(self, listener: Callable[[QueueEvent], None]) -> None:
+        """
+        Register a function called on every change of the queue.
+        """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[QueueEvent], None]) -> None:
+        self._listeners.remove(listener)
+
+    @abstractmethod
+    def get(self, profile_id: int) -> QueueEntry | None:
+        """
+        Get the queue entry of a player, or None if the player is not queued.
+        """
+
+    @abstractmethod
+    def entries(self) -> list[QueueEntry]:
+        """
+        Get the entries of all queued players in the order they joined.
+        """
+
+    @abstractmethod
+    def add(self, profile_id: int, cluster: int, rating: float, enqueued_at: float | None = None) -> bool:
+        """
+        Add a player to the queue, dropping the player's match that was not polled yet.
+        Args:
+            profile_id: The profile ID of the player.
+            cluster: The cluster of the player.
+            rating: The ELO rating of the player.
+            enqueued_at: The enqueue timestamp, defaults to the current time.
+        Returns:
+            True if the player was added, False if the player was already queued.
+        """
+
+    @abstractmethod
+    def add_many(self, entries: Iterable[tuple[int, int, float]], enqueued_at: Iterable[float] | None = None) -> int:
+        """
+        Add many players at once. Listeners are not notified.
+        Args:
+            entries: The (profile_id, cluster, rating) tuples of the players.
+            enqueued_at: The enqueue timestamps aligned with the entries, e.g. of recovered players. Defaults to the current time.
+        Returns:
+            The number of players added.
+        """
+
+    @abstractmethod
+    def remove(self, profile_id: int, event_type: QueueEventType = QueueEventType.DEQUEUED) -> QueueEntry | None:
+        """
+        Remove a player from the queue.
+        Args:
+            profile_id: The profile ID of the player.
+            event_type: The event type reported to the listeners, `MATCHED` when the player leaves the queue with a match.
+        Returns:
+            The removed entry, or None if the player was not queued.
+        """
+
+    @abstractmethod
+    def update(self, profile_id: int, cluster: int, rating: float) -> bool:
+        """
+        Change the cluster and the rating of a queued player, keeping the position in the queue and the enqueue time.
+        Listeners are not notified since the player stays in the queue.
+        Returns:
+            True if the player was updated, False if the player is not queued.
+        """
+
+    @abstractmethod
+    def claim_pair(self, profile_id_A: int, profile_id_B: int) -> tuple[QueueEntry, QueueEntry] | None:
+        """
+        Remove two players from the queue as matched, only if both of them are still queued.
+        The check and the removal are atomic, so a player is never matched twice
+        by concurrent matchmaking sharing the same state.
+        Returns:
+            The removed entries of player A and player B, or None if one of them is not queued anymore.
+        """
+
+    @abstractmethod
+    def claim_players(self, profile_ids: list[int]) -> list[QueueEntry] | None:
+        """
+        Remove players from the queue as matched, only if all of them are still queued, e.g. the players of a team game.
+        The check and the removal are atomic like `claim_pair`.
+        Returns:
+            The removed entries in the order of the profile IDs, or None if one of them is not queued anymore.
+        """
+
+    @abstractmethod
+    def cluster_size(self, cluster: int) -> int:
+        """
+        Get the number of queued players in a cluster.
+        """
+
+    @abstractmethod
+    def cluster_members(self, cluster: int) -> list[int]:
+        """
+        Get the profile IDs of the queued players in a cluster, ordered by rating.
+        """
+
+    @abstractmethod
+    def clusters(self) -> list[int]:
+        """
+        Get the clusters that have at least one queued player.
+        """
+
+    @abstractmethod
+    def nearest_by_rating(
+        self,
+        rating: float,
+        k: int = 1,
+        max_diff: float = float("inf"),
+        cluster: int | None = None,
+        exclude: int | None = None,
+    ) -> list[QueueEntry]:
+        """
+        Find the queued players with the closest ratings.
+        Args:
+            rating: The rating to search around.
+            k: The maximum number of players to return.
+            max_diff: The maximum rating difference.
+            cluster: Restrict the search to a cluster, search the whole queue if None.
+            exclude: The profile ID to skip, usually the searching player.
+        Returns:
+            Up to `k` queue entries ordered by the rating difference.
+        """
+
+    def wait_time(self, profile_id: int) -> float | None:
+        """
+        Get the number of seconds a player has been waiting in the queue, or None if the player is not queued.
+        """
+        entry = self.get(profile_id)
+        return None if entry is None else self.clock() - entry.enqueued_at
+
+    def positions(self, profile_ids: list[int]) -> dict[int, int]:
+        """
+        Get the positions of players in the queue by the time of joining, in one pass over the queue.
+        Returns:
+            The 1-based position of every queued player of the profile IDs, the players not queued are left out.
+        """
+        remaining = set(profile_ids)
+        positions: dict[int, int] = {}
+
+        for position, profile_id in enumerate(self, 1):
+            if profile_id in remaining:
+                positions[profile_id] = position
+                remaining.discard(profile_id)
+
+                if not remaining:
+                    break
+
+        return positions
+
+    @abstractmethod
+    def max_wait_time(self) -> float:
+        """
+        Get the number of seconds the longest waiting player has been in the queue, 0 if the queue is empty.
+        """
+
+    @abstractmethod
+    def put_match(self, profile_id: int, match: dict) -> None:
+        """
+        Keep a formed match until the player polls it.
+        Args:
+            profile_id: The profile ID of the matched player.
+            match: The match data in the same format as `Matchmaker.find_match_for_player`.
+        """
+
+    @abstractmethod
+    def get_match(self, profile_id: int) -> dict | None:
+        """
+        Get the match formed for a player without forgetting it.
+        Returns:
+            The match data, or None if the player has no match yet.
+        """
+
+    @abstractmethod
+    def pop_match(self, profile_id: int) -> dict | None:
+        """
+        Get the match formed for a player and forget it.
+        Returns:
+            The match data, or None if the player has no match yet.
+        """
+
+    def _notify(self, event_type: QueueEventType, profile_id: int, timestamp: float) -> None:
+        if not self._listeners:
+            return
+
+        event = QueueEvent(event_type, profile_id, timestamp)
+
+        for listener in self._listeners:
+            listener(event)
+
+
+QUEUE_STORES = ("memory", "sqlite")
+"""Available queue stores by name"""
+
+def create_queue_store(name: str, sqlite_path: str | None = None) -> QueueStore:
+    """
+    Create a queue store.
+    Args:
+        name: The name of the store: `memory` keeps the queue in the process,
+            `sqlite` shares it between the processes using the same database file.
+        sqlite_path: The path to the SQLite database file, required by the `sqlite` store.
+    Raises:
+        ValueError: If the store name is unknown or the SQLite path is missing.
+    """
+    # Imported here since the implementations depend on this module
+    from .player_queue import PlayerQueue
+    from .sqlite_queue_store import SqliteQueueStore
+
+    match name:
+        case "memory":
+            return PlayerQueue()
+        case "sqlite":
+            if not sqlite_path:
+                raise ValueError("The sqlite queue store requires a database path")
+
+            return SqliteQueueStore(sqlite_path)
+        case _:
+            raise ValueError(f"Unknown queue store '{name}', expected one of {list(QUEUE_STORES)}")
@@ -0,0 +1,341 @@
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from enum import IntEnum
+import numpy as np
+import pandas as pd
+from core import get_model_path, settings
+from .batch_matchmaker import BatchMatchmaker
+from .matchmaker import Matchmaker
+from .model_artifacts import ModelArtifacts, load_model_artifacts
+from .player_queue import PlayerQueue
+from .player_store import PlayerStore
+from .queue_store import QueueEvent, QueueEventType
+
+SIMULATION_MODES = ("pair", "batch")
+"""`pair`: every player requests a match on arrival and again every `retry_interval` while queued,
+`batch`: the batch matchmaking pairs the whole queue every `batch_interval`"""
+
+WAIT_PERCENTILES = (50, 90, 99)
+
+logger = logging.getLogger()
+
+class EventType(IntEnum):
+    """Simulated events, the value orders the events happening at the same time"""
+    BATCH_TICK = 0
+    ARRIVAL = 1
+    RETRY = 2
+    ABANDON = 3
+
+
+class VirtualClock:
+    """
+    Clock of the simulated time given to the queue instead of the wall clock, so the enqueue times,
+    the wait times and the widening of the ELO window follow the simulated events.
+    """
+    now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@dataclass(slots=True, frozen=True)
+class SimulationConfig:
+    mode: str = "pair"
+    """One of `SIMULATION_MODES`"""
+    duration: float = 600.0
+    """Simulated seconds, no player arrives and no match is requested after it"""
+    arrival_rate: float = 5.0
+    """Players joining the queue per simulated second in a synthetic arrival stream"""
+    rate_multiplier: float = 1.0
+    """Speed-up of the arrival stream, synthetic or recorded, to simulate a busier or a quieter ladder"""
+    target: float = 0.5
+    tolerance: float = 0.1
+    elo_window: float = settings.elo_window
+    elo_window_growth: float = settings.elo_window_growth
+    retry_interval: float = 5.0
+    """Simulated seconds between two match requests of a queued player in the `pair` mode"""
+    batch_interval: float = 1.0
+    """Simulated seconds between two batch matchmaking ticks in the `batch` mode"""
+    max_wait: float = 300.0
+    """Simulated seconds after which a player still waiting leaves the queue"""
+    seed: int = 0
+    """Seed of the synthetic arrival stream and of the random tie breaks of the matchmaking"""
+
+
+def generate_arrivals(player_store: PlayerStore, arrival_rate: float, duration: float, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Generate a Poisson arrival stream of players drawn uniformly from the players data.
+    Returns:
+        The sorted arrival times in seconds from the start and the profile IDs of the arriving players.
+    """
+    rng = np.random.default_rng(seed)
+    arrivals_count = rng.poisson(arrival_rate * duration)
+    arrived_at = np.sort(rng.uniform(0.0, duration, arrivals_count))
+    return arrived_at, rng.choice(player_store.profile_ids, arrivals_count)
+
+def load_arrivals(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Read a recorded arrival stream from a CSV file with the `arrived_at` and `profile_id` columns.
+    `arrived_at` holds either seconds or date-times, the stream is shifted to start at 0.
+    Returns:
+        The sorted arrival times in seconds from the start and the profile IDs of the arriving players.
+    """
+    arrivals_df = pd.read_csv(path, usecols=["arrived_at", "profile_id"])
+    arrived_at = arrivals_df["arrived_at"]
+
+    if not pd.api.types.is_numeric_dtype(arrived_at):
+        arrived_at = pd.to_datetime(arrived_at, utc=True).astype("int64") / 1e9
+
+    arrived_at = arrived_at.to_numpy(dtype=np.float64)
+    order = np.argsort(arrived_at, kind="stable")
+    arrived_at = arrived_at[order]
+    return arrived_at - (arrived_at[0] if len(arrived_at) > 0 else 0.0), arrivals_df["profile_id"].to_numpy(dtype=np.int64)[order]
+
+def run_simulation(config: SimulationConfig, artifacts: ModelArtifacts, arrivals: tuple[np.ndarray, np.ndarray] | None = None) -> dict:
+    """
+    Replay an arrival stream against a real `Matchmaker` with an empty in-memory queue in virtual time:
+    the events are processed as fast as the matchmaking runs and the clock jumps from one event to the next,
+    so hours of a ladder are simulated in seconds.
+    Args:
+        config: The simulation parameters.
+        artifacts: The loaded classifier and players data, reused by all the simulations of a process.
+        arrivals: The recorded arrival times and profile IDs, see `load_arrivals`.
+            A synthetic stream is generated by default. Players missing in the players data are skipped.
+    Returns:
+        The report of the simulation: the config, the counts of the arrivals, matches and players leaving the queue,
+        the matches per simulated second, the wait time percentiles, the spread of the predicted win probabilities
+        and the CPU time spent per match.
+    Raises:
+        ValueError: If the mode is not supported.
+    """
+    if config.mode not in SIMULATION_MODES:
+        raise ValueError(f"Unknown simulation mode '{config.mode}', expected one of {list(SIMULATION_MODES)}")
+
+    clock = VirtualClock()
+    players_queue = PlayerQueue(clock=clock)
+    matchmaker = Matchmaker(player_store=artifacts.player_store, players_queue=players_queue)
+    matchmaker.swap_artifacts(artifacts)
+    matchmaker.elo_window = config.elo_window
+    matchmaker.elo_window_growth = config.elo_window_growth
+    batch_matchmaker = BatchMatchmaker(matchmaker, config.target, config.tolerance)
+    # The matchmaking breaks ties with the global random generator
+    np.random.seed(config.seed)
+
+    if arrivals is None:
+        arrived_at, profile_ids = generate_arrivals(artifacts.player_store, config.arrival_rate * config.rate_multiplier, config.duration, config.seed)
+    else:
+        arrived_at, profile_ids = arrivals[0] / config.rate_multiplier, arrivals[1]
+
+    is_simulated = np.isin(profile_ids, artifacts.player_store.profile_ids) & (arrived_at <= config.duration)
+    # A recorded stream shorter than the duration is simulated until its last arrival
+    simulated_seconds = config.duration if arrivals is None or not is_simulated.any() else min(config.duration, float(arrived_at[is_simulated][-1]))
+    sequence = itertools.count()
+    # (time, event type, sequence, profile ID, enqueue time of the player the event was scheduled for)
+    events: list[tuple[float, int, int, int, float]] = [
+        (at, EventType.ARRIVAL, next(sequence), profile_id, 0.0)
+        for at, profile_id in zip(arrived_at[is_simulated].tolist(), profile_ids[is_simulated].tolist())
+    ]
+    heapq.heapify(events)
+
+    if config.mode == "batch":
+        events.append((config.batch_interval, EventType.BATCH_TICK, next(sequence), 0, 0.0))
+        heapq.heapify(events)
+
+    enqueued_at: dict[int, float] = {}
+    wait_times: list[float] = []
+    win_probs: list[float] = []
+    abandoned_count = 0
+
+    # The waits are measured on the queue events, the same for the matches formed on request and by the batch matchmaking
+    def on_queue_event(event: QueueEvent) -> None:
+        if event.type == QueueEventType.ENQUEUED:
+            enqueued_at[event.profile_id] = event.timestamp
+        elif event.type == QueueEventType.MATCHED:
+            wait_times.append(event.timestamp - enqueued_at.pop(event.profile_id))
+        else:
+            enqueued_at.pop(event.profile_id, None)
+
+    def request_match(profile_id: int) -> None:
+        match = matchmaker.find_match_for_player(profile_id, config.target, config.tolerance)
+
+        if match is not None:
+            win_probs.append(match["player_1_win_prob"])
+        elif clock.now + config.retry_interval <= config.duration:
+            heapq.heappush(events, (clock.now + config.retry_interval, EventType.RETRY, next(sequence), profile_id, enqueued_at[profile_id]))
+
+    players_queue.subscribe(on_queue_event)
+    # The matchmaker logs every request without an opponent, which would dominate the measured CPU time
+    logging.disable(logging.WARNING)
+    cpu_started_at = time.process_time()
+    wall_started_at = time.perf_counter()
+
+    try:
+        while events:
+            at, event_type, _, profile_id, scheduled_for = heapq.heappop(events)
+            clock.now = at
+
+            match event_type:
+                case EventType.ARRIVAL:
+                    # Joining twice keeps the original position and the scheduled events
+                    if profile_id in enqueued_at:
+                        continue
+
+                    matchmaker.add_player_to_queue(profile_id)
+                    heapq.heappush(events, (at + config.max_wait, EventType.ABANDON, next(sequence), profile_id, at))
+
+                    if config.mode == "pair":
+                        request_match(profile_id)
+                case EventType.RETRY:
+                    # Skip the retries of players matched since, who may have joined again
+                    if enqueued_at.get(profile_id) == scheduled_for:
+                        request_match(profile_id)
+                case EventType.BATCH_TICK:
+                    win_probs.extend(match["player_1_win_prob"] for match in batch_matchmaker.run_tick())
+
+                    if at + config.batch_interval <= config.duration:
+                        heapq.heappush(events, (at + config.batch_interval, EventType.BATCH_TICK, next(sequence), 0, 0.0))
+                case EventType.ABANDON:
+                    if enqueued_at.get(profile_id) == scheduled_for:
+                        matchmaker.remove_player_from_queue(profile_id)
+                        abandoned_count += 1
+    finally:
+        logging.disable(logging.NOTSET)
+
+    cpu_seconds = time.process_time() - cpu_started_at
+    wall_seconds = time.perf_counter() - wall_started_at
+    players_queue.unsubscribe(on_queue_event)
+
+    waits = np.array(wait_times, dtype=np.float64)
+    probs = np.array(win_probs, dtype=np.float64)
+    prob_errors = np.abs(probs - config.target)
+    matches_count = len(probs)
+    return {
+        "config": asdict(config),
+        "arrivals": int(is_simulated.sum()),
+        "matches": matches_count,
+        "abandoned": abandoned_count,
+        "still_queued": len(players_queue),
+        "simulated_seconds": round(simulated_seconds, 3),
+        "matches_per_second": round(matches_count / simulated_seconds, 4) if simulated_seconds > 0 else None,
+        "wait_seconds": {
+            **{f"p{q}": round(float(np.percentile(waits, q)), 3) for q in WAIT_PERCENTILES},
+            "mean": round(float(waits.mean()), 3),
+            "max": round(float(waits.max()), 3),
+        } if len(waits) > 0 else None,
+        # Matches out of the tolerance were formed by the ELO fallback
+        "win_prob": {
+            "mean": round(float(probs.mean()), 4),
+            "std": round(float(probs.std()), 4),
+            "mean_abs_error": round(float(prob_errors.mean()), 4),
+            "p90_abs_error": round(float(np.percentile(prob_errors, 90)), 4),
+            "out_of_tolerance_share": round(float((prob_errors > config.tolerance).mean()), 4),
+        } if matches_count > 0 else None,
+        "cpu_ms_per_match": round(1000 * cpu_seconds / matches_count, 3) if matches_count > 0 else None,
+        "cpu_seconds": round(cpu_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "speedup": round(simulated_seconds / wall_seconds, 1) if wall_seconds > 0 else None,
+    }
+
+_worker_artifacts: ModelArtifacts | None = None
+_worker_arrivals: tuple[np.ndarray, np.ndarray] | None = None
+
+def _init_worker(model_path: str, players_path: str, arrivals_path: str | None, single_threaded: bool) -> None:
+    """
+    Load the artifacts and the recorded arrivals once per worker process, not once per simulation.
+    """
+    global _worker_artifacts, _worker_arrivals
+    _worker_artifacts = load_model_artifacts(model_path, players_path, settings.inference_backend)
+    _worker_arrivals = load_arrivals(arrivals_path) if arrivals_path else None
+
+    # The processes run the simulations in parallel, a classifier using all the cores in each of them would oversubscribe the CPU
+    if single_threaded:
+        _worker_artifacts.classifier_model.get_booster().set_param({"nthread": 1})
+
+def _run_worker_simulation(config: SimulationConfig) -> dict:
+    return run_simulation(config, _worker_artifacts, _worker_arrivals)
+
+def run_sweep(
+    configs: list[SimulationConfig],
+    model_path: str | None = None,
+    players_path: str | None = None,
+    arrivals_path: str | None = None,
+    processes: int | None = None,
+) -> list[dict]:
+    """
+    Run the simulations of a parameter sweep in parallel across processes, each simulation runs in one process.
+    Args:
+        configs: The simulation parameters to run.
+        model_path: The path to the pickled classifier, `classifier_model.xgb` in the models directory by default.
+        players_path: The path to the players CSV file, `clustered_players.csv` in the models directory by default.
+        arrivals_path: The path to a recorded arrival stream, see `load_arrivals`. Synthetic streams by default.
+        processes: The number of worker processes, the number of cores by default. With 1 the simulations run in this process.
+    Returns:
+        The simulation reports in the order of the configs.
+    """
+    processes = min(processes or os.cpu_count() or 1, len(configs))
+    model_path = model_path or get_model_path("classifier_model.xgb")
+    players_path = players_path or get_model_path("clustered_players.csv")
+
+    if processes <= 1:
+        _init_worker(model_path, players_path, arrivals_path, single_threaded=False)
+        return [_run_worker_simulation(config) for config in configs]
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(model_path, players_path, arrivals_path, True)) as executor:
+        return list(executor.map(_run_worker_simulation, configs))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Simulate the matchmaking queue in virtual time and report the wait times and the throughput. "
+                    "Every parameter accepts several values, the simulations of all their combinations run in parallel."
+    )
+    defaults = SimulationConfig()
+    parser.add_argument("--model", default=get_model_path("classifier_model.xgb"), help="Path to the classifier")
+    parser.add_argument("--players", default=get_model_path("clustered_players.csv"), help="Path to the players CSV file the arriving players are drawn from")
+    parser.add_argument("--arrivals", default=None, help="CSV file of a recorded arrival stream with the arrived_at and profile_id columns, a synthetic Poisson stream by default")
+    parser.add_argument("--mode", nargs="+", choices=SIMULATION_MODES, default=[defaults.mode], help="Matchmaking mode")
+    parser.add_argument("--duration", nargs="+", type=float, default=[defaults.duration], help="Simulated seconds")
+    parser.add_argument("--arrival-rate", nargs="+", type=float, default=[defaults.arrival_rate], help="Players joining the queue per second of a synthetic stream")
+    parser.add_argument("--rate-multiplier", nargs="+", type=float, default=[defaults.rate_multiplier], help="Speed-up of the arrival stream")
+    parser.add_argument("--target", nargs="+", type=float, default=[defaults.target], help="Target probability that a player wins")
+    parser.add_argument("--tolerance", nargs="+", type=float, default=[defaults.tolerance], help="Maximum difference between the target and the predicted probability")
+    parser.add_argument("--elo-window", nargs="+", type=float, default=[defaults.elo_window], help="Initial rating window of the ELO fallback")
+    parser.add_argument("--elo-window-growth", nargs="+", type=float, default=[defaults.elo_window_growth], help="Rating points the ELO window widens by per second of waiting")
+    parser.add_argument("--retry-interval", nargs="+", type=float, default=[defaults.retry_interval], help="Seconds between two match requests of a queued player in the pair mode")
+    parser.add_argument("--batch-interval", nargs="+", type=float, default=[defaults.batch_interval], help="Seconds between two ticks in the batch mode")
+    parser.add_argument("--max-wait", nargs="+", type=float, default=[defaults.max_wait], help="Seconds after which a waiting player leaves the queue")
+    parser.add_argument("--seed", nargs="+", type=int, default=[defaults.seed], help="Seed of the simulation")
+    parser.add_argument("--processes", type=int, default=None, help="Number of worker processes, the number of cores by default")
+    parser.add_argument("--output", default=None, help="Path to write the JSON reports to")
+    args = parser.parse_args()
+
+    names = [field.name for field in fields(SimulationConfig)]
+    configs = [SimulationConfig(**dict(zip(names, values))) for values in itertools.product(*(getattr(args, name) for name in names))]
+    logger.info(f"Running {len(configs)} simulations")
+    reports = run_sweep(configs, args.model, args.players, args.arrivals, args.processes)
+
+    for report in reports:
+        config, wait_seconds = report["config"], report["wait_seconds"] or {}
+        p50, p99 = wait_seconds.get("p50"), wait_seconds.get("p99")
+        matches, arrivals, matches_per_second = report["matches"], report["arrivals"], report["matches_per_second"]
+        abandoned, cpu_ms_per_match, speedup = report["abandoned"], report["cpu_ms_per_match"], report["speedup"]
+        logger.info(
+            f"{config}: {matches} matches of {arrivals} arrivals, {matches_per_second} matches/s, wait p50 {p50}s p99 {p99}s, "
+            f"{abandoned} left the queue, {cpu_ms_per_match} CPU ms per match, {speedup}x real time"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+        logger.info(f"Reports written to {args.output}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
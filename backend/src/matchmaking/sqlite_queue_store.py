@@ -0,0 +1,270 @@
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from itertools import repeat
+import numpy as np
+from .queue_store import QueueEntry, QueueEventType, QueueStore
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile_id INTEGER NOT NULL UNIQUE,
+    cluster INTEGER NOT NULL,
+    rating REAL NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_rating ON queue (rating, profile_id);
+CREATE INDEX IF NOT EXISTS queue_cluster_rating ON queue (cluster, rating, profile_id);
+CREATE TABLE IF NOT EXISTS matches (
+    profile_id INTEGER PRIMARY KEY,
+    match TEXT NOT NULL
+);
+"""
+"""Tables of the queued players, `seq` keeps the join order, and of the formed matches as JSON"""
+
+QUEUE_ENTRY_COLUMNS = "profile_id, cluster, rating, enqueued_at"
+
+class SqliteQueueStore(QueueStore):
+    """
+    Matchmaking queue kept in a SQLite database in WAL mode, shared by all the processes opening the same file,
+    e.g. the workers of `uvicorn --workers N` on one host.
+    Every operation is a short transaction, writes take the database lock up front (`BEGIN IMMEDIATE`),
+    so removing the two players of a match is atomic across the processes and a player is never matched twice.
+    Readers do not block the writer in WAL mode.
+    """
+    is_shared = True
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time, timeout: float = 5.0) -> None:
+        """
+        Args:
+            path: The path to the database file, created if it does not exist.
+            clock: The function returning the current timestamp in seconds, the wall clock is consistent between processes.
+            timeout: Seconds to wait for the database lock held by another process.
+        """
+        super().__init__(clock)
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode, the transactions are started explicitly
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(QUEUE_SCHEMA)
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self) -> int:
+        return self._query_one("SELECT COUNT(*) FROM queue")[0]
+
+    def __contains__(self, profile_id: int) -> bool:
+        return self._query_one("SELECT 1 FROM queue WHERE profile_id = ?", (profile_id,)) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([row[0] for row in self._query("SELECT profile_id FROM queue ORDER BY seq")])
+
+    def get(self, profile_id: int) -> QueueEntry | None:
+        row = self._query_one(f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue WHERE profile_id = ?", (profile_id,))
+        return None if row is None else QueueEntry(*row)
+
+    def entries(self) -> list[QueueEntry]:
+        return [QueueEntry(*row) for row in self._query(f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue ORDER BY seq")]
+
+    def add(self, profile_id: int, cluster: int, rating: float, enqueued_at: float | None = None) -> bool:
+        enqueued_at = self.clock() if enqueued_at is None else enqueued_at
+
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO queue (profile_id, cluster, rating, enqueued_at) VALUES (?, ?, ?, ?)",
+                (profile_id, cluster, rating, enqueued_at),
+            )
+            is_added = cursor.rowcount > 0
+
+            # A player joining the queue again is no longer interested in the previous match
+            if is_added:
+                connection.execute("DELETE FROM matches WHERE profile_id = ?", (profile_id,))
+
+        if is_added:
+            self._notify(QueueEventType.ENQUEUED, profile_id, enqueued_at)
+
+        return is_added
+
+    def add_many(self, entries: Iterable[tuple[int, int, float]], enqueued_at: Iterable[float] | None = None) -> int:
+        timestamps = repeat(self.clock()) if enqueued_at is None else enqueued_at
+
+        with self._transaction() as connection:
+            changes_before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO queue (profile_id, cluster, rating, enqueued_at) VALUES (?, ?, ?, ?)",
+                ((profile_id, cluster, rating, timestamp) for (profile_id, cluster, rating), timestamp in zip(entries, timestamps)),
+            )
+            return connection.total_changes - changes_before
+
+    def remove(self, profile_id: int, event_type: QueueEventType = QueueEventType.DEQUEUED) -> QueueEntry | None:
+        with self._transaction() as connection:
+            row = connection.execute(f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue WHERE profile_id = ?", (profile_id,)).fetchone()
+
+            if row is None:
+                return None
+
+            connection.execute("DELETE FROM queue WHERE profile_id = ?", (profile_id,))
+
+        self._notify(event_type, profile_id, self.clock())
+        return QueueEntry(*row)
+
+    def update(self, profile_id: int, cluster: int, rating: float) -> bool:
+        with self._transaction() as connection:
+            cursor = connection.execute("UPDATE queue SET cluster = ?, rating = ? WHERE profile_id = ?", (cluster, rating, profile_id))
+            return cursor.rowcount > 0
+
+    def claim_pair(self, profile_id_A: int, profile_id_B: int) -> tuple[QueueEntry, QueueEntry] | None:
+        if profile_id_A == profile_id_B:
+            return None
+
+        with self._transaction() as connection:
+            rows = connection.execute(
+                f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue WHERE profile_id IN (?, ?)",
+                (profile_id_A, profile_id_B),
+            ).fetchall()
+
+            if len(rows) < 2:
+                return None
+
+            connection.execute("DELETE FROM queue WHERE profile_id IN (?, ?)", (profile_id_A, profile_id_B))
+
+        entries = {row[0]: QueueEntry(*row) for row in rows}
+        timestamp = self.clock()
+        self._notify(QueueEventType.MATCHED, profile_id_A, timestamp)
+        self._notify(QueueEventType.MATCHED, profile_id_B, timestamp)
+        return entries[profile_id_A], entries[profile_id_B]
+
+    def claim_players(self, profile_ids: list[int]) -> list[QueueEntry] | None:
+        if len(set(profile_ids)) != len(profile_ids):
+            return None
+
+        placeholders = ", ".join("?" * len(profile_ids))
+
+        with self._transaction() as connection:
+            rows = connection.execute(f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue WHERE profile_id IN ({placeholders})", profile_ids).fetchall()
+
+            if len(rows) < len(profile_ids):
+                return None
+
+            connection.execute(f"DELETE FROM queue WHERE profile_id IN ({placeholders})", profile_ids)
+
+        entries = {row[0]: QueueEntry(*row) for row in rows}
+        timestamp = self.clock()
+
+        for profile_id in profile_ids:
+            self._notify(QueueEventType.MATCHED, profile_id, timestamp)
+
+        return [entries[profile_id] for profile_id in profile_ids]
+
+    def cluster_size(self, cluster: int) -> int:
+        return self._query_one("SELECT COUNT(*) FROM queue WHERE cluster = ?", (cluster,))[0]
+
+    def cluster_members(self, cluster: int) -> list[int]:
+        rows = self._query("SELECT profile_id FROM queue WHERE cluster = ? ORDER BY rating, profile_id", (cluster,))
+        return [row[0] for row in rows]
+
+    def clusters(self) -> list[int]:
+        return [row[0] for row in self._query("SELECT DISTINCT cluster FROM queue")]
+
+    def nearest_by_rating(
+        self,
+        rating: float,
+        k: int = 1,
+        max_diff: float = float("inf"),
+        cluster: int | None = None,
+        exclude: int | None = None,
+    ) -> list[QueueEntry]:
+        conditions = ""
+        params: list = []
+
+        if cluster is not None:
+            conditions += " AND cluster = ?"
+            params.append(cluster)
+
+        if exclude is not None:
+            conditions += " AND profile_id != ?"
+            params.append(exclude)
+
+        # The k nearest players are among the k closest below and the k closest above the rating
+        below = self._query(
+            f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue WHERE rating <= ? AND rating >= ?{conditions} ORDER BY rating DESC, profile_id DESC LIMIT ?",
+            (rating, rating - max_diff, *params, k),
+        )
+        above = self._query(
+            f"SELECT {QUEUE_ENTRY_COLUMNS} FROM queue WHERE rating > ? AND rating <= ?{conditions} ORDER BY rating, profile_id LIMIT ?",
+            (rating, rating + max_diff, *params, k),
+        )
+        # Ties are broken in favour of the lower rating like the in-memory queue
+        nearest = sorted(
+            [(rating - row[2], 0, i, row) for i, row in enumerate(below)] + [(row[2] - rating, 1, i, row) for i, row in enumerate(above)]
+        )
+        return [QueueEntry(*row) for *_, row in nearest[:k]]
+
+    def max_wait_time(self) -> float:
+        oldest_enqueued_at = self._query_one("SELECT MIN(enqueued_at) FROM queue")[0]
+        return 0.0 if oldest_enqueued_at is None else self.clock() - oldest_enqueued_at
+
+    def put_match(self, profile_id: int, match: dict) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO matches (profile_id, match) VALUES (?, ?)",
+                (profile_id, json.dumps(match, default=_to_json_value)),
+            )
+
+    def get_match(self, profile_id: int) -> dict | None:
+        row = self._query_one("SELECT match FROM matches WHERE profile_id = ?", (profile_id,))
+        return None if row is None else json.loads(row[0])
+
+    def pop_match(self, profile_id: int) -> dict | None:
+        with self._transaction() as connection:
+            row = connection.execute("SELECT match FROM matches WHERE profile_id = ?", (profile_id,)).fetchone()
+
+            if row is None:
+                return None
+
+            connection.execute("DELETE FROM matches WHERE profile_id = ?", (profile_id,))
+
+        return json.loads(row[0])
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the block in a write transaction, rolled back if the block raises"""
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _query_one(self, sql: str, params: tuple = ()) -> tuple | None:
+        with self._lock:
+            return self._connection.execute(sql, params).fetchone()
+
+
+def _to_json_value(value: object) -> object:
+    """Convert the NumPy scalars of the players rows to plain Python values"""
+    if isinstance(value, np.generic):
+        return value.item()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,229 @@
+import logging
+import os
+from functools import cache
+from itertools import combinations
+import numpy as np
+from core import metrics_registry, settings
+from .matchmaker import MATCH_WAIT_SECONDS, Matchmaker
+from .model_artifacts import ModelArtifacts
+from .queue_store import QueueStore, create_queue_store
+
+TEAM_SIZES = (2, 3, 4)
+"""Supported numbers of players per team"""
+
+TEAM_MATCH_SECONDS = metrics_registry.histogram("matchmaking_team_match_seconds", "Time spent forming a team match", ("team_size",))
+TEAM_SPLITS = metrics_registry.counter("matchmaking_team_splits_total", "Team splits scored by the classifier", ("team_size",))
+TEAM_MATCHES = metrics_registry.counter("matchmaking_team_matches_total", "Formed team matches", ("team_size",))
+
+def aggregate_team_features(features: np.ndarray, team_rows: np.ndarray) -> np.ndarray:
+    """
+    Aggregate the per-player features of teams into team features scored by the 1v1 classifier,
+    the mean of every `PLAYER_FEATURE_COLUMNS` column over the team members.
+    Args:
+        features: The players features of the player store.
+        team_rows: The row indices of the team members, of shape (teams, team_size).
+    Returns:
+        The team features of shape (teams, len(PLAYER_FEATURE_COLUMNS)).
+    """
+    return features[team_rows].mean(axis=1)
+
+@cache
+def get_team_splits(team_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get every split of a group of `2 * team_size` players into two teams.
+    The first player is always in team A, so each split is listed once rather than once per side.
+    Returns:
+        The positions in the group of the team A members and of the team B members, both of shape (splits, team_size).
+    """
+    group_size = 2 * team_size
+    positions_A = np.array([(0, *others) for others in combinations(range(1, group_size), team_size - 1)], dtype=np.intp)
+    is_in_A = np.zeros((len(positions_A), group_size), dtype=bool)
+    np.put_along_axis(is_in_A, positions_A, True, axis=1)
+    positions_B = np.nonzero(~is_in_A)[1].reshape(len(positions_A), team_size)
+    return positions_A, positions_B
+
+def get_team_queue_path(sqlite_path: str, team_size: int) -> str:
+    """
+    Get the path to the SQLite queue of a team ladder next to the 1v1 queue, e.g. `queue_2v2.db` for `queue.db`.
+    """
+    root, extension = os.path.splitext(sqlite_path)
+    return f"{root}_{team_size}v{team_size}{extension}"
+
+class TeamMatchmaker:
+    """
+    Matchmaking of a team ladder (2v2, 3v3 or 4v4) with its own queue, scoring the team splits with the 1v1 classifier
+    on aggregated team features.
+    A match is formed around an anchor player: the pool is the queued players with the closest ratings,
+    the groups are the windows of `2 * team_size` consecutive players by rating that contain the anchor,
+    and only the most rating-balanced splits of every group are kept. All the kept splits are scored in one model call
+    and the split closest to the target probability wins, so the cost does not grow with the number of player combinations.
+    """
+    team_size: int
+    players_queue: QueueStore
+    """Queue of the players waiting for a team match of this size"""
+    pool_size: int
+    """Number of queued players with the closest ratings the teams are formed from"""
+    splits_per_group: int
+    """Number of the most rating-balanced splits of every group scored by the classifier"""
+    logger = logging.getLogger()
+
+    MAX_CLAIM_ATTEMPTS = 3
+    """Number of searches tried when the chosen players are matched first by another process sharing the queue"""
+
+    def __init__(self, matchmaker: Matchmaker, team_size: int, players_queue: QueueStore | None = None) -> None:
+        """
+        Args:
+            matchmaker: The 1v1 matchmaker providing the served models, the players data and the queue lock.
+            team_size: The number of players per team, one of `TEAM_SIZES`.
+            players_queue: The queue of the team ladder. Defaults to a store selected by the settings,
+                the SQLite store uses a database next to the 1v1 queue's.
+        Raises:
+            ValueError: If the team size is not supported.
+        """
+        if team_size not in TEAM_SIZES:
+            raise ValueError(f"Unsupported team size {team_size}, expected one of {list(TEAM_SIZES)}")
+
+        self.matchmaker = matchmaker
+        self.team_size = team_size
+        self.players_queue = players_queue if players_queue is not None else create_queue_store(
+            settings.queue_backend,
+            get_team_queue_path(settings.queue_sqlite_path, team_size),
+        )
+        self.pool_size = settings.team_pool_size
+        self.splits_per_group = settings.team_splits_per_group
+
+    def add_player_to_queue(self, player_id: int) -> bool:
+        """
+        Add a player to the team ladder queue.
+        Returns:
+            True if the player was added or already queued, False if the player does not exist.
+        """
+        store = self.matchmaker.player_store
+        row = store.get_row(player_id)
+
+        if row is None:
+            self.logger.error(f"Player {player_id} not found in the database")
+            return False
+
+        with self.matchmaker.queue_lock:
+            self.players_queue.add(player_id, int(store.clusters[row]), float(store.ratings[row]))
+
+        return True
+
+    def remove_player_from_queue(self, player_id: int) -> bool:
+        """
+        Remove a player from the team ladder queue.
+        Returns:
+            True if the player was removed, False if the player was not queued.
+        """
+        with self.matchmaker.queue_lock:
+            return self.players_queue.remove(player_id) is not None
+
+    def queue_length(self) -> int:
+        return len(self.players_queue)
+
+    def find_match(self, profile_id: int, target: float = 0.5, tolerance: float = 0.1) -> dict | None:
+        """
+        Form a team match around a player, the player is not required to be queued.
+        Args:
+            profile_id: The profile ID of the anchor player, who is always in team 1.
+            target: The target probability that team 1 wins.
+            tolerance: The maximum difference between the target probability and the predicted probability.
+        Returns:
+            The `team_1` and `team_2` player data and the probability `team_1_win_prob` that team 1 wins,
+            or None if not enough players are queued or no split is balanced enough.
+        Raises:
+            ValueError: If the models are not loaded or the player does not exist.
+        """
+        if not self.matchmaker.is_model_loaded:
+            raise ValueError("Models are not loaded. Call load_models() first.")
+
+        with self.matchmaker.queue_lock, TEAM_MATCH_SECONDS.time(str(self.team_size)):
+            artifacts = self.matchmaker.artifacts
+            is_queued = profile_id in self.players_queue
+
+            for _ in range(self.MAX_CLAIM_ATTEMPTS):
+                split = self._search_split(profile_id, artifacts, target, tolerance)
+
+                if split is None:
+                    return None
+
+                team_rows_A, team_rows_B, prob = split
+                profile_ids = artifacts.player_store.profile_ids
+                team_ids = profile_ids[np.concatenate((team_rows_A, team_rows_B))].tolist()
+                entries = self.players_queue.claim_players(team_ids if is_queued else [pid for pid in team_ids if pid != profile_id])
+
+                if entries is not None:
+                    for entry in entries:
+                        MATCH_WAIT_SECONDS.observe(self.players_queue.clock() - entry.enqueued_at)
+
+                    TEAM_MATCHES.inc(1, str(self.team_size))
+                    players_df = artifacts.player_store.players_df
+                    return {
+                        "team_1": players_df.iloc[team_rows_A].to_dict("records"),
+                        "team_2": players_df.iloc[team_rows_B].to_dict("records"),
+                        "team_1_win_prob": prob,
+                    }
+
+                if is_queued and profile_id not in self.players_queue:
+                    return None
+
+                self.logger.debug(f"Players of the team match of player {profile_id} were matched by another process, searching again")
+
+        return None
+
+    def _search_split(self, profile_id: int, artifacts: ModelArtifacts, target: float, tolerance: float) -> tuple[np.ndarray, np.ndarray, float] | None:
+        """
+        Find the best split into two teams of the queued players around the anchor player.
+        Returns:
+            The rows of team A (with the anchor) and of team B, and the probability that team A wins,
+            or None if not enough players are queued or no split is within the tolerance.
+        """
+        store = artifacts.player_store
+        anchor_row = store.get_row(profile_id)
+
+        if anchor_row is None:
+            raise ValueError(f"Player {profile_id} not found")
+
+        group_size = 2 * self.team_size
+        anchor_rating = float(store.ratings[anchor_row])
+        pool_entries = self.players_queue.nearest_by_rating(anchor_rating, k=self.pool_size - 1, exclude=profile_id)
+        pool_rows = np.concatenate(([anchor_row], store.get_rows([entry.profile_id for entry in pool_entries])))
+
+        if len(pool_rows) < group_size:
+            return None
+
+        # Groups of consecutive players by rating containing the anchor, with the anchor first
+        pool_rows = pool_rows[np.argsort(store.ratings[pool_rows], kind="stable")]
+        anchor_position = int(np.flatnonzero(pool_rows == anchor_row)[0])
+        starts = range(max(0, anchor_position - group_size + 1), min(anchor_position, len(pool_rows) - group_size) + 1)
+        groups = np.array([
+            [anchor_row, *np.delete(pool_rows[start:start + group_size], anchor_position - start)]
+            for start in starts
+        ])
+
+        # Keep the splits of every group with the smallest difference of the team ratings
+        positions_A, positions_B = get_team_splits(self.team_size)
+        teams_A, teams_B = groups[:, positions_A], groups[:, positions_B]
+        rating_diffs = np.abs(store.ratings[teams_A].sum(axis=2) - store.ratings[teams_B].sum(axis=2))
+        kept_count = min(self.splits_per_group, len(positions_A))
+        kept = np.argpartition(rating_diffs, kept_count - 1, axis=1)[:, :kept_count]
+        teams_A = np.take_along_axis(teams_A, kept[:, :, np.newaxis], axis=1).reshape(-1, self.team_size)
+        teams_B = np.take_along_axis(teams_B, kept[:, :, np.newaxis], axis=1).reshape(-1, self.team_size)
+        rating_diffs = np.take_along_axis(rating_diffs, kept, axis=1).ravel()
+
+        # Score all the kept splits of all the groups in one model call
+        features = store.features
+        X_matches = np.hstack((aggregate_team_features(features, teams_A), aggregate_team_features(features, teams_B)))
+        probs = self.matchmaker.predict_match_outcomes_by_features(X_matches, artifacts)
+        TEAM_SPLITS.inc(len(X_matches), str(self.team_size))
+
+        diffs = np.abs(probs - target)
+        diffs[diffs > tolerance] = np.inf
+
+        if not np.isfinite(diffs.min()):
+            return None
+
+        # The closest to the target, then the most rating-balanced split
+        best = int(np.lexsort((rating_diffs, diffs))[0])
+        return teams_A[best], teams_B[best], float(probs[best])
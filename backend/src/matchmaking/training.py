@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.model_selection import train_test_split
+from xgboost import XGBClassifier
+from core import get_data_path, get_model_path
+from .features import MATCH_FEATURE_COLUMNS
+from .model_artifacts import get_model_schema_path
+from .pipeline import iter_game_chunks
+from .player_store import PlayerStore
+
+MATCH_DATASET_FORMAT_VERSION = 1
+"""Version of the cached match dataset layout, bumped on incompatible changes"""
+
+MANIFEST_FILE = "manifest.json"
+FEATURES_FILE = "features.npy"
+OUTCOMES_FILE = "outcomes.npy"
+
+CLASSIFIER_PARAMS = {
+    "n_estimators": 2000,
+    "learning_rate": 0.1,
+    "max_depth": 6,
+    "tree_method": "hist",
+    "max_bin": 256,
+    "eval_metric": "logloss",
+}
+"""Default XGBoost parameters, `n_estimators` is only the upper bound of the boosting rounds stopped early"""
+
+logger = logging.getLogger()
+
+def extract_matches(games: list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Extract the players and the outcome of the 1v1 games, other games are skipped like in the BuildModel notebook.
+    Args:
+        games: The game records, each with the players grouped in a `teams` list of lists.
+    Returns:
+        The profile IDs of players A (first team) and players B (second team), and the outcomes, 1 if player A won.
+    """
+    matches = [
+        (teams[0][0]["profile_id"], teams[1][0]["profile_id"], teams[0][0].get("result") == "win")
+        for teams in (game["teams"] for game in games)
+        if len(teams) == 2 and len(teams[0]) == 1 and len(teams[1]) == 1
+    ]
+
+    if not matches:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8)
+
+    profile_ids_A, profile_ids_B, outcomes = zip(*matches)
+    return np.array(profile_ids_A, dtype=np.int64), np.array(profile_ids_B, dtype=np.int64), np.array(outcomes, dtype=np.int8)
+
+def build_match_dataset(games_path: str, player_store: PlayerStore, chunk_size: int = 50_000) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Build the classifier training set from the games dump.
+    Only the profile IDs and the outcomes are kept while the games are streamed, then both players of all the games
+    are joined with the players data at once, games with a player missing in the players data are dropped.
+    Args:
+        games_path: The path to the games file, see `iter_game_chunks`.
+        player_store: The loaded players data.
+        chunk_size: The number of games parsed at once.
+    Returns:
+        The float32 match features of shape (N, 28) in `MATCH_FEATURE_COLUMNS` order, the same as served
+        by `Matchmaker._get_match_features`, and the int8 outcomes, 1 if player A won.
+    """
+    chunks: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+    games_count = 0
+
+    for games in iter_game_chunks(games_path, chunk_size):
+        chunks.append(extract_matches(games))
+        games_count += len(games)
+        logger.info(f"Read {games_count} games")
+
+    profile_ids_A, profile_ids_B, outcomes = (np.concatenate(arrays) for arrays in zip(*(chunks or [extract_matches([])])))
+    player_index = pd.Index(player_store.profile_ids)
+    rows_A = player_index.get_indexer(profile_ids_A)
+    rows_B = player_index.get_indexer(profile_ids_B)
+    is_known = (rows_A >= 0) & (rows_B >= 0)
+
+    features = player_store.features
+    X_matches = np.hstack((features[rows_A[is_known]], features[rows_B[is_known]]))
+    logger.info(f"Built {len(X_matches)} matches from {len(outcomes)} 1v1 games, {int((~is_known).sum())} games with unknown players dropped")
+    return X_matches, outcomes[is_known].astype(np.int8)
+
+def load_match_dataset(
+    games_path: str,
+    players_path: str,
+    cache_path: str | None = None,
+    chunk_size: int = 50_000,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Load the classifier training set from its cache, or build and cache it if the games or the players data changed.
+    Args:
+        games_path: The path to the games file.
+        players_path: The path to the players CSV file, its snapshot is used when it is up to date.
+        cache_path: The directory of the cached dataset, not cached if None.
+        chunk_size: The number of games parsed at once.
+    Returns:
+        The match features and the outcomes, see `build_match_dataset`.
+    """
+    sources = {"games": _get_file_signature(games_path), "players": _get_file_signature(players_path)}
+
+    if cache_path is not None:
+        dataset = _read_cached_dataset(cache_path, sources)
+
+        if dataset is not None:
+            logger.info(f"Match dataset of {len(dataset[0])} matches loaded from {cache_path}")
+            return dataset
+
+    player_store = PlayerStore()
+    player_store.load(players_path)
+    X_matches, outcomes = build_match_dataset(games_path, player_store, chunk_size)
+
+    if cache_path is not None:
+        _write_cached_dataset(cache_path, X_matches, outcomes, sources)
+        logger.info(f"Match dataset cached to {cache_path}")
+
+    return X_matches, outcomes
+
+def _get_file_signature(path: str) -> dict:
+    """The size and the modification time of a file, a cached dataset is rebuilt when they change"""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _read_cached_dataset(cache_path: str, sources: dict) -> tuple[np.ndarray, np.ndarray] | None:
+    """Memory-map a cached dataset, or None if it is missing or was built from other sources"""
+    manifest_path = os.path.join(cache_path, MANIFEST_FILE)
+
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest: dict = json.load(f)
+
+    if (
+        manifest.get("version") != MATCH_DATASET_FORMAT_VERSION
+        or manifest.get("feature_columns") != MATCH_FEATURE_COLUMNS
+        or manifest.get("sources") != sources
+    ):
+        return None
+
+    X_matches = np.load(os.path.join(cache_path, FEATURES_FILE), mmap_mode="r")
+    outcomes = np.load(os.path.join(cache_path, OUTCOMES_FILE), mmap_mode="r")
+    return X_matches, outcomes
+
+def _write_cached_dataset(cache_path: str, X_matches: np.ndarray, outcomes: np.ndarray, sources: dict) -> None:
+    """Write the dataset as `.npy` arrays, replacing the previous cache at once"""
+    tmp_path = f"{cache_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, FEATURES_FILE), X_matches)
+    np.save(os.path.join(tmp_path, OUTCOMES_FILE), outcomes)
+
+    manifest = {
+        "version": MATCH_DATASET_FORMAT_VERSION,
+        "rows": len(X_matches),
+        "feature_columns": MATCH_FEATURE_COLUMNS,
+        "sources": sources,
+    }
+
+    # Write the manifest last, so a cache without it is never picked up
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(tmp_path, cache_path)
+
+def train_classifier(
+    X_matches: np.ndarray,
+    outcomes: np.ndarray,
+    params: dict | None = None,
+    test_size: float = 0.2,
+    validation_size: float = 0.1,
+    early_stopping_rounds: int = 50,
+    n_jobs: int = -1,
+    random_state: int = 42,
+) -> tuple[XGBClassifier, dict]:
+    """
+    Train the match outcome classifier with the multi-threaded `hist` tree method.
+    The matches are split into train, validation and test sets stratified by the outcome,
+    boosting stops once the validation log loss has not improved for `early_stopping_rounds` rounds.
+    Args:
+        X_matches: The match features, see `build_match_dataset`.
+        outcomes: The outcomes, 1 if player A won.
+        params: The XGBoost parameters overriding `CLASSIFIER_PARAMS`.
+        test_size: The fraction of the matches held out to evaluate the classifier.
+        validation_size: The fraction of the remaining matches used for early stopping.
+        early_stopping_rounds: The number of rounds without improvement before boosting stops.
+        n_jobs: The number of training threads, all the cores if -1.
+        random_state: The seed of the splits and the training.
+    Returns:
+        The trained classifier and its metrics on the test set.
+    Raises:
+        ValueError: If there are no matches to train on.
+    """
+    if len(X_matches) == 0:
+        raise ValueError("The match dataset is empty, no 1v1 game has both players in the players data")
+
+    X_train, X_test, y_train, y_test = train_test_split(X_matches, outcomes, test_size=test_size, random_state=random_state, stratify=outcomes)
+    X_train, X_valid, y_train, y_valid = train_test_split(X_train, y_train, test_size=validation_size, random_state=random_state, stratify=y_train)
+
+    classifier_model = XGBClassifier(
+        **{**CLASSIFIER_PARAMS, **(params or {})},
+        early_stopping_rounds=early_stopping_rounds,
+        n_jobs=n_jobs,
+        random_state=random_state,
+    )
+
+    started_at = time.perf_counter()
+    classifier_model.fit(X_train, y_train, eval_set=[(X_valid, y_valid)], verbose=False)
+    training_seconds = time.perf_counter() - started_at
+
+    y_pred_proba = classifier_model.predict_proba(X_test)[:, 1]
+    metrics = {
+        "accuracy": float(accuracy_score(y_test, y_pred_proba >= 0.5)),
+        "auc": float(roc_auc_score(y_test, y_pred_proba)),
+        "log_loss": float(log_loss(y_test, y_pred_proba)),
+        "best_iteration": int(classifier_model.best_iteration),
+        "train_rows": len(X_train),
+        "validation_rows": len(X_valid),
+        "test_rows": len(X_test),
+        "training_seconds": round(training_seconds, 3),
+    }
+    return classifier_model, metrics
+
+def save_classifier(classifier_model: XGBClassifier, metrics: dict, output_dir: str, version: str, install: bool = False) -> str:
+    """
+    Write the classifier as `classifier_model.<version>.xgb` with its feature schema `classifier_model.<version>.schema.json`.
+    Args:
+        classifier_model: The trained classifier.
+        metrics: The metrics of the classifier, kept in the schema.
+        output_dir: The directory to write the files to.
+        version: The version of the classifier.
+        install: Also replace `classifier_model.xgb` and its schema, the files served by the API after a reload.
+    Returns:
+        The path to the versioned classifier file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, f"classifier_model.{version}.xgb")
+    schema = {
+        "version": version,
+        "features": MATCH_FEATURE_COLUMNS,
+        # NaN (the default `missing`) is left out, it is not valid JSON
+        "params": {name: value for name, value in classifier_model.get_params().items() if value is not None and value == value},
+        "metrics": metrics,
+    }
+
+    joblib.dump(classifier_model, model_path)
+
+    with open(get_model_schema_path(model_path), "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+
+    if install:
+        # Copy next to the served files first and move them in, so a reload never reads a partial file
+        served_path = os.path.join(output_dir, "classifier_model.xgb")
+
+        for source_path, target_path in ((model_path, served_path), (get_model_schema_path(model_path), get_model_schema_path(served_path))):
+            shutil.copyfile(source_path, f"{target_path}.tmp")
+            os.replace(f"{target_path}.tmp", target_path)
+
+    return model_path
+
+def run_training(
+    games_path: str,
+    players_path: str,
+    output_dir: str,
+    cache_path: str | None = None,
+    chunk_size: int = 50_000,
+    params: dict | None = None,
+    early_stopping_rounds: int = 50,
+    n_jobs: int = -1,
+    random_state: int = 42,
+    install: bool = False,
+) -> str:
+    """
+    Build the match dataset and train a new version of the classifier, see `load_match_dataset`,
+    `train_classifier` and `save_classifier` for the arguments.
+    Returns:
+        The path to the versioned classifier file.
+    """
+    X_matches, outcomes = load_match_dataset(games_path, players_path, cache_path, chunk_size)
+    classifier_model, metrics = train_classifier(
+        X_matches,
+        outcomes,
+        params,
+        early_stopping_rounds=early_stopping_rounds,
+        n_jobs=n_jobs,
+        random_state=random_state,
+    )
+    logger.info(f"Classifier trained in {metrics["training_seconds"]}s, {metrics["best_iteration"] + 1} rounds, accuracy {metrics["accuracy"]:.4f}, AUC {metrics["auc"]:.4f}")
+
+    version = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+    model_path = save_classifier(classifier_model, metrics, output_dir, version, install)
+    logger.info(f"Classifier version {version} written to {model_path}")
+    return model_path
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train classifier_model.xgb from the games dump and the clustered players data.")
+    parser.add_argument("--games", default=get_data_path("games_rm_1v1_s8.json"), help="Path to the games JSON (array or lines) file, optionally gzip-compressed")
+    parser.add_argument("--players", default=get_model_path("clustered_players.csv"), help="Path to the players CSV file")
+    parser.add_argument("--output-dir", default=get_model_path(""), help="Directory to write the versioned classifier to")
+    parser.add_argument("--cache", default=get_data_path("match_dataset.cache"), help="Directory of the cached match dataset")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the cached match dataset")
+    parser.add_argument("--install", action="store_true", help="Also replace classifier_model.xgb served by the API")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="Number of games parsed at once")
+    parser.add_argument("--max-rounds", type=int, default=CLASSIFIER_PARAMS["n_estimators"], help="Maximum number of boosting rounds")
+    parser.add_argument("--learning-rate", type=float, default=CLASSIFIER_PARAMS["learning_rate"], help="Boosting learning rate")
+    parser.add_argument("--max-depth", type=int, default=CLASSIFIER_PARAMS["max_depth"], help="Maximum depth of the trees")
+    parser.add_argument("--early-stopping", type=int, default=50, help="Rounds without validation improvement before boosting stops")
+    parser.add_argument("--threads", type=int, default=-1, help="Number of training threads, all the cores by default")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the splits and the training")
+    args = parser.parse_args()
+
+    run_training(
+        args.games,
+        args.players,
+        args.output_dir,
+        cache_path=None if args.no_cache else args.cache,
+        chunk_size=args.chunk_size,
+        params={"n_estimators": args.max_rounds, "learning_rate": args.learning_rate, "max_depth": args.max_depth},
+        early_stopping_rounds=args.early_stopping,
+        n_jobs=args.threads,
+        random_state=args.seed,
+        install=args.install,
+    )
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:    %(message)s")
+    main()
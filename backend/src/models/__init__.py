@@ -1,4 +1,11 @@
 from .player_id import *
 from .player import *
 from .predict_match_outcome import *
+from .predict_match_outcome_batch import *
 from .pair_players import *
+from .team_match import *
+from .matchmaking_notification import *
+from .prediction_cache_stats import *
+from .finished_game import *
+from .new_player import *
+from .model_info import *
@@ -0,0 +1,29 @@
+from core import PydanticBaseModel
+
+class FinishedGamePlayerDto(PydanticBaseModel):
+    profile_id: int
+    result: str | None = None
+    """Result of the game for the player: `win` or `loss`"""
+
+    rating: float | None = None
+    """ELO rating of the player before the game"""
+
+    rating_diff: float | None = None
+    """Change of the player's ELO rating after the game"""
+
+    mmr: float | None = None
+    mmr_diff: float | None = None
+    civilization: str | None = None
+    input_type: str | None = None
+
+
+class FinishedGameDto(PydanticBaseModel):
+    game_id: int
+    finished_at: str | None = None
+    duration: float | None = None
+    teams: list[list[FinishedGamePlayerDto]]
+    """Players grouped by team, a 1v1 game has two teams of one player"""
+
+
+class FinishedGamesDto(PydanticBaseModel):
+    games: list[FinishedGameDto]
@@ -0,0 +1,13 @@
+from core import PydanticBaseModel
+from .pair_players import PairPlayersDto
+
+class QueueStatusDto(PydanticBaseModel):
+    position: int
+    queue_length: int
+    wait_seconds: float
+    estimated_wait_seconds: float | None = None
+
+class MatchmakingNotificationDto(PydanticBaseModel):
+    type: str
+    queue_status: QueueStatusDto | None = None
+    match: PairPlayersDto | None = None
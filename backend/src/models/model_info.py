@@ -0,0 +1,14 @@
+from core import PydanticBaseModel
+
+class ModelInfoDto(PydanticBaseModel):
+    version: int
+    """Number of the loaded models version, incremented by every hot reload"""
+
+    loaded_at: float
+    """Unix timestamp when the version was loaded"""
+
+    model_version: str | None = None
+    """Version of the classifier written by the training CLI, None for a classifier trained in the notebook"""
+
+    inference_backend: str
+    players_count: int
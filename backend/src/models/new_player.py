@@ -0,0 +1,23 @@
+from core import PydanticBaseModel
+
+class NewPlayerDto(PydanticBaseModel):
+    profile_id: int
+    name: str
+    rating: float
+    """ELO rating of the player, newcomers start at the initial rating of the ladder"""
+
+    rank: int = 0
+    games_count: int = 0
+    wins_count: int = 0
+    last_game_at: str = ""
+    country: str = "unknown"
+    avg_mmr: float | None = None
+    avg_opp_mmr: float | None = None
+    avg_game_length: float | None = None
+    common_civ: str | None = None
+    input_type: str | None = None
+    """Input type used by the player: `keyboard` or `controller`"""
+
+
+class NewPlayersDto(PydanticBaseModel):
+    players: list[NewPlayerDto]
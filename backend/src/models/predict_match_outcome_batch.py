@@ -0,0 +1,16 @@
+from typing import Literal
+from core import PydanticBaseModel
+from .predict_match_outcome import PredictMatchOutcomeDto
+
+class PredictMatchOutcomeBatchDto(PydanticBaseModel):
+    pairs: list[PredictMatchOutcomeDto] = []
+    """Pairs of players to score"""
+
+    players_1: list[int] = []
+    """Players scored against every player in `players_2` when no `pairs` are given"""
+
+    players_2: list[int] = []
+    """Opponents of every player in `players_1` when no `pairs` are given"""
+
+    format: Literal["ndjson", "binary"] = "ndjson"
+    """Response format: one JSON object per pair, or little-endian float32 probabilities in request order"""
@@ -0,0 +1,8 @@
+from core import PydanticBaseModel
+
+class PredictionCacheStatsDto(PydanticBaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    size: int
+    max_size: int
@@ -0,0 +1,7 @@
+from core import PydanticBaseModel
+from .player import PlayerDto
+
+class TeamMatchDto(PydanticBaseModel):
+    team_1: list[PlayerDto]
+    team_2: list[PlayerDto]
+    team_1_win_prob: float
@@ -1,3 +1,3 @@
 from .api import api_router
-from .matchmaking_router import matchmaking_router
+from .matchmaking_router import matchmaking_router, matchmaking_lifespan
 from .players_router import players_router
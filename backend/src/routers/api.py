@@ -1,7 +1,16 @@
 from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core import metrics_registry
 from .matchmaking_router import matchmaking_router
 from .players_router import players_router
 
 api_router = APIRouter(prefix="/api")
 api_router.include_router(matchmaking_router)
 api_router.include_router(players_router)
+
+@api_router.get("/metrics", response_class=PlainTextResponse, tags=["metrics"])
+def get_metrics() -> str:
+    """
+    Get the application metrics in the Prometheus text format.
+    """
+    return metrics_registry.render()
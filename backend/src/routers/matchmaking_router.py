@@ -1,53 +1,315 @@
-
-from fastapi import APIRouter
+import asyncio
+import json
+from collections.abc import Iterator
+from contextlib import asynccontextmanager, suppress
+import anyio
+import numpy as np
+from fastapi import APIRouter, FastAPI, WebSocket
+from fastapi.responses import StreamingResponse
+from core import RawJSONResponse, encode_result_json, metrics_registry, settings
 from core.result import Result, ResultWithData
-from matchmaking import Matchmaker
-from models import PlayerIdDto, PredictMatchOutcomeDto, PairPlayersDto
+from matchmaking import TEAM_SIZES, BatchMatchmaker, GameFileWatcher, Matchmaker, MatchmakingService, MatchNotifier, ModelArtifacts, Notification, NotificationType, PlayerStore, TeamMatchmaker
+from models import FinishedGamesDto, MatchmakingNotificationDto, ModelInfoDto, NewPlayersDto, PlayerIdDto, PredictMatchOutcomeDto, PredictMatchOutcomeBatchDto, PairPlayersDto, PredictionCacheStatsDto, QueueStatusDto, TeamMatchDto
 from models.player import PlayerDto
+from services import get_player_json_cache
 
 matchmaking_router = APIRouter(prefix="/matchmaking", tags=["matchmaking"])
 router = matchmaking_router
 
 matchmaker = Matchmaker()
 matchmaker.load_models()
+batch_matchmaker = BatchMatchmaker(matchmaker)
+team_matchmakers = {team_size: TeamMatchmaker(matchmaker, team_size) for team_size in TEAM_SIZES}
+matchmaking_service = MatchmakingService(matchmaker, team_matchmakers)
+match_notifier = MatchNotifier(matchmaker, settings.notify_interval)
+matchmaking_service.subscribe_matches(match_notifier.publish_match)
+player_json_cache = get_player_json_cache()
+
+metrics_registry.gauge("matchmaking_queue_depth", "Players waiting in the queue", matchmaker.queue_length)
+metrics_registry.gauge("matchmaking_queue_max_wait_seconds", "Seconds the longest waiting player has been in the queue", matchmaker.players_queue.max_wait_time)
+metrics_registry.gauge("matchmaking_prediction_cache_size", "Pairs held by the prediction cache", lambda: len(matchmaker.prediction_cache))
+metrics_registry.gauge("matchmaking_prediction_cache_hits", "Predictions served from the cache", lambda: matchmaker.prediction_cache.hits)
+metrics_registry.gauge("matchmaking_prediction_cache_misses", "Predictions missing in the cache", lambda: matchmaker.prediction_cache.misses)
+metrics_registry.gauge("matchmaking_notification_subscriptions", "Open match notification connections", match_notifier.subscriptions_count)
+metrics_registry.gauge("matchmaking_model_version", "Version of the served classifier and players data", lambda: matchmaker.artifacts.version)
+
+PREDICT_BATCH_CHUNK_SIZE = 65_536
+"""Number of pairs scored by one model call while streaming a batch prediction"""
+
+@asynccontextmanager
+async def matchmaking_lifespan(app: FastAPI):
+    """
+    Run the matchmaking service, the match notifications, the background batch matchmaking and the finished games watcher
+    (if enabled in the settings) while the application is running.
+    """
+    await matchmaking_service.start()
+    tasks: list[asyncio.Task] = [asyncio.create_task(match_notifier.run())]
+
+    if settings.batch_enabled:
+        tasks.append(asyncio.create_task(batch_matchmaker.run(settings.batch_interval)))
+
+    if settings.games_watch_dir:
+        game_file_watcher = GameFileWatcher(matchmaking_service, settings.games_watch_dir)
+        tasks.append(asyncio.create_task(game_file_watcher.run(settings.games_watch_interval)))
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+
+        with suppress(asyncio.CancelledError):
+            await task
+
+    await matchmaking_service.stop()
+
+    if matchmaker.queue_journal is not None:
+        matchmaker.queue_journal.flush()
     
 @router.post("/queue")
-def add_player_to_queue(payload: PlayerIdDto) -> Result:
+async def add_player_to_queue(payload: PlayerIdDto) -> Result:
     """
     Add a player to the matchmaking queue.
     """
-    success = matchmaker.add_player_to_queue(payload.player_id)
+    success = await matchmaking_service.add_player_to_queue(payload.player_id)
     return Result.succeed() if success else Result.fail("Player not found")
 
 @router.post("/queue/remove")
-def remove_player_from_queue(payload: PlayerIdDto) -> Result:
+async def remove_player_from_queue(payload: PlayerIdDto) -> Result:
     """
     Remove a player from the matchmaking queue.
     """
-    success = matchmaker.remove_player_from_queue(payload.player_id)
+    success = await matchmaking_service.remove_player_from_queue(payload.player_id)
     return Result.succeed() if success else Result.fail("Player not found")
 
+@router.post("/teams/{team_size}/queue")
+async def add_player_to_team_queue(team_size: int, payload: PlayerIdDto) -> Result:
+    """
+    Add a player to the queue of a team ladder, `team_size` is 2, 3 or 4.
+    """
+    if team_size not in team_matchmakers:
+        return Result.fail(f"Unsupported team size {team_size}")
+
+    success = await matchmaking_service.add_player_to_team_queue(team_size, payload.player_id)
+    return Result.succeed() if success else Result.fail("Player not found")
+
+@router.post("/teams/{team_size}/queue/remove")
+async def remove_player_from_team_queue(team_size: int, payload: PlayerIdDto) -> Result:
+    """
+    Remove a player from the queue of a team ladder.
+    """
+    if team_size not in team_matchmakers:
+        return Result.fail(f"Unsupported team size {team_size}")
+
+    success = await matchmaking_service.remove_player_from_team_queue(team_size, payload.player_id)
+    return Result.succeed() if success else Result.fail("Player not found")
+
+@router.post("/teams/{team_size}/pair")
+async def find_team_match(team_size: int, payload: PlayerIdDto) -> ResultWithData[TeamMatchDto]:
+    """
+    Form a balanced team match around a player from the queue of a team ladder.
+    The player is in team 1, the other players are removed from the queue.
+    """
+    if team_size not in team_matchmakers:
+        return ResultWithData.fail(f"Unsupported team size {team_size}")
+
+    try:
+        match = await matchmaking_service.find_team_match(team_size, payload.player_id)
+    except ValueError as e:
+        return ResultWithData.fail(str(e))
+
+    if match is None:
+        return ResultWithData.fail("No team match found")
+
+    return ResultWithData.succeed(TeamMatchDto(
+        team_1=[PlayerDto.from_dict(player) for player in match["team_1"]],
+        team_2=[PlayerDto.from_dict(player) for player in match["team_2"]],
+        team_1_win_prob=match["team_1_win_prob"],
+    ))
+
 @router.post("/predict")
-def predict_match_outcome(payload: PredictMatchOutcomeDto) -> ResultWithData[float]:
+async def predict_match_outcome(payload: PredictMatchOutcomeDto) -> ResultWithData[float]:
     """
     Predict the outcome of a match between two players. 
     Return the probability that player 1 wins against player 2.
     """
     try:
-        probability = matchmaker.predict_match_outcome(payload.player_1, payload.player_2)
+        probability = await matchmaking_service.predict_match_outcome(payload.player_1, payload.player_2)
         return ResultWithData.succeed(probability)
     except ValueError as e:
         return ResultWithData.fail(str(e))
 
-@router.post("/pair")
-def find_match(payload: PlayerIdDto) -> ResultWithData[PairPlayersDto]:
+@router.post("/predict/batch", response_model=None)
+def predict_match_outcomes_batch(payload: PredictMatchOutcomeBatchDto) -> StreamingResponse | Result:
+    """
+    Predict the outcomes of many matches at once.
+    Either explicit `pairs` are scored, or every player in `players1` against every player in `players2`.
+    The probabilities that the first player of each pair wins are streamed back in request order,
+    as NDJSON lines or as a little-endian float32 array.
+    """
+    # The whole stream is scored by the version it started with, even if a hot reload happens meanwhile
+    artifacts = matchmaker.artifacts
+    store = artifacts.player_store
+
+    if payload.pairs:
+        rows_A, missing_A = _get_player_rows(store, [pair.player_1 for pair in payload.pairs])
+        rows_B, missing_B = _get_player_rows(store, [pair.player_2 for pair in payload.pairs])
+        pairs_count = len(payload.pairs)
+    else:
+        rows_A, missing_A = _get_player_rows(store, payload.players_1)
+        rows_B, missing_B = _get_player_rows(store, payload.players_2)
+        pairs_count = len(payload.players_1) * len(payload.players_2)
+
+    if pairs_count == 0:
+        return Result.fail("No pairs to predict")
+
+    if pairs_count > settings.predict_batch_max_pairs:
+        return Result.fail(f"Too many pairs: {pairs_count}, the limit is {settings.predict_batch_max_pairs}")
+
+    if missing_A is not None or missing_B is not None:
+        return Result.fail(f"Player {missing_A if missing_A is not None else missing_B} not found")
+
+    if not payload.pairs:
+        rows_A, rows_B = np.repeat(rows_A, len(rows_B)), np.tile(rows_B, len(rows_A))
+
+    if payload.format == "binary":
+        return StreamingResponse(
+            _iter_match_outcomes_binary(rows_A, rows_B, artifacts),
+            media_type="application/octet-stream",
+            headers={"X-Pairs-Count": str(pairs_count)},
+        )
+
+    return StreamingResponse(_iter_match_outcomes_ndjson(rows_A, rows_B, artifacts), media_type="application/x-ndjson")
+
+def _get_player_rows(store: PlayerStore, player_ids: list[int]) -> tuple[np.ndarray, int | None]:
+    """
+    Get the player store rows of the players.
+    Returns:
+        The rows, and the first unknown profile ID or None if all the players exist.
+    """
+    rows = store.get_rows(player_ids)
+
+    if len(rows) == len(player_ids):
+        return rows, None
+
+    return rows, next(pid for pid in player_ids if not store.contains(pid))
+
+def _iter_match_outcomes_binary(rows_A: np.ndarray, rows_B: np.ndarray, artifacts: ModelArtifacts) -> Iterator[bytes]:
+    for start in range(0, len(rows_A), PREDICT_BATCH_CHUNK_SIZE):
+        end = start + PREDICT_BATCH_CHUNK_SIZE
+        probs = matchmaker.predict_match_outcomes_by_rows(rows_A[start:end], rows_B[start:end], artifacts)
+        yield probs.astype("<f4").tobytes()
+
+def _iter_match_outcomes_ndjson(rows_A: np.ndarray, rows_B: np.ndarray, artifacts: ModelArtifacts) -> Iterator[str]:
+    profile_ids = artifacts.player_store.profile_ids
+
+    for start in range(0, len(rows_A), PREDICT_BATCH_CHUNK_SIZE):
+        end = start + PREDICT_BATCH_CHUNK_SIZE
+        probs = matchmaker.predict_match_outcomes_by_rows(rows_A[start:end], rows_B[start:end], artifacts)
+        yield "".join(
+            f'{{"player1":{player_1},"player2":{player_2},"player1WinProb":{prob}}}\n'
+            for player_1, player_2, prob in zip(profile_ids[rows_A[start:end]].tolist(), profile_ids[rows_B[start:end]].tolist(), probs.tolist())
+        )
+
+@router.post("/pair", response_model=ResultWithData[PairPlayersDto])
+async def find_match(payload: PlayerIdDto) -> RawJSONResponse | ResultWithData[PairPlayersDto]:
     """
     Pair a player with an opponent and form a match. 
     Return the opponent's data.
     """
-    match_data = matchmaker.find_match_for_player(payload.player_id)
+    try:
+        match_data = await matchmaking_service.find_match_for_player(payload.player_id)
+    except ValueError as e:
+        return ResultWithData.fail(str(e))
     
     if match_data:
+        return _map_match_to_response(match_data)
+
+    return ResultWithData.fail("No match found")
+
+@router.websocket("/ws/{player_id}")
+async def match_notifications(websocket: WebSocket, player_id: int) -> None:
+    """
+    Push the queue status of a queued player and then the formed match, instead of the player polling.
+    The server closes the connection once the player leaves the queue.
+    """
+    await websocket.accept()
+    subscription = match_notifier.subscribe(player_id)
+    is_final_sent = False
+
+    async def send_notifications() -> None:
+        nonlocal is_final_sent
+
+        while not is_final_sent:
+            notification = await subscription.get()
+            await websocket.send_text(_map_notification_to_json(notification))
+            is_final_sent = notification.is_final
+
+            if notification.type == NotificationType.MATCH:
+                await match_notifier.acknowledge_match(player_id, notification.payload)
+
+        task_group.cancel_scope.cancel()
+
+    async def wait_for_disconnect() -> None:
+        # Receiving is the only way to notice that the client went away while no notification is pushed
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+        task_group.cancel_scope.cancel()
+
+    try:
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(send_notifications)
+            task_group.start_soon(wait_for_disconnect)
+    finally:
+        match_notifier.unsubscribe(subscription)
+
+    if is_final_sent:
+        await websocket.close()
+
+def _map_notification_to_json(notification: Notification) -> str:
+    dto = MatchmakingNotificationDto(type=notification.type.value)
+
+    match notification.type:
+        case NotificationType.STATUS:
+            status = notification.payload
+            dto.queue_status = QueueStatusDto(
+                position=status.position,
+                queue_length=status.queue_length,
+                wait_seconds=status.wait_seconds,
+                estimated_wait_seconds=status.estimated_wait_seconds,
+            )
+        case NotificationType.MATCH:
+            match_data = notification.payload
+            dto.match = PairPlayersDto(
+                player_1=PlayerDto.from_dict(match_data["player_1"]),
+                player_2=PlayerDto.from_dict(match_data["player_2"]),
+                player_1_win_prob=match_data["player_1_win_prob"],
+            )
+
+    return dto.model_dump_json(by_alias=True, exclude_none=True)
+
+@router.get("/match/{player_id}", response_model=ResultWithData[PairPlayersDto])
+def get_match(player_id: int) -> RawJSONResponse | ResultWithData[PairPlayersDto]:
+    """
+    Poll the match formed for a player by the background batch matchmaking.
+    A formed match is returned only once, and not after it was pushed over the notifications WebSocket.
+    """
+    match_data = batch_matchmaker.pop_match(player_id)
+
+    if match_data is None:
+        return ResultWithData.fail("No match found yet")
+
+    return _map_match_to_response(match_data)
+
+def _map_match_to_response(match_data: dict) -> RawJSONResponse | ResultWithData[PairPlayersDto]:
+    """
+    Serialize a formed match with the players JSON taken from the players JSON cache.
+    The DTOs are built instead if a player is missing in the current players data, e.g. after a hot reload.
+    """
+    profile_ids = [int(match_data["player_1"]["profile_id"]), int(match_data["player_2"]["profile_id"])]
+    players_json = player_json_cache.encode_players(profile_ids)
+
+    if players_json is None:
         dto = PairPlayersDto(
             player_1=PlayerDto.from_dict(match_data["player_1"]),
             player_2=PlayerDto.from_dict(match_data["player_2"]),
@@ -55,4 +317,70 @@ def find_match(payload: PlayerIdDto) -> ResultWithData[PairPlayersDto]:
         )
         return ResultWithData.succeed(dto)
 
-    return ResultWithData.fail("No match found")
+    fields = PairPlayersDto.model_fields
+    pair_json = (
+        '{"' + fields["player_1"].alias + '":' + players_json[0]
+        + ',"' + fields["player_2"].alias + '":' + players_json[1]
+        + ',"' + fields["player_1_win_prob"].alias + '":' + json.dumps(float(match_data["player_1_win_prob"])) + "}"
+    )
+    return RawJSONResponse(encode_result_json(ResultWithData.succeed(None), pair_json))
+
+@router.post("/games")
+async def apply_finished_games(payload: FinishedGamesDto) -> ResultWithData[int]:
+    """
+    Update the stats of the players of finished 1v1 games.
+    Return the number of updated players.
+    """
+    games = [game.model_dump() for game in payload.games]
+    updated_ids = await matchmaking_service.apply_games(games)
+    return ResultWithData.succeed(len(set(updated_ids)))
+
+@router.post("/players")
+async def register_players(payload: NewPlayersDto) -> ResultWithData[int]:
+    """
+    Add players missing in the players data, e.g. newcomers, with a cluster assigned by the cluster model,
+    so they can join the queue right away. Players that already exist are skipped.
+    Return the number of added players.
+    """
+    players = [player.model_dump() for player in payload.players]
+    added_ids = await matchmaking_service.register_players(players)
+    return ResultWithData.succeed(len(added_ids))
+
+@router.get("/cache/stats")
+def get_prediction_cache_stats() -> ResultWithData[PredictionCacheStatsDto]:
+    """
+    Get the hit/miss counters of the match outcome prediction cache.
+    """
+    stats = matchmaker.prediction_cache.stats()
+    return ResultWithData.succeed(PredictionCacheStatsDto(**stats))
+
+@router.get("/models")
+def get_models_info() -> ResultWithData[ModelInfoDto]:
+    """
+    Get the version of the served classifier and players data.
+    """
+    return ResultWithData.succeed(_map_artifacts_to_dto(matchmaker.artifacts))
+
+@router.post("/models/reload")
+async def reload_models() -> ResultWithData[ModelInfoDto]:
+    """
+    Hot reload `classifier_model.xgb` and the players data from the models directory.
+    The new version is validated before it replaces the current one, the queue is kept
+    and the requests being served finish on the previous version.
+    Return the new version, or the reason it was rejected while the previous version keeps serving.
+    """
+    try:
+        artifacts = await matchmaking_service.reload_models()
+    except (ValueError, OSError) as e:
+        return ResultWithData.fail(f"Models reload failed: {e}")
+
+    return ResultWithData.succeed(_map_artifacts_to_dto(artifacts))
+
+def _map_artifacts_to_dto(artifacts: ModelArtifacts) -> ModelInfoDto:
+    return ModelInfoDto(
+        version=artifacts.version,
+        loaded_at=artifacts.loaded_at,
+        model_version=artifacts.model_version,
+        inference_backend=artifacts.inference_backend.name,
+        players_count=len(artifacts.player_store)
+    )
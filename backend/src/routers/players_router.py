@@ -1,7 +1,7 @@
 
 from typing import Annotated
 from fastapi import APIRouter, Depends
-from core import PagedQuery, PagedResult, ResultWithData
+from core import PagedQuery, PagedResult, RawJSONResponse, ResultWithData, encode_result_json
 from models import PlayerDto
 from services import PlayerService
 
@@ -10,22 +10,21 @@ router = players_router
 
 player_service = PlayerService()
     
-@router.get("/{player_id}")
-def get_player_by_id(player_id: int) -> ResultWithData[PlayerDto]:
+@router.get("/{player_id}", response_model=ResultWithData[PlayerDto])
+def get_player_by_id(player_id: int) -> RawJSONResponse:
     """
     Get a player by ID.
     """
-    player = player_service.get_player(player_id)
+    player_json = player_service.get_player_json(player_id)
 
-    if player is None:
-        return ResultWithData.fail("Player not found")
+    if player_json is None:
+        return RawJSONResponse(encode_result_json(ResultWithData.fail("Player not found")))
     
-    return ResultWithData.succeed(player)
+    return RawJSONResponse(encode_result_json(ResultWithData.succeed(None), player_json))
 
-@router.get("/")
-def get_players_paged(paged_query: Annotated[PagedQuery, Depends()]) -> PagedResult[PlayerDto]:
+@router.get("/", response_model=PagedResult[PlayerDto])
+def get_players_paged(paged_query: Annotated[PagedQuery, Depends()]) -> RawJSONResponse:
     """
     Get a list of players with pagination.
     """
-    paged_result = player_service.get_players(paged_query)
-    return paged_result
+    return RawJSONResponse(player_service.get_players_json(paged_query))
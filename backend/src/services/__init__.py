@@ -1 +1,3 @@
+from .player_query_index import *
+from .player_json_cache import *
 from .player_service import *
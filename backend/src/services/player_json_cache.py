@@ -0,0 +1,130 @@
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+import numpy as np
+import pandas as pd
+from matchmaking import PlayerStore, get_player_store
+from models import PlayerDto
+
+def _to_ints(values: np.ndarray) -> list:
+    return values.astype(np.int64).tolist()
+
+def _to_floats(values: np.ndarray) -> list:
+    values = values.astype(np.float64)
+    floats = values.tolist()
+
+    # NaN and infinity are serialized as null like pydantic does
+    for i in np.flatnonzero(~np.isfinite(values)).tolist():
+        floats[i] = None
+
+    return floats
+
+def _to_strings(values: np.ndarray) -> list:
+    return [value if isinstance(value, str) else None if pd.isna(value) else str(value) for value in values.tolist()]
+
+_CONVERTERS: dict[type, Callable[[np.ndarray], list]] = {int: _to_ints, float: _to_floats, str: _to_strings}
+
+PLAYER_JSON_FIELDS = [(name, field.alias or name, _CONVERTERS[field.annotation]) for name, field in PlayerDto.model_fields.items()]
+"""The `PlayerDto` fields: column name, JSON key and the function converting a column to JSON values"""
+
+class PlayerJsonCache:
+    """
+    Bounded LRU cache of the players encoded as `PlayerDto` JSON objects, keyed by the player store row.
+    Missing players are encoded column by column straight from the players data, without building DTOs,
+    and an entry is stale once the player store updated its row after the entry was encoded.
+    The cache follows the shared player store across hot reloads unless it was given a store.
+    """
+    max_size: int
+    """Maximum number of cached players"""
+
+    def __init__(self, player_store: PlayerStore | None = None, max_size: int = 200_000) -> None:
+        """
+        Args:
+            player_store: The players data store. Defaults to the current store shared by the whole process.
+            max_size: The maximum number of cached players.
+        """
+        self.max_size = max_size
+        self._player_store = player_store
+        self._players_df: pd.DataFrame | None = None
+        self._entries: OrderedDict[int, tuple[int, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def player_store(self) -> PlayerStore:
+        """The players data store, the current shared store unless a store was given."""
+        return self._player_store if self._player_store is not None else get_player_store()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def encode_rows(self, rows: np.ndarray, player_store: PlayerStore | None = None) -> list[str]:
+        """
+        Get the JSON objects of players.
+        Args:
+            rows: The row indices of the players in the player store.
+            player_store: The store the rows come from, the cache's store by default.
+        Returns:
+            The JSON objects of the players, in the order of the rows.
+        """
+        store = player_store if player_store is not None else self.player_store
+        # Read before encoding, so an update racing with the encoding leaves the entry stale
+        version = store.version
+
+        with self._lock:
+            if self._players_df is not store.players_df:
+                self._players_df = store.players_df
+                self._entries.clear()
+
+            entries = self._entries
+            row_versions = store.row_versions
+            encoded: list[str | None] = [None] * len(rows)
+            missing: list[int] = []
+
+            for i, row in enumerate(rows.tolist()):
+                entry = entries.get(row)
+
+                if entry is not None and entry[0] >= row_versions[row]:
+                    encoded[i] = entry[1]
+                    entries.move_to_end(row)
+                else:
+                    missing.append(i)
+
+            if missing:
+                missing_rows = rows[missing]
+
+                for i, row, player_json in zip(missing, missing_rows.tolist(), self._encode(store.players_df, missing_rows)):
+                    encoded[i] = player_json
+                    entries[row] = (version, player_json)
+
+                while len(entries) > self.max_size:
+                    entries.popitem(last=False)
+
+        return encoded
+
+    def encode_players(self, profile_ids: list[int]) -> list[str] | None:
+        """
+        Get the JSON objects of players by their profile IDs.
+        Returns:
+            The JSON objects of the players in the given order, or None if a player does not exist.
+        """
+        player_store = self.player_store
+        rows = player_store.get_rows(profile_ids)
+        return self.encode_rows(rows, player_store) if len(rows) == len(profile_ids) else None
+
+    def _encode(self, players_df: pd.DataFrame, rows: np.ndarray) -> list[str]:
+        """Encode the players column by column, each column is gathered and converted once for all the rows"""
+        keys = [key for _, key, _ in PLAYER_JSON_FIELDS]
+        players = players_df.iloc[rows]
+        columns = [convert(players[name].to_numpy()) for name, _, convert in PLAYER_JSON_FIELDS]
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        return [encoder.encode(dict(zip(keys, values))) for values in zip(*columns)]
+
+
+_shared_player_json_cache = PlayerJsonCache()
+
+def get_player_json_cache() -> PlayerJsonCache:
+    """
+    Get the cache of the encoded players of the shared player store, used by all the endpoints returning players.
+    """
+    return _shared_player_json_cache
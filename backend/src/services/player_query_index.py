@@ -0,0 +1,126 @@
+from collections.abc import Iterable
+import numpy as np
+import pandas as pd
+from models import PlayerDto
+
+SORTABLE_COLUMNS = list(PlayerDto.model_fields)
+"""Columns of the players data that can be used to order the players"""
+
+class PlayerQueryIndex:
+    """
+    Query index over the players data for paged requests.
+    Keeps the sort permutations of the sortable columns (computed on first use)
+    and a trigram index of the lowercase player names, so that a page of an unfiltered query
+    costs O(page_size) and a filtered query avoids scanning the names.
+    """
+    players_df: pd.DataFrame
+    """The indexed players data"""
+
+    def __init__(self, players_df: pd.DataFrame) -> None:
+        self.players_df = players_df
+        self._names = players_df["name"].fillna("").astype(str).str.lower().to_numpy(dtype=object)
+        self._sort_orders: dict[tuple[str, bool], np.ndarray] = {}
+        self._trigrams: dict[str, np.ndarray] | None = None
+
+    def query(self, filter: str | None, order_by: str | None, start: int, end: int) -> tuple[np.ndarray, int]:
+        """
+        Find the rows of a page of players.
+        Args:
+            filter: The term the player names must contain, case-insensitive.
+            order_by: The column to order by, prefixed with `-` for descending order.
+            start: The position of the first player of the page, negative positions are clamped to 0.
+            end: The position after the last player of the page, negative positions are clamped to 0.
+        Returns:
+            The row positions of the page's players and the total number of players matching the filter.
+        Raises:
+            ValueError: If the players cannot be ordered by the given column.
+        """
+        # Negative positions would wrap to the end of the table, only on the path building the rows with `np.arange`
+        start, end = max(start, 0), max(end, 0)
+        order = self.sort_order(order_by) if order_by else None
+        matched = self.filter_rows(filter) if filter else None
+
+        if matched is None:
+            rows = order[start:end] if order is not None else np.arange(start, min(end, len(self.players_df)))
+            return rows, len(self.players_df)
+
+        if order is not None:
+            mask = np.zeros(len(self.players_df), dtype=bool)
+            mask[matched] = True
+            return order[mask[order]][start:end], len(matched)
+
+        return matched[start:end], len(matched)
+
+    def clear_sort_orders(self, columns: Iterable[str] | None = None) -> None:
+        """
+        Forget the computed sort permutations, required after the players data was updated in place.
+        Args:
+            columns: The updated columns whose permutations are forgotten, all of them by default.
+        """
+        if columns is None:
+            self._sort_orders = {}
+            return
+
+        columns = set(columns)
+        self._sort_orders = {key: order for key, order in self._sort_orders.items() if key[0] not in columns}
+
+    def sort_order(self, order_by: str) -> np.ndarray:
+        """
+        Get the permutation of the rows ordering the players by a column, missing values last.
+        Args:
+            order_by: The column to order by, prefixed with `-` for descending order.
+        Raises:
+            ValueError: If the players cannot be ordered by the given column.
+        """
+        is_desc = order_by.startswith("-")
+        column = order_by[1:] if is_desc else order_by
+
+        if column not in SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot order players by '{column}'")
+
+        key = (column, is_desc)
+        order = self._sort_orders.get(key)
+
+        if order is None:
+            sorted_values = self.players_df[column].sort_values(ascending=not is_desc, kind="stable", na_position="last")
+            order = self._sort_orders[key] = sorted_values.index.to_numpy()
+
+        return order
+
+    def filter_rows(self, term: str) -> np.ndarray:
+        """
+        Find the rows of the players whose names contain a term, case-insensitive.
+        Terms of three or more characters are looked up in the trigram index and only the candidate names are checked.
+        Returns:
+            The ascending row positions of the matching players.
+        """
+        term = term.lower()
+
+        if len(term) < 3:
+            return np.flatnonzero([term in name for name in self._names])
+
+        trigrams = self._get_trigrams()
+        postings = sorted((trigrams.get(term[i:i + 3], np.empty(0, dtype=np.intp)) for i in range(len(term) - 2)), key=len)
+        candidates = postings[0]
+
+        for posting in postings[1:]:
+            if len(candidates) == 0:
+                break
+
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+
+        names = self._names
+        return np.array([row for row in candidates.tolist() if term in names[row]], dtype=np.intp)
+
+    def _get_trigrams(self) -> dict[str, np.ndarray]:
+        """Build the trigram index of the names on first use: trigram -> ascending rows containing it"""
+        if self._trigrams is None:
+            postings: dict[str, list[int]] = {}
+
+            for row, name in enumerate(self._names):
+                for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                    postings.setdefault(trigram, []).append(row)
+
+            self._trigrams = {trigram: np.array(rows, dtype=np.intp) for trigram, rows in postings.items()}
+
+        return self._trigrams
@@ -1,51 +1,93 @@
 import pandas as pd
-from core import get_model_path, PagedResult, PagedQuery
+import numpy as np
+from core import PagedResult, PagedQuery, encode_result_json, metrics_registry
+from matchmaking import PlayerStore, get_player_store
 from models import PlayerDto
+from .player_json_cache import PlayerJsonCache, get_player_json_cache
+from .player_query_index import PlayerQueryIndex
+
+QUERY_SECONDS = metrics_registry.histogram("players_query_seconds", "Time spent serving a players query", ("query",))
 
 class PlayerService:
-    players_df: pd.DataFrame
-    is_data_loaded = False
+    def __init__(self, player_store: PlayerStore | None = None) -> None:
+        """
+        Args:
+            player_store: The players data store. Defaults to the store shared by the whole process,
+                followed across hot reloads.
+        """
+        self._player_store = player_store
+        self.json_cache = PlayerJsonCache(player_store) if player_store is not None else get_player_json_cache()
+        self._query_index: PlayerQueryIndex | None = None
+        self._query_index_version = 0
 
-    def load_players(self):
-        if self.is_data_loaded:
-            return
+    @property
+    def player_store(self) -> PlayerStore:
+        """The players data store, the current shared store unless a store was given."""
+        return self._player_store if self._player_store is not None else get_player_store()
 
-        self.players_df = pd.read_csv(get_model_path("clustered_players.csv"))
-        self.is_data_loaded = True
+    @property
+    def players_df(self) -> pd.DataFrame:
+        """The players DataFrame held by the player store."""
+        return self.player_store.players_df
+
+    def load_players(self):
+        self.player_store.load()
 
     def get_player(self, player_id: int) -> PlayerDto | None:
-        self.load_players() # Ensure data is loaded
-        player = self.players_df[self.players_df["profile_id"] == player_id].iloc[0]
+        with QUERY_SECONDS.time("get_player"):
+            self.load_players() # Ensure data is loaded
+            player = self.player_store.get_player(player_id)
 
-        if player is None:
-            return None
+            if player is None:
+                return None
 
-        return self._map_player_to_dto(player)
+            return self._map_player_to_dto(player)
+
+    def get_player_json(self, player_id: int) -> str | None:
+        """
+        Get a player serialized as `PlayerDto` JSON from the players JSON cache.
+        Returns:
+            The JSON of the player, or None if the player does not exist.
+        """
+        with QUERY_SECONDS.time("get_player"):
+            self.load_players() # Ensure data is loaded
+            encoded = self.json_cache.encode_players([player_id])
+            return None if encoded is None else encoded[0]
     
     def get_players(self, paged_query: PagedQuery) -> PagedResult[PlayerDto]:
-        self.load_players() # Ensure data is loaded
-        filtered_df = self.players_df
+        with QUERY_SECONDS.time("get_players"):
+            return self._get_players(paged_query)
 
-        if paged_query.filter:
-            filtered_df = filtered_df.fillna({"name": ""})
-            filter_condition = f"name.str.contains('{paged_query.filter}')"
-            filtered_df = filtered_df.query(filter_condition)
+    def get_players_json(self, paged_query: PagedQuery) -> str:
+        """
+        Get a page of players like `get_players`, serialized as `PagedResult[PlayerDto]` JSON.
+        The players come from the players JSON cache, so no DTO is built or validated.
+        """
+        with QUERY_SECONDS.time("get_players"):
+            self.load_players() # Ensure data is loaded
+            player_store = self.player_store
 
-        items_count = len(filtered_df)
-        page_index = paged_query.page - 1
+            try:
+                rows, items_count, page_index = self._query_page(player_store, paged_query)
+            except ValueError as e:
+                return encode_result_json(PagedResult.fail(str(e)))
 
-        if paged_query.order_by:
-            is_desc = paged_query.order_by.startswith("-")
-            order_by_property = paged_query.order_by[1:] if is_desc else paged_query.order_by
-            filtered_df = filtered_df.sort_values(by=order_by_property, ascending=not is_desc)
+            players_json = "[" + ",".join(self.json_cache.encode_rows(rows, player_store)) + "]"
+            result = PagedResult.succeed(data=[], page_index=page_index, page_size=paged_query.page_size, items_count=items_count)
+            return encode_result_json(result, players_json)
 
-        start = page_index * paged_query.page_size
-        end = start + paged_query.page_size
-        page_data = filtered_df.iloc[start:end]
+    def _get_players(self, paged_query: PagedQuery) -> PagedResult[PlayerDto]:
+        self.load_players() # Ensure data is loaded
+        player_store = self.player_store
+
+        try:
+            rows, items_count, page_index = self._query_page(player_store, paged_query)
+        except ValueError as e:
+            return PagedResult.fail(str(e))
 
         players = [
             self._map_player_to_dto(player)
-            for _, player in page_data.iterrows()
+            for _, player in player_store.players_df.iloc[rows].iterrows()
         ]
 
         return PagedResult.succeed(
@@ -54,6 +96,34 @@ class PlayerService:
             page_size=paged_query.page_size,
             items_count=items_count
         )
+
+    def _query_page(self, player_store: PlayerStore, paged_query: PagedQuery) -> tuple[np.ndarray, int, int]:
+        """
+        Find the rows of the requested page of players.
+        Returns:
+            The rows of the page's players, the total number of players matching the filter and the page index.
+        Raises:
+            ValueError: If the players cannot be ordered by the requested column.
+        """
+        page_index = paged_query.page - 1
+        start = page_index * paged_query.page_size
+        end = start + paged_query.page_size
+        rows, items_count = self._get_query_index(player_store).query(paged_query.filter, paged_query.order_by, start, end)
+        return rows, items_count, page_index
+
+    def _get_query_index(self, player_store: PlayerStore) -> PlayerQueryIndex:
+        """Get the query index of the store's players data, rebuilding it when the data was replaced or updated"""
+        query_index = self._query_index
+        version = player_store.version
+
+        if query_index is None or query_index.players_df is not player_store.players_df:
+            query_index = self._query_index = PlayerQueryIndex(player_store.players_df)
+        elif self._query_index_version != version:
+            # Only the orders of the updated columns are recomputed, the names used by the filter are never updated
+            query_index.clear_sort_orders(player_store.columns_updated_since(self._query_index_version))
+
+        self._query_index_version = version
+        return query_index
     
     def _map_player_to_dto(self, player: pd.Series) -> PlayerDto:
         return PlayerDto(